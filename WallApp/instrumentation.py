@@ -0,0 +1,64 @@
+import time
+
+from django.db.backends.utils import CursorWrapper
+
+# Functions called after every query on a database using InstrumentedDatabaseMixin, with the connection,
+# the SQL, its parameters and how long it took in seconds
+_query_observers = []
+
+
+def add_query_observer(observer):
+    """
+    Call observer(connection, sql, params, duration) after every query, adding the same observer twice does nothing
+    """
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def remove_query_observer(observer):
+    if observer in _query_observers:
+        _query_observers.remove(observer)
+
+
+class InstrumentedCursorWrapper(CursorWrapper):
+    """
+    Times every query run through the cursor, and tells each query observer about it
+    """
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedCursorWrapper, self).execute(sql, params)
+        finally:
+            self.observe(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self.observe(sql, param_list, time.perf_counter() - start)
+
+    def observe(self, sql, params, duration):
+        for observer in list(_query_observers):
+            observer(self.db, sql, params, duration)
+
+
+class InstrumentedDatabaseMixin(object):
+    """
+    Mixin for a database backend's DatabaseWrapper that lets query observers see its queries
+
+    Cursors are only wrapped while there are observers, otherwise this costs one check per cursor
+    """
+
+    def make_cursor(self, cursor):
+        if not _query_observers:
+            return super(InstrumentedDatabaseMixin, self).make_cursor(cursor)
+        return InstrumentedCursorWrapper(cursor, self)
+
+    def make_debug_cursor(self, cursor):
+        # The debug cursor logs queries for connection.queries and the tests, wrap it rather than replace it
+        debug_cursor = super(InstrumentedDatabaseMixin, self).make_debug_cursor(cursor)
+        if not _query_observers:
+            return debug_cursor
+        return InstrumentedCursorWrapper(debug_cursor, self)
@@ -0,0 +1,177 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+from WallApp.instrumentation import add_query_observer
+
+# The queries run by the request the current thread is handling
+_request = threading.local()
+
+
+class Histogram(object):
+    """
+    Counts observations into cumulative buckets, the way Prometheus histograms do
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Each observation goes in the first bucket it fits, the counts are added up when they are exported
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry(object):
+    """
+    Per route request latency, queries per request and time spent in SQL, for this process
+
+    Routes are named after their URL pattern, e.g. post-list or user-detail. Every worker process has its
+    own registry, so have Prometheus scrape each of them.
+    """
+
+    def __init__(self, latency_buckets, query_buckets):
+        self.latency_buckets = latency_buckets
+        self.query_buckets = query_buckets
+        self.requests = defaultdict(int)
+        self.latency = {}
+        self.queries = {}
+        self.query_seconds = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, duration, queries, query_seconds):
+        with self._lock:
+            self.requests[(route, method, str(status))] += 1
+            if (route, method) not in self.latency:
+                self.latency[(route, method)] = Histogram(self.latency_buckets)
+                self.queries[(route, method)] = Histogram(self.query_buckets)
+            self.latency[(route, method)].observe(duration)
+            self.queries[(route, method)].observe(queries)
+            self.query_seconds[(route, method)] += query_seconds
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            lines += ['# HELP wall_requests_total Requests handled.',
+                      '# TYPE wall_requests_total counter']
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines += ['wall_requests_total{} {}'.format(
+                    format_labels(route=route, method=method, status=status), count)]
+            render_histograms(lines, 'wall_request_duration_seconds', 'Time taken to handle a request.',
+                              self.latency)
+            render_histograms(lines, 'wall_request_queries', 'SQL queries run per request.', self.queries)
+            lines += ['# HELP wall_request_query_seconds_total Time spent running SQL queries.',
+                      '# TYPE wall_request_query_seconds_total counter']
+            for (route, method), seconds in sorted(self.query_seconds.items()):
+                lines += ['wall_request_query_seconds_total{} {!r}'.format(
+                    format_labels(route=route, method=method), seconds)]
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(**labels):
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_histograms(lines, name, description, histograms):
+    lines += ['# HELP {} {}'.format(name, description),
+              '# TYPE {} histogram'.format(name)]
+    for (route, method), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + [float('inf')], histogram.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            lines += ['{}_bucket{} {}'.format(name, format_labels(route=route, method=method, le=le), cumulative)]
+        labels = format_labels(route=route, method=method)
+        lines += ['{}_sum{} {!r}'.format(name, labels, float(histogram.sum)),
+                  '{}_count{} {}'.format(name, labels, histogram.count)]
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    Return this process's metrics, configured by settings.METRICS
+    """
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry(latency_buckets=list(settings.METRICS['LATENCY_BUCKETS']),
+                                    query_buckets=list(settings.METRICS['QUERY_BUCKETS']))
+    return _registry
+
+
+@receiver(setting_changed)
+def reload_registry(setting, **kwargs):
+    global _registry
+    if setting == 'METRICS':
+        _registry = None
+
+
+def count_query(connection, sql, params, duration):
+    if getattr(_request, 'active', False):
+        _request.queries += 1
+        _request.query_seconds += duration
+
+
+class MetricsMiddleware(object):
+    """
+    Records how long each request took and the SQL it ran, by route
+
+    Put it first in MIDDLEWARE so the time covers every other middleware. When settings.METRICS['ENABLED']
+    is off Django drops it, and no query is timed.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        add_query_observer(count_query)
+
+    def __call__(self, request):
+        _request.active = True
+        _request.queries = 0
+        _request.query_seconds = 0.0
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.active = False
+        duration = time.perf_counter() - start
+
+        get_registry().observe(self.get_route(request), request.method, response.status_code,
+                               duration, _request.queries, _request.query_seconds)
+        return response
+
+    def get_route(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unmatched'
+        return match.url_name or match.view_name
+
+
+def metrics_view(request):
+    """
+    Every metric in the Prometheus text format, for the addresses in settings.METRICS['ALLOWED_IPS']
+    """
+    options = settings.METRICS
+    if not options['ENABLED']:
+        return HttpResponseNotFound()
+    if options['ALLOWED_IPS'] is not None and request.META.get('REMOTE_ADDR') not in options['ALLOWED_IPS']:
+        return HttpResponseForbidden()
+    return HttpResponse(get_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,104 @@
+import random
+import threading
+from contextlib import contextmanager
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Whether the current thread is handling a request whose reads may go to a replica
+_state = threading.local()
+
+
+def replicas_allowed():
+    return getattr(_state, 'replicas_allowed', False)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Read from the primary inside this block, even in a request that may read from replicas
+    """
+    allowed = replicas_allowed()
+    _state.replicas_allowed = False
+    try:
+        yield
+    finally:
+        _state.replicas_allowed = allowed
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads to one of settings.DATABASE_REPLICAS and everything else to the default (primary) database
+
+    Reads only go to a replica while ReadAfterWriteMiddleware says they may, so management commands,
+    background threads and requests that write all read from the primary. Reads inside a transaction
+    go to the primary too, they have to see what the transaction wrote.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not replicas_allowed():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every database has the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their tables from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReadAfterWriteMiddleware(object):
+    """
+    Lets safe requests read from replicas, except for clients that have written in the last few seconds
+
+    Replicas lag behind the primary, so someone who has just posted could load the wall from a replica and
+    not see their own post. After any successful write, the client's requests read from the primary for
+    READ_AFTER_WRITE['SECONDS']. Clients are told apart by their Authorization header or session cookie,
+    which are remembered (hashed) in one of Django's CACHES. With more than one worker process that cache
+    has to be shared between them, e.g. memcached.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Without replicas everything reads from the primary anyway
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        identity = self.get_identity(request)
+        safe = request.method in ('GET', 'HEAD', 'OPTIONS')
+        _state.replicas_allowed = safe and not self.is_sticky(identity)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.replicas_allowed = False
+
+        if not safe and identity is not None and response.status_code < 400:
+            self.get_cache().set(identity, True, settings.READ_AFTER_WRITE['SECONDS'])
+        return response
+
+    def get_identity(self, request):
+        """
+        Return the cache key that stands for the client making the request, or None for anonymous clients
+        """
+        credentials = (request.META.get('HTTP_AUTHORIZATION') or
+                       request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+        if not credentials:
+            return None
+        return 'wall:primary:{}'.format(md5(credentials.encode('utf-8')).hexdigest())
+
+    def is_sticky(self, identity):
+        return identity is not None and self.get_cache().get(identity) is not None
+
+    def get_cache(self):
+        return caches[settings.READ_AFTER_WRITE['CACHE']]
@@ -47,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it times everything else
+    'WallApp.metrics.MetricsMiddleware',
+    'WallApp.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +58,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'WallApp.routers.ReadAfterWriteMiddleware',
 ]
 
 ROOT_URLCONF = 'WallApp.urls'
@@ -85,9 +89,49 @@ APPEND_SLASH = True
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # Django's SQLite backend, tuned for serving many requests at once, see WallApp/sqlite3/base.py
+        'ENGINE': 'WallApp.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Keep each worker's connection open between requests, for up to 10 minutes
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            # Override any of the pragmas applied to new connections here, e.g. {'synchronous': 'full'}
+            'PRAGMAS': {},
+        },
+    },
+    # A read replica can be added like this, and listed in DATABASE_REPLICAS. To try it out locally with
+    # a second SQLite file, keep the file up to date with python manage.py sync_replicas --interval 1.
+    # Open connections move on to each new copy at their next request, so replica reads are at most --interval
+    # seconds behind plus however long a copy takes. Keep that below READ_AFTER_WRITE['SECONDS'].
+    # 'replica': {
+    #     'ENGINE': 'WallApp.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+    #     'CONN_MAX_AGE': 600,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+# Safe requests read from one of these databases, everything else goes to default, see WallApp/routers.py
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['WallApp.routers.ReplicaRouter']
+
+# Shared by every worker process on this machine, so they agree on the wall version and on who just wrote.
+# With workers on more than one machine, use a cache they can all reach, e.g. memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache'),
+    },
+}
+
+# The tests swap these for caches in memory, so they never see or clear this one, see WallApp/test_runner.py
+TEST_RUNNER = 'WallApp.test_runner.WallTestRunner'
+
+# After a client writes, its requests keep reading from default for this many seconds, so it sees its own
+# writes before the replicas catch up. CACHE is where that is remembered, it has to be shared between workers.
+READ_AFTER_WRITE = {
+    'SECONDS': 10,
+    'CACHE': 'default',
 }
 
 
@@ -132,8 +176,119 @@ STATIC_URL = '/static/'
 REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-    )
+        'accounts.authentication.CachedTokenAuthentication',
+    ),
+    # How many proxies in front of the app add to X-Forwarded-For. Throttles tell clients apart by IP address,
+    # and with this unset DRF believes whatever address the client puts in that header. Behind a proxy, set it
+    # to the number of proxies.
+    'NUM_PROXIES': 0,
+}
+
+# Request latency and SQL per route, served at /metrics for Prometheus, see WallApp/metrics.py
+METRICS = {
+    'ENABLED': True,
+    # Seconds
+    'LATENCY_BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    'QUERY_BUCKETS': [0, 1, 2, 3, 5, 10, 20, 50, 100],
+    # Who may read /metrics, None for anyone
+    'ALLOWED_IPS': ['127.0.0.1'],
+}
+
+# Log queries slower than THRESHOLD seconds with their query plan, and keep the MAX_ENTRIES most recently seen
+# kinds of slow query for admins at /slow-queries/, see WallApp/slow_queries.py
+SLOW_QUERIES = {
+    'ENABLED': False,
+    'THRESHOLD': 0.1,
+    'MAX_ENTRIES': 100,
+    # How many frames of the code that ran the query to keep
+    'STACK_DEPTH': 8,
+}
+
+# Token buckets for requests that write, see accounts/throttling.py. Each client can make CAPACITY requests
+# at once, and then RATE requests a second.
+THROTTLES = {
+    # Creating posts, per user
+    'post': {
+        'CAPACITY': 30,
+        'RATE': 0.5,
+    },
+    # Creating posts with /post/bulk/, per user. Each post takes a token, so CAPACITY is the most posts that
+    # can be made in one go and should be at least PostViewSet.bulk_max_size.
+    'bulk_post': {
+        'CAPACITY': 1000,
+        'RATE': 1000 / 3600,
+    },
+    # Signing up, per IP address. Each signup hashes a password and sends an email.
+    'signup': {
+        'CAPACITY': 5,
+        'RATE': 1 / 60,
+    },
+}
+
+# Which user each token belongs to is remembered for TIMEOUT seconds, see accounts/authentication.py. Each
+# process remembers its own, and CACHE is where they tell each other a user or token changed, it has to be
+# shared between workers.
+TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+    'CACHE': 'default',
+}
+
+# Rendered pages of the wall, see post/cache.py. They are kept in the shared default cache above, so a post
+# changed through one worker is never served stale by another. 'post.cache.LRUWallCache' keeps them in
+# memory instead, which is quicker but only right when there is a single worker process.
+WALL_CACHE = {
+    'BACKEND': 'post.cache.DjangoWallCache',
+    'OPTIONS': {
+        'alias': 'default',
+    },
+    # Only the first few pages are worth keeping when paging by number
+    'PAGES': 5,
+    # How long (in seconds) browsers and proxies may reuse posts fetched anonymously without asking again
+    'MAX_AGE': 5,
+}
+
+# Streams of new posts, see post/events.py
+WALL_EVENTS = {
+    # How many new posts each process remembers for streams that fall behind
+    'BUFFER': 1000,
+    # How many posts are read back from the database at a time for a client that reconnects with Last-Event-ID,
+    # or a stream that falls further behind than BUFFER
+    'CATCH_UP': 1000,
+    # Seconds between keep-alive comments on an idle stream
+    'HEARTBEAT': 15,
+    # Seconds before a stream is ended, and the client told to reconnect after RETRY seconds
+    'MAX_DURATION': 300,
+    'RETRY': 3,
+}
+
+# Emails are queued in the database and sent in the background, see accounts/outbox.py
+OUTBOX = {
+    # 'thread' sends from a background thread in each web process, 'command' leaves it to
+    # `python manage.py send_outbox`, 'eager' sends as soon as an email is committed (for local testing)
+    'MODE': 'thread',
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    # Seconds to wait before trying a failed email again, doubled after every failure
+    'RETRY_DELAY': 30,
+    # Seconds a worker may spend on a batch before other workers assume it died and send it themselves
+    'LEASE': 300,
+    # Seconds between checks for retries that have become due
+    'POLL_INTERVAL': 30,
+}
+
+# Deleted accounts are deactivated straight away, their posts are deleted in the background, see accounts/deletion.py
+ACCOUNT_DELETION = {
+    # 'thread' deletes from a background thread in each web process, 'command' leaves it to
+    # `python manage.py delete_accounts`, 'eager' deletes everything as soon as the deletion is committed
+    # (for local testing)
+    'MODE': 'thread',
+    # How many posts to delete in each transaction, the write lock is held for one batch at a time
+    'BATCH_SIZE': 500,
+    # Seconds a worker may spend on a batch before other workers assume it died and carry on for it
+    'LEASE': 300,
+    # Seconds between checks for deletions left behind by a worker that died
+    'POLL_INTERVAL': 30,
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
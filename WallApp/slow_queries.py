@@ -0,0 +1,225 @@
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.db import DatabaseError
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from WallApp.instrumentation import add_query_observer
+
+logger = logging.getLogger(__name__)
+
+# The view the current thread is running, and whether it is running an EXPLAIN of its own
+_current = threading.local()
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.IGNORECASE)
+PLACEHOLDERS = re.compile(r'%s|\?')
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    Reduce a statement to its shape, so the same query with different values is counted as one
+
+    Literals and placeholders become ?, lists of them become (...)
+    """
+    sql = STRINGS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    sql = PLACEHOLDERS.sub('?', sql)
+    sql = LISTS.sub('(...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+class SlowQueryLog(object):
+    """
+    The slowest kinds of query this process has run, keyed by fingerprint
+
+    Keeps the max_entries fingerprints seen most recently. Each one has how many times it was slow, its total
+    and worst time, an example of the SQL, where it came from and, on SQLite, its query plan.
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, sql, duration, view, stack, explain):
+        """
+        Add a slow query and return its plan, explain() is only called the first time its fingerprint is seen
+        """
+        key = fingerprint(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = OrderedDict([
+                ('fingerprint', key),
+                ('sql', sql),
+                ('plan', explain()),
+                ('count', 0),
+                ('total_time', 0.0),
+                ('max_time', 0.0),
+                ('last_seen', None),
+                ('views', []),
+                ('stack', stack),
+            ])
+
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            entry['count'] += 1
+            entry['total_time'] += duration
+            entry['last_seen'] = time.time()
+            if duration >= entry['max_time']:
+                entry['max_time'] = duration
+                entry['sql'] = sql
+                entry['stack'] = stack
+            if view not in entry['views']:
+                entry['views'].append(view)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry['plan']
+
+    def entries(self):
+        """
+        Return a copy of every entry, the slowest in total first
+        """
+        with self._lock:
+            entries = [OrderedDict(entry, views=list(entry['views'])) for entry in self._entries.values()]
+        return sorted(entries, key=lambda entry: entry['total_time'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_slow_query_log = None
+
+
+def get_slow_query_log():
+    """
+    Return this process's slow query log, configured by settings.SLOW_QUERIES
+    """
+    global _slow_query_log
+    if _slow_query_log is None:
+        _slow_query_log = SlowQueryLog(max_entries=settings.SLOW_QUERIES['MAX_ENTRIES'])
+    return _slow_query_log
+
+
+@receiver(setting_changed)
+def reload_slow_query_log(setting, **kwargs):
+    global _slow_query_log
+    if setting == 'SLOW_QUERIES':
+        _slow_query_log = None
+
+
+def explain(connection, sql, params):
+    """
+    Return SQLite's plan for a SELECT as a list of lines, or None for anything else
+    """
+    if connection.vendor != 'sqlite' or not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    _current.explaining = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError as exc:
+        return ['Could not explain the query: {}'.format(exc)]
+    finally:
+        _current.explaining = False
+
+
+def summarize_stack(depth):
+    """
+    Return the innermost depth frames of the current stack that are in this project, as file:line in function
+    """
+    root = settings.BASE_DIR + os.sep
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename.startswith(root) and 'site-packages' not in frame.filename and
+              frame.filename != __file__ and not frame.filename.endswith('instrumentation.py')]
+    return ['{}:{} in {}'.format(os.path.relpath(frame.filename, root), frame.lineno, frame.name)
+            for frame in frames[-depth:]]
+
+
+def capture_slow_query(connection, sql, params, duration):
+    options = settings.SLOW_QUERIES
+    if not options['ENABLED'] or duration < options['THRESHOLD'] or getattr(_current, 'explaining', False):
+        return
+    view = getattr(_current, 'view', None) or 'outside a request'
+    stack = summarize_stack(options['STACK_DEPTH'])
+    plan = get_slow_query_log().record(sql, duration, view, stack, lambda: explain(connection, sql, params))
+    # On one line, so log aggregators keep it together, and as extra for handlers that format records themselves
+    logger.warning('Slow query (%.3fs) in %s: %s | plan: %s | stack: %s', duration, view, sql,
+                   '; '.join(plan or ['none']), '; '.join(reversed(stack)) or 'none',
+                   extra={'slow_query': {'sql': sql, 'duration': duration, 'view': view, 'plan': plan,
+                                         'stack': stack}})
+
+
+class SlowQueryMiddleware(object):
+    """
+    Captures every query slower than settings.SLOW_QUERIES['THRESHOLD'] seconds, with the view it came from
+
+    Off unless SLOW_QUERIES['ENABLED'], each slow query then also costs an EXPLAIN the first time it is seen.
+    Admins can see what was captured at /slow-queries/.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERIES['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        add_query_observer(capture_slow_query)
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            _current.view = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _current.view = describe_view(request, view_func)
+
+
+def describe_view(request, view_func):
+    """
+    Name a view for people reading the slow query log, e.g. PostViewSet.list
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return '{}.{}'.format(view_func.__module__, view_func.__name__)
+    # Viewsets map each method to an action
+    actions = getattr(view_func, 'actions', None) or {}
+    return '{}.{}'.format(cls.__name__, actions.get(request.method.lower(), request.method.lower()))
+
+
+class SlowQueryView(APIView):
+    """
+    The slow queries this process has captured, slowest in total first. DELETE to start again.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'enabled': settings.SLOW_QUERIES['ENABLED'],
+            'threshold': settings.SLOW_QUERIES['THRESHOLD'],
+            'queries': get_slow_query_log().entries(),
+        })
+
+    def delete(self, request, *args, **kwargs):
+        get_slow_query_log().clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def select_fields(query_params, available):
+    """
+    Return the available fields that ?fields= and ?omit= pick, in the order of available, or None if they pick all
+
+    Both take a comma separated list of field names, fields keeps only those and omit drops them. Picking no
+    fields at all is a ValidationError rather than a response of empty objects.
+    """
+    if query_params.get(FIELDS_PARAM) is None and query_params.get(OMIT_PARAM) is None:
+        return None
+
+    selected, errors = list(available), {}
+    for param in (FIELDS_PARAM, OMIT_PARAM):
+        if query_params.get(param) is None:
+            continue
+        names = [name.strip() for name in query_params[param].split(',') if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if param == FIELDS_PARAM and not names:
+            errors[param] = 'No fields given, choose from {}'.format(', '.join(available))
+        elif unknown:
+            errors[param] = 'Unknown fields {}, choose from {}'.format(', '.join(unknown), ', '.join(available))
+        elif param == FIELDS_PARAM:
+            selected = [name for name in selected if name in names]
+        else:
+            selected = [name for name in selected if name not in names]
+    if not errors and not selected:
+        errors[OMIT_PARAM] = 'Every field was omitted, keep at least one of {}'.format(', '.join(available))
+    if errors:
+        raise ValidationError(errors)
+    return tuple(selected)
+
+
+class SparseFieldsMixin(object):
+    """
+    Viewset mixin that lets read requests ask for only some fields, e.g. ?fields=id,text or ?omit=author
+
+    The picked fields are passed to the serializer in its context, and views can call get_sparse_fields() to
+    skip the columns and joins that only the other fields need
+    """
+
+    def get_sparse_fields(self):
+        """
+        Return the names of the fields the response should have, or None for all of them
+        """
+        if self.request.method not in SAFE_METHODS:
+            return None
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = select_fields(self.request.query_params, self.get_serializer_class().Meta.fields)
+        return self._sparse_fields
+
+    def get_serializer_context(self):
+        context = super(SparseFieldsMixin, self).get_serializer_context()
+        context['fields'] = self.get_sparse_fields()
+        return context
+
+
+class SparseFieldsSerializerMixin(object):
+    """
+    Serializer mixin that only has the fields picked by SparseFieldsMixin
+    """
+
+    def get_fields(self):
+        fields = super(SparseFieldsSerializerMixin, self).get_fields()
+        selected = self.context.get('fields')
+        if selected is None:
+            return fields
+        return OrderedDict((name, field) for name, field in fields.items() if name in selected)
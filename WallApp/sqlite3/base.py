@@ -0,0 +1,101 @@
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+from WallApp.instrumentation import InstrumentedDatabaseMixin
+
+
+class DatabaseWrapper(InstrumentedDatabaseMixin, base.DatabaseWrapper):
+    """
+    Django's SQLite backend, with the pragmas that suit a web server applied to every new connection,
+    and queries that can be watched (see WallApp/instrumentation.py)
+
+    Use it with ENGINE = 'WallApp.sqlite3', and set any of the pragmas differently with OPTIONS['PRAGMAS'].
+    Connections are only worth tuning once they live longer than a request, so set CONN_MAX_AGE as well.
+    """
+    # Which file a replica's connection has open, see close_if_unusable_or_obsolete()
+    replica_file = None
+    pragmas = OrderedDict([
+        # Readers don't block the writer and the writer doesn't block readers, and commits only append to the log
+        ('journal_mode', 'wal'),
+        # In WAL mode a commit is still safe from crashes of the app without syncing on every commit,
+        # only a power cut can lose the last few commits
+        ('synchronous', 'normal'),
+        # Wait up to 5 seconds for another connection's write to finish instead of failing with
+        # "database is locked"
+        ('busy_timeout', 5000),
+        # Read the database through a 256MB memory map instead of copying pages into each connection
+        ('mmap_size', 256 * 1024 * 1024),
+        # Keep about 20MB of pages per connection (negative sizes are in KiB)
+        ('cache_size', -20000),
+        # Temporary tables and indexes, e.g. for sorting, stay in memory
+        ('temp_store', 'memory'),
+    ])
+
+    def get_pragmas(self):
+        """
+        Return the pragmas to apply to new connections, the defaults with OPTIONS['PRAGMAS'] on top
+
+        Replicas are never put in WAL mode. sync_replicas swaps a new copy in for the replica's file, and a
+        write ahead log left next to it would be read as part of the new copy.
+        """
+        pragmas = OrderedDict(self.pragmas)
+        pragmas.update(self.settings_dict['OPTIONS'].get('PRAGMAS', {}))
+        if self.alias in settings.DATABASE_REPLICAS:
+            pragmas['journal_mode'] = 'delete'
+        return pragmas
+
+    def get_connection_params(self):
+        kwargs = super(DatabaseWrapper, self).get_connection_params()
+        # Not an argument of sqlite3.connect()
+        kwargs.pop('PRAGMAS', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        # Before connecting, so that if a new copy is swapped in meanwhile the connection is only ever thought
+        # to be older than it is
+        self.replica_file = self.get_replica_file()
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in self.get_pragmas().items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def get_replica_file(self):
+        """
+        Return what identifies the file behind a replica, which changes whenever sync_replicas swaps in a new copy,
+        or None if this isn't a replica or has no file
+        """
+        if self.alias not in settings.DATABASE_REPLICAS:
+            return None
+        try:
+            stat = os.stat(self.settings_dict['NAME'])
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def close_if_unusable_or_obsolete(self):
+        # A connection that is open while sync_replicas swaps in a new copy keeps reading the old one for as long
+        # as it lives, which with CONN_MAX_AGE is far longer than reads stick to the primary after a write. This
+        # runs at the start and end of every request, so replicas are only ever as far behind as the last copy.
+        if self.connection is not None and self.get_replica_file() != self.replica_file:
+            self.close()
+            return
+        super(DatabaseWrapper, self).close_if_unusable_or_obsolete()
+
+    def active_pragmas(self):
+        """
+        Return the value SQLite reports for each pragma on the current connection, to check they took effect
+
+        Some are reported as numbers, e.g. synchronous = normal is 1. An in memory database, like the one the
+        tests use, reports journal_mode = memory because it has no file to keep a log next to, and no mmap_size
+        at all (None).
+        """
+        active = OrderedDict()
+        with self.cursor() as cursor:
+            for name in self.get_pragmas():
+                cursor.execute('PRAGMA {}'.format(name))
+                row = cursor.fetchone()
+                active[name] = row[0] if row is not None else None
+        return active
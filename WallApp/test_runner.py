@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Every alias in settings.CACHES is swapped for one of these while the tests run
+TEST_CACHE = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+class WallTestRunner(DiscoverRunner):
+    """
+    Runs the tests with caches in memory rather than the project's own caches
+
+    The default cache is on disk and shared with the development server, so without this tests would read
+    whatever the server left there, and clearing the cache in a test would wipe the server's.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(WallTestRunner, self).setup_test_environment(**kwargs)
+        self.cache_override = override_settings(CACHES={
+            alias: dict(TEST_CACHE, LOCATION='test-{}'.format(alias)) for alias in settings.CACHES
+        })
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        super(WallTestRunner, self).teardown_test_environment(**kwargs)
@@ -0,0 +1,394 @@
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from post.cache import get_wall_cache
+from post.management.commands.sync_replicas import copy_database
+from post.models import Post
+from WallApp import instrumentation
+from WallApp.metrics import MetricsMiddleware
+from WallApp.routers import primary_reads, ReadAfterWriteMiddleware
+from WallApp.slow_queries import fingerprint, get_slow_query_log, SlowQueryLog
+from WallApp.sqlite3.base import DatabaseWrapper
+
+
+class SQLiteBackendTest(TestCase):
+    """
+    All tests related to the tuned SQLite backend
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_database(self, pragmas=None, name='db.sqlite3', alias='sqlite_backend_test'):
+        """
+        Return a new connection to a database file of its own, with the same settings as the default database
+        """
+        settings_dict = dict(connection.settings_dict, NAME=os.path.join(self.directory, name),
+                             OPTIONS={'PRAGMAS': pragmas or {}})
+        wrapper = DatabaseWrapper(settings_dict, alias=alias)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_test_database(self):
+        """
+        Make sure that the pragmas are applied to the database the tests run against
+        """
+        active = connection.active_pragmas()
+        self.assertEqual(active['synchronous'], 1, 'synchronous was not normal')
+        self.assertEqual(active['busy_timeout'], 5000, 'busy_timeout was not set')
+        self.assertEqual(active['cache_size'], -20000, 'cache_size was not set')
+        self.assertEqual(active['temp_store'], 2, 'temp_store was not memory')
+        # The test database is in memory, which has no write ahead log
+        self.assertIn(active['journal_mode'], ('wal', 'memory'), 'journal_mode was not set')
+
+    def test_database_file(self):
+        """
+        Make sure that a database file is put in WAL mode, and OPTIONS['PRAGMAS'] overrides the defaults
+        """
+        wrapper = self.open_database(pragmas={'synchronous': 'full'})
+        active = wrapper.active_pragmas()
+        self.assertEqual(active['journal_mode'], 'wal', 'Database file was not in WAL mode')
+        self.assertEqual(active['mmap_size'], 256 * 1024 * 1024, 'mmap_size was not set')
+        self.assertEqual(active['synchronous'], 2, 'OPTIONS did not override synchronous')
+
+    def test_readers_during_write(self):
+        """
+        Make sure that reading isn't blocked by another connection part way through writing
+        """
+        writer = self.open_database()
+        reader = self.open_database()
+        with writer.cursor() as cursor:
+            cursor.execute('CREATE TABLE wall (text TEXT)')
+            cursor.execute("INSERT INTO wall VALUES ('committed')")
+
+        writer.set_autocommit(False)
+        with writer.cursor() as cursor:
+            cursor.execute("INSERT INTO wall VALUES ('not committed')")
+        with reader.cursor() as cursor:
+            cursor.execute('SELECT text FROM wall')
+            self.assertEqual(cursor.fetchall(), [('committed',)], 'Reader was blocked or saw an uncommitted write')
+        writer.rollback()
+
+    def test_copy_database(self):
+        """
+        Make sure that sync_replicas leaves the replica with the same rows as the primary, and that open
+        connections to the replica move on to the new copy between requests
+        """
+        primary = self.open_database()
+        with primary.cursor() as cursor:
+            cursor.execute('CREATE TABLE wall (text TEXT)')
+            cursor.execute("INSERT INTO wall VALUES ('first')")
+        path = os.path.join(self.directory, 'replica.sqlite3')
+        copy_database(primary, path)
+
+        with override_settings(DATABASE_REPLICAS=['replica']):
+            # A replica that is open while a new copy is swapped in
+            reading = self.open_database(name='replica.sqlite3', alias='replica')
+            with reading.cursor() as cursor:
+                cursor.execute('SELECT text FROM wall')
+            self.assertEqual(reading.active_pragmas()['journal_mode'], 'delete', 'Replica was put in WAL mode')
+            self.assertFalse(os.path.exists(path + '-wal'), 'Replica had a write ahead log')
+
+            with primary.cursor() as cursor:
+                cursor.execute("INSERT INTO wall VALUES ('second')")
+            copy_database(primary, path)
+            with reading.cursor() as cursor:
+                cursor.execute('SELECT text FROM wall')
+                self.assertEqual(cursor.fetchall(), [('first',)], 'Open replica did not keep reading its copy')
+            # As happens at the start and end of every request
+            reading.close_if_unusable_or_obsolete()
+            with reading.cursor() as cursor:
+                cursor.execute('SELECT text FROM wall')
+                self.assertEqual(cursor.fetchall(), [('first',), ('second',)],
+                                 'Open replica kept reading the old copy after a request')
+            connection_object = reading.connection
+            reading.close_if_unusable_or_obsolete()
+            self.assertIs(reading.connection, connection_object, 'Replica reconnected without a new copy')
+
+            replica = self.open_database(name='replica.sqlite3', alias='replica')
+            with replica.cursor() as cursor:
+                cursor.execute('SELECT text FROM wall')
+                self.assertEqual(cursor.fetchall(), [('first',), ('second',)],
+                                 'Replica was not a copy of the primary')
+
+
+def read_database(request):
+    """
+    A view that answers with the database posts would be read from
+    """
+    return HttpResponse(router.db_for_read(Post))
+
+
+def primary_database(request):
+    """
+    A view that answers with the database posts would be read from inside primary_reads()
+    """
+    with primary_reads():
+        return HttpResponse(router.db_for_read(Post))
+
+
+def write_database(request):
+    """
+    A view that fails when asked to
+    """
+    return HttpResponse(status=400 if 'fail' in request.GET else 201)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    """
+    All tests related to reading from replicas
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def read(self, token=None):
+        """
+        Return the database a GET would read posts from
+        """
+        extra = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+        response = ReadAfterWriteMiddleware(read_database)(self.factory.get('/post/', **extra))
+        return response.content.decode('utf-8')
+
+    def write(self, token, fail=False):
+        request = self.factory.post('/post/?fail' if fail else '/post/', HTTP_AUTHORIZATION='Token ' + token)
+        return ReadAfterWriteMiddleware(write_database)(request)
+
+    def test_cache_is_in_memory(self):
+        """
+        Make sure that the tests clear a cache of their own rather than the project's cache on disk
+        """
+        self.assertIsInstance(caches['default'], LocMemCache, 'Tests used the project\'s cache')
+
+    def test_reads_and_writes(self):
+        """
+        Make sure that reads in safe requests go to a replica, and everything else to the primary
+        """
+        self.assertEqual(self.read(), 'replica', 'Anonymous read did not go to the replica')
+        self.assertEqual(self.read('token1'), 'replica', 'Read did not go to the replica')
+        response = ReadAfterWriteMiddleware(read_database)(self.factory.post('/post/'))
+        self.assertEqual(response.content, b'default', 'Read in a write request went to the replica')
+        self.assertEqual(router.db_for_read(Post), 'default', 'Read outside a request went to the replica')
+        self.assertEqual(router.db_for_write(Post), 'default', 'Write went to the replica')
+
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.read(), 'default', 'Read went to a replica when there are none')
+
+    def test_primary_reads(self):
+        """
+        Make sure that reads inside primary_reads() go to the primary, and only inside it
+        """
+        response = ReadAfterWriteMiddleware(primary_database)(self.factory.get('/post/'))
+        self.assertEqual(response.content, b'default', 'Read inside primary_reads() went to the replica')
+        self.assertEqual(self.read(), 'replica', 'Reads did not go back to the replica')
+
+    def test_read_after_write(self):
+        """
+        Make sure that a client reads from the primary for a while after it writes
+        """
+        self.write('token1', fail=True)
+        self.assertEqual(self.read('token1'), 'replica', 'Failed write sent reads to the primary')
+
+        self.write('token1')
+        self.assertEqual(self.read('token1'), 'default', 'Read after a write went to the replica')
+        self.assertEqual(self.read('token2'), 'replica', 'Another client\'s write sent reads to the primary')
+        self.assertEqual(self.read(), 'replica', 'Another client\'s write sent reads to the primary')
+
+        cache.clear()
+        self.assertEqual(self.read('token1'), 'replica', 'Reads did not go back to the replica')
+
+
+@override_settings(METRICS=dict(settings.METRICS, ALLOWED_IPS=['127.0.0.1']))
+class MetricsTest(TestCase):
+    """
+    All tests related to the Prometheus metrics
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        get_wall_cache().clear()
+        self.post = Post.objects.create(author=User.objects.create_user(username='metrics', password='metrics1'),
+                                        text='metrics')
+
+    def metrics(self):
+        """
+        Return the metrics, as a dict of each line's name and labels to its value
+        """
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200, 'Could not get the metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'), 'Metrics were not text')
+        lines = [line for line in response.content.decode('utf-8').splitlines() if not line.startswith('#')]
+        return dict(line.rsplit(' ', 1) for line in lines)
+
+    def test_metrics(self):
+        """
+        Make sure that requests are counted, timed and have their queries counted by route
+        """
+        self.client.get('/post/')
+        self.client.get('/post/')
+        self.client.get('/post/{}/'.format(self.post.pk))
+        self.client.post('/api-token-auth/', {'username': 'metrics', 'password': 'metrics1'})
+        metrics = self.metrics()
+
+        self.assertEqual(metrics['wall_requests_total{method="GET",route="post-list",status="200"}'], '2',
+                         'Requests were not counted')
+        self.assertEqual(metrics['wall_requests_total{method="POST",route="obtain_auth_token",status="200"}'], '1',
+                         'Requests for a token were not counted')
+        self.assertEqual(metrics['wall_request_duration_seconds_count{method="GET",route="post-detail"}'], '1',
+                         'Requests were not timed')
+        self.assertEqual(metrics['wall_request_duration_seconds_bucket{le="+Inf",method="GET",route="post-list"}'],
+                         '2', 'Latency buckets did not add up')
+        # A count and a page, then the cached page
+        self.assertEqual(metrics['wall_request_queries_sum{method="GET",route="post-list"}'], '2.0',
+                         'Queries were not counted')
+        self.assertEqual(metrics['wall_request_queries_bucket{le="0.0",method="GET",route="post-list"}'], '1',
+                         'Cached page did not count as no queries')
+        self.assertGreater(float(metrics['wall_request_query_seconds_total{method="GET",route="post-list"}']), 0,
+                           'Queries were not timed')
+
+    def test_metrics_access(self):
+        """
+        Make sure that only allowed addresses can read the metrics, and there are none when they are off
+        """
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403, 'Metrics were shown to anyone')
+
+        with override_settings(METRICS=dict(settings.METRICS, ENABLED=False)):
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 404, 'Metrics were shown when they were off')
+            with self.assertRaises(MiddlewareNotUsed):
+                MetricsMiddleware(lambda request: None)
+
+    def test_no_observers(self):
+        """
+        Make sure that cursors are only wrapped while something is watching queries
+        """
+        with mock.patch.object(instrumentation, '_query_observers', []):
+            with connection.cursor() as cursor:
+                self.assertNotIsInstance(cursor, instrumentation.InstrumentedCursorWrapper,
+                                         'Cursor was wrapped with nothing watching')
+
+            observed = []
+            instrumentation.add_query_observer(lambda *args: observed.append(args))
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            self.assertEqual([args[1] for args in observed], ['SELECT 1'], 'Query was not observed')
+
+
+# Only queries made while capture() is on are slow enough to be captured
+@override_settings(SLOW_QUERIES=dict(settings.SLOW_QUERIES, ENABLED=True, THRESHOLD=60))
+class SlowQueryTest(TestCase):
+    """
+    All tests related to capturing slow queries
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        get_wall_cache().clear()
+        self.user = User.objects.create_user(username='slow', password='slowpassword')
+        self.admin = User.objects.create_superuser(username='slowadmin', email='slow@admin.com',
+                                                   password='slowpassword')
+        self.post = Post.objects.create(author=self.user, text='slow')
+
+    @contextmanager
+    def capture(self):
+        """
+        Capture every query made inside the block, and expect them to be logged
+        """
+        with self.settings(SLOW_QUERIES=dict(settings.SLOW_QUERIES, THRESHOLD=0)):
+            with self.assertLogs('WallApp.slow_queries', level='WARNING') as logs:
+                yield logs
+
+    def login(self, user):
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_capture(self):
+        """
+        Make sure that slow queries are logged with their plan, view and stack, once per fingerprint
+        """
+        with self.capture() as logs:
+            self.client.get('/post/{}/'.format(self.post.pk))
+            self.client.get('/post/{}/'.format(self.post.pk + 1))
+            entries = [entry for entry in get_slow_query_log().entries() if entry['sql'].startswith('SELECT')]
+        self.assertIn('PostViewSet.retrieve', logs.output[0], 'Log did not say which view ran the query')
+        logged = [line for line in logs.output if 'FROM "post_post"' in line]
+        self.assertEqual(len(logged), 2, 'Every slow query was not logged')
+        for line in logged:
+            self.assertRegex(line, r'\| plan: [^|]*post_post', 'Log did not have the query plan')
+            self.assertRegex(line, r'\| stack: .*' + re.escape('post' + os.sep + 'views.py'),
+                             'Log did not have the stack')
+        record = logs.records[logs.output.index(logged[-1])]
+        self.assertEqual(record.slow_query['view'], 'PostViewSet.retrieve', 'Log record did not have the view')
+        self.assertTrue(record.slow_query['plan'] and record.slow_query['stack'],
+                        'Log record did not have the plan and stack')
+
+        self.assertEqual(len(entries), 1, 'Same query with different values was not counted as one')
+        entry = entries[0]
+        self.assertEqual(entry['count'], 2, 'Slow queries were not counted')
+        self.assertEqual(entry['views'], ['PostViewSet.retrieve'], 'Slow query did not have its view')
+        self.assertTrue(any('post_post' in line for line in entry['plan']), 'Slow query was not explained')
+        self.assertTrue(any(line.startswith('post' + os.sep + 'views.py') for line in entry['stack']),
+                        'Slow query did not have a stack')
+
+    def test_fingerprint(self):
+        """
+        Make sure that statements with different values have the same fingerprint
+        """
+        self.assertEqual(fingerprint("SELECT * FROM post_post WHERE id = 12 AND text = 'it''s'"),
+                         fingerprint('SELECT *  FROM post_post\nWHERE id = %s AND text = %s'),
+                         'Values were not taken out of the fingerprint')
+        self.assertEqual(fingerprint('SELECT * FROM post_post WHERE id IN (%s, %s, %s)'),
+                         'SELECT * FROM post_post WHERE id IN (...)', 'Lists were not collapsed')
+
+        log = SlowQueryLog(max_entries=2)
+        for i in range(3):
+            log.record('SELECT {} FROM table{}'.format(i, i), 1.0, 'view', [], lambda: None)
+        self.assertEqual(len(log), 2, 'Log kept more than max_entries fingerprints')
+
+    def test_admin_view(self):
+        """
+        Make sure that only admins can see the slow queries, and can clear them
+        """
+        self.assertEqual(self.client.get('/slow-queries/').status_code, 401, 'Anonymous users saw slow queries')
+        self.login(self.user)
+        self.assertEqual(self.client.get('/slow-queries/').status_code, 403, 'Users saw slow queries')
+
+        self.login(self.admin)
+        with self.capture():
+            self.client.get('/post/')
+            response = self.client.get('/slow-queries/')
+            self.assertEqual(response.status_code, 200, 'Admin could not see slow queries')
+            self.assertIn('PostViewSet.list', [view for query in response.json()['queries'] for view in query['views']],
+                          'Admin did not see the slow queries')
+            self.assertEqual(self.client.delete('/slow-queries/').status_code, 204, 'Admin could not clear them')
+            self.assertEqual(len(get_slow_query_log()), 0, 'Slow queries were not cleared')
@@ -2,6 +2,8 @@ from django.conf.urls import url, include
 from django.contrib import admin
 from rest_framework.schemas import get_schema_view
 from rest_framework.authtoken import views as auth_views
+from WallApp.metrics import metrics_view
+from WallApp.slow_queries import SlowQueryView
 
 schema_view = get_schema_view(title='Pastebin API')
 
@@ -11,5 +13,7 @@ urlpatterns = [
     url(r'', include('accounts.urls')),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^schema/$', schema_view),
-    url(r'^api-token-auth/', auth_views.obtain_auth_token),
+    url(r'^api-token-auth/', auth_views.obtain_auth_token, name='obtain_auth_token'),
+    url(r'^metrics$', metrics_view, name='metrics'),
+    url(r'^slow-queries/$', SlowQueryView.as_view(), name='slow-queries'),
 ]
@@ -1,3 +1,27 @@
 from django.contrib import admin
+from accounts.models import AccountDeletion, OutgoingEmail
 
-# Register your models here.
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to',)
+
+
+@admin.register(AccountDeletion)
+class AccountDeletionAdmin(admin.ModelAdmin):
+    list_display = ('username', 'status', 'progress', 'posts_deleted', 'posts_total', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('username',)
+    readonly_fields = ('user_id', 'username', 'status', 'posts_total', 'posts_deleted', 'created_at', 'run_after',
+                       'finished_at')
+
+    def progress(self, deletion):
+        if deletion.status == AccountDeletion.DONE:
+            return '100%'
+        # The total was the user's post count when the account was deleted, it may have been a little off
+        return '{:.0%}'.format(min(deletion.posts_deleted / deletion.posts_total, 1) if deletion.posts_total else 0)
+
+    def has_add_permission(self, request):
+        return False
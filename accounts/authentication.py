@@ -0,0 +1,141 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache(object):
+    """
+    Remembers which user each token belongs to, for at most timeout seconds and max_entries tokens
+
+    Entries are dropped as soon as their token is deleted or their user changes (see accounts/models.py). Every
+    process has its own entries, so the change is also stamped on the user in the Django cache called shared,
+    which every process checks before using an entry. A cache hit costs that one lookup in the shared cache
+    instead of a query.
+    """
+
+    def __init__(self, max_entries=10000, timeout=60, shared='default'):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def stamp_key(self, user_pk):
+        return 'token-cache:user:{}'.format(user_pk)
+
+    def get(self, key):
+        """
+        Return the (user, token) pair for key, or None if it isn't cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                self._remove(key)
+                entry = None
+        if entry is not None and caches[self.shared].get(self.stamp_key(entry[1].pk)) != entry[3]:
+            # The user or one of their tokens changed, maybe in another process
+            self.forget_token(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, key, user, token):
+        stamp = caches[self.shared].get(self.stamp_key(user.pk))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.time() + self.timeout, user, token, stamp)
+            self._keys_by_user[user.pk].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def forget_token(self, key):
+        """
+        Drop key from this process only
+        """
+        with self._lock:
+            self._remove(key)
+
+    def forget_user(self, user_pk):
+        """
+        Drop every token of the user, in this process and, by stamping the user, in every other one
+        """
+        # Entries never outlive timeout, so the stamp doesn't need to either
+        caches[self.shared].set(self.stamp_key(user_pk), uuid.uuid4().hex, self.timeout + 1)
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_pk, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_user[entry[1].pk]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1].pk]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    """
+    Return this process's token cache, configured by settings.TOKEN_CACHE
+    """
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(max_entries=settings.TOKEN_CACHE['MAX_ENTRIES'],
+                                  timeout=settings.TOKEN_CACHE['TIMEOUT'],
+                                  shared=settings.TOKEN_CACHE['CACHE'])
+    return _token_cache
+
+
+@receiver(setting_changed)
+def reload_token_cache(setting, **kwargs):
+    global _token_cache
+    if setting == 'TOKEN_CACHE':
+        _token_cache = None
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that only goes to the database the first time it sees a token
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cached = cache.get(key)
+        if cached is None:
+            # Raises AuthenticationFailed for unknown tokens and inactive users, neither is cached
+            user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            cache.set(key, user, token)
+        else:
+            user, token = cached
+        # Hand each request its own copy, so nothing a view does to request.user leaks into other requests
+        return copy.copy(user), token
@@ -0,0 +1,68 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def claim_due(queryset, field, lease, limit):
+    """
+    Claim up to limit rows of queryset whose field (a time) has come, and return them
+
+    They are claimed by pushing field back lease seconds, so that another worker running at the same time skips
+    them. If this worker dies they become due again once the lease runs out. Rows another worker claimed first
+    are left out, so fewer than were due can come back.
+    """
+    now = timezone.now()
+    leased_until = now + timedelta(seconds=lease)
+    due = queryset.filter(**{field + '__lte': now})
+    pks = list(due.values_list('pk', flat=True)[:limit])
+    if not pks:
+        return []
+    due.filter(pk__in=pks).update(**{field: leased_until})
+    return list(queryset.filter(pk__in=pks, **{field: leased_until}))
+
+
+class BackgroundJob(object):
+    """
+    Runs run_batch in a background thread of the web process until it returns something falsy
+
+    The thread is started the first time the job is woken up, and otherwise runs every POLL_INTERVAL seconds
+    of settings.<settings_name>, so that work that only becomes due later, or was left behind by a worker
+    that died, is picked up.
+    """
+
+    def __init__(self, name, run_batch, settings_name):
+        self.name = name
+        self.run_batch = run_batch
+        self.settings_name = settings_name
+        self.wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        """
+        Tell the job there is something to do, starting its thread if this process doesn't have one yet
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self._thread.start()
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(getattr(settings, self.settings_name)['POLL_INTERVAL'])
+            self.wakeup.clear()
+            try:
+                while self.run_batch():
+                    pass
+            except Exception:
+                logger.exception('%s failed', self.name)
+            finally:
+                # This thread has its own database connection, don't hold on to it while idle
+                connection.close()
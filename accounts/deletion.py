@@ -0,0 +1,95 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.background import BackgroundJob, claim_due
+from accounts.models import AccountDeletion, Profile
+from post.models import Post
+from post.signals import posts_deleted
+
+logger = logging.getLogger(__name__)
+
+
+def queue_account_deletion(user):
+    """
+    Deactivate and rename user and queue the deletion of their posts and then of the user, as part of the current
+    transaction
+
+    Deleting every post at once would hold the database's write lock for as long as that takes, so they are
+    deleted a batch at a time in the background. How that happens depends on settings.ACCOUNT_DELETION['MODE'].
+    """
+    username = user.username
+    # Free the username straight away so it can be signed up for again, the colon keeps anyone from signing up
+    # with the placeholder
+    user.username = 'deleted:{}'.format(user.pk)
+    user.is_active = False
+    user.save(update_fields=['username', 'is_active'])
+    AccountDeletion.objects.get_or_create(user_id=user.pk, status=AccountDeletion.PENDING, defaults={
+        'username': username,
+        'posts_total': Profile.objects.filter(user=user).values_list('post_count', flat=True).first() or 0,
+    })
+
+    mode = settings.ACCOUNT_DELETION['MODE']
+    if mode == 'eager':
+        # Once the request's transaction is over, so that each batch is still a transaction of its own
+        transaction.on_commit(run_all_account_deletions)
+    elif mode == 'thread':
+        transaction.on_commit(wake_worker)
+
+
+def run_account_deletions(batch_size=None):
+    """
+    Delete one batch of posts for the account deletion that is due first, or its user once the posts are gone
+
+    Each batch is its own transaction, so other writes get a turn in between. Returns whether there was
+    anything to do, so callers can keep going until there isn't.
+    """
+    options = settings.ACCOUNT_DELETION
+    batch_size = batch_size or options['BATCH_SIZE']
+
+    claimed = claim_due(AccountDeletion.objects.filter(status=AccountDeletion.PENDING), 'run_after',
+                        options['LEASE'], 1)
+    if not claimed:
+        return False
+    deletion = claimed[0]
+
+    with transaction.atomic():
+        pks = list(Post.objects.filter(author_id=deletion.user_id).values_list('pk', flat=True)[:batch_size])
+        if pks:
+            deleted = Post.objects.filter(pk__in=pks).fast_delete()
+            posts_deleted.send(sender=Post, pks=pks, author_ids=[deletion.user_id] * len(pks))
+            # Due again straight away, after any other deletions that were waiting
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                posts_deleted=F('posts_deleted') + deleted, run_after=timezone.now())
+        else:
+            # Nothing big is left to cascade to
+            get_user_model().objects.filter(pk=deletion.user_id).delete()
+            AccountDeletion.objects.filter(pk=deletion.pk).update(
+                status=AccountDeletion.DONE, finished_at=timezone.now())
+            logger.info('Deleted %s', deletion.username)
+    return True
+
+
+def run_all_account_deletions():
+    """
+    Run account deletions a batch at a time until there are none left that are due
+    """
+    while run_account_deletions():
+        pass
+
+
+# Deletes accounts' posts in a background thread of the web process. It is woken up whenever an account is
+# deleted, and otherwise checks every POLL_INTERVAL seconds so that deletions left behind by a worker that died
+# are picked up again.
+worker = BackgroundJob('account-deletion-worker', run_account_deletions, 'ACCOUNT_DELETION')
+
+
+def wake_worker():
+    """
+    Tell the account deletion worker there is something to delete, starting it if this process doesn't have one yet
+    """
+    worker.wake()
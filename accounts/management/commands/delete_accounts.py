@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.deletion import run_account_deletions
+
+
+class Command(BaseCommand):
+    help = ('Delete the posts and then the users of deleted accounts, for running account deletion as its own '
+            'process (ACCOUNT_DELETION[\'MODE\'] = \'command\')')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Delete everything that is due, then exit instead of waiting for more')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when there is nothing to delete')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='How many posts to delete in each transaction')
+
+    def handle(self, *args, **options):
+        batches = 0
+        while True:
+            if run_account_deletions(options['batch_size']):
+                batches += 1
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write('Ran {} batches'.format(batches))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.throttling import prune_buckets
+
+
+class Command(BaseCommand):
+    help = 'Delete the throttle buckets that have filled back up, so there isn\'t a row for every client ever seen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Prune once, then exit instead of pruning again later')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds to wait between prunes')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = prune_buckets()
+            if options['verbosity'] > 1 or options['once']:
+                self.stdout.write('Deleted {} buckets'.format(deleted))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
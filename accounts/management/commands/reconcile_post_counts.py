@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import reconcile_post_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount every user\'s posts and fix the post counts that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='How many users to check at a time')
+
+    def handle(self, *args, **options):
+        checked = fixed = created = 0
+        for batch in reconcile_post_counts(options['batch_size']):
+            checked, fixed, created = (total + n for total, n in zip((checked, fixed, created), batch))
+            if options['verbosity'] > 1:
+                self.stdout.write('Checked {} users'.format(checked))
+        self.stdout.write('Checked {} users, fixed {} post counts and created {} profiles'.format(
+            checked, fixed, created))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Send emails waiting in the outbox, for running the outbox as its own process (OUTBOX[\'MODE\'] = \'command\')'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Send everything that is due, then exit instead of waiting for more')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='How many emails to send over each connection to the mail server')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            sent = send_queued_emails(options['batch_size'])
+            total += sent
+            if sent:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write('Sent {} emails'.format(total))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 17:01
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def create_profiles(apps, schema_editor):
+    # Signal receivers don't run in migrations, so existing users get their profiles and post counts here
+    User = apps.get_model('auth', 'User')
+    Post = apps.get_model('post', 'Post')
+    Profile = apps.get_model('accounts', 'Profile')
+    counts = dict(Post.objects.order_by().values_list('author_id').annotate(Count('id')))
+    user_pks = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(user_pks), 1000):
+        Profile.objects.bulk_create([Profile(user_id=pk, post_count=counts.get(pk, 0))
+                                     for pk in user_pks[start:start + 1000]])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0008_alter_user_username_max_length'),
+        ('accounts', '0003_throttlebucket'),
+        ('post', '0004_post_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='profile', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_profiles, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,202 @@
-from django.db.models.signals import post_save
+from collections import Counter
+
+from django.db import models, transaction
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 from django.conf import settings
+from accounts.authentication import get_token_cache
+from post.models import Post
+from post.signals import posts_created, posts_deleted
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+        Token.objects.create(user=instance)
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_cached_user(sender, instance=None, **kwargs):
+    # The user may have been deactivated or had their permissions changed, so look them up again next time
+    forget_user(instance.pk)
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def forget_cached_token(sender, instance=None, **kwargs):
+    get_token_cache().forget_token(instance.key)
+    # Other processes only hear about it through the user
+    forget_user(instance.user_id)
+
+def forget_user(user_pk):
+    # Forget now, so this process stops using the old user, and again once the change is committed, in case
+    # another request cached the old row in between
+    get_token_cache().forget_user(user_pk)
+    transaction.on_commit(lambda: get_token_cache().forget_user(user_pk))
+
+
+class OutgoingEmail(models.Model):
+    """
+    An email waiting in the outbox, it is sent in the background by accounts/outbox.py
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.EmailField()
+    to = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # The email isn't sent before this, it is pushed back while a worker is sending it and after each failure
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('send_after', 'id')
+        indexes = [
+            # Emails that are due to be sent, in order
+            models.Index(fields=['status', 'send_after'], name='accounts_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{} to {}'.format(self.subject, self.to)
+
+
+class ThrottleBucket(models.Model):
+    """
+    A token bucket for one client and one kind of request, see accounts/throttling.py
+
+    Rows are only needed while a client has used some of its tokens, rows for full buckets are deleted by
+    manage.py prune_throttle_buckets
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    tokens = models.FloatField()
+    # When tokens was last worked out, in seconds since the epoch
+    updated_at = models.FloatField()
+
+    def __str__(self):
+        return self.key
+
+
+class Profile(models.Model):
+    """
+    What we keep about a user besides their account, created when there is something to keep
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True, related_name='profile',
+                                on_delete=models.CASCADE)
+    # How many posts the user has, so showing it never counts them. Kept up to date by add_post_counts,
+    # manage.py reconcile_post_counts repairs it if it ever drifts.
+    post_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.user)
+
+
+def add_post_counts(changes):
+    """
+    Add to users' post counts, changes maps each user's pk to how many posts they gained (or lost, if negative)
+
+    Each count is changed with one UPDATE of post_count + change, so concurrent writers never lose a change.
+    A user without a profile, e.g. one created in bulk, gets one counted from scratch when they gain posts.
+    """
+    for user_pk, change in changes.items():
+        if not change:
+            continue
+        updated = Profile.objects.filter(user_id=user_pk).update(post_count=F('post_count') + change)
+        # Not when losing posts, the user may be being deleted along with their profile
+        if not updated and change > 0:
+            Profile.objects.get_or_create(user_id=user_pk, defaults={
+                'post_count': Post.objects.filter(author_id=user_pk).count(),
+            })
+
+
+def reconcile_post_counts(batch_size=1000):
+    """
+    Recount every user's posts, batch_size users at a time, fixing wrong counts and creating missing profiles
+
+    Yields how many users were checked, counts fixed and profiles created in each batch. A count is only fixed
+    if it hasn't changed since it was checked, one that did is left for the next run rather than overwritten.
+    """
+    last_pk = 0
+    while True:
+        # Each user's stored and actual count, read in one query so they agree with each other
+        users = list(get_user_model().objects.filter(pk__gt=last_pk).order_by('pk')
+                     .annotate(actual=Count('posts')).values_list('pk', 'profile__post_count', 'actual')[:batch_size])
+        if not users:
+            return
+        last_pk = users[-1][0]
+
+        fixed = created = 0
+        for user_pk, post_count, actual in users:
+            if post_count is None:
+                created += Profile.objects.get_or_create(user_id=user_pk, defaults={'post_count': actual})[1]
+            elif post_count != actual:
+                fixed += Profile.objects.filter(user_id=user_pk, post_count=post_count).update(post_count=actual)
+        yield len(users), fixed, created
+
+
+@receiver(post_save, sender=Post)
+def count_created_post(sender, instance=None, created=False, raw=False, **kwargs):
+    if created and not raw:
+        add_post_counts({instance.author_id: 1})
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance=None, **kwargs):
+    add_post_counts({instance.author_id: -1})
+
+
+@receiver(posts_created, sender=Post)
+def count_created_posts(sender, posts=(), **kwargs):
+    add_post_counts(Counter(post.author_id for post in posts))
+
+
+@receiver(posts_deleted, sender=Post)
+def count_deleted_posts(sender, author_ids=(), **kwargs):
+    add_post_counts({author_pk: -count for author_pk, count in Counter(author_ids).items()})
+
+
+class AccountDeletion(models.Model):
+    """
+    A deleted account whose posts are being deleted in the background by accounts/deletion.py
+
+    The user is deactivated straight away, and deleted once all of their posts are. This isn't a foreign key
+    to the user, so admins can still see how it went after the user is gone.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+    )
+
+    user_id = models.IntegerField(db_index=True)
+    username = models.CharField(max_length=150)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    posts_total = models.PositiveIntegerField(default=0)
+    posts_deleted = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # The next batch isn't deleted before this, it is pushed back while a worker is deleting one
+    run_after = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('run_after', 'id')
+        indexes = [
+            # Deletions that are due to run, in order
+            models.Index(fields=['status', 'run_after'], name='accounts_deletion_due_idx'),
+        ]
+
+    def __str__(self):
+        return 'Deleting {}'.format(self.username)
@@ -0,0 +1,100 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.background import BackgroundJob, claim_due
+from accounts.models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, message, from_email, recipient_list):
+    """
+    Put an email in the outbox, takes the same arguments as django.core.mail.send_mail
+
+    The email is saved as part of the current transaction, so it is only sent if that transaction commits,
+    and the request doesn't wait on the mail server. How it gets sent depends on settings.OUTBOX['MODE'].
+    """
+    OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(subject=subject, body=message, from_email=from_email, to=recipient)
+        for recipient in recipient_list
+    ])
+
+    mode = settings.OUTBOX['MODE']
+    if mode == 'eager':
+        # Still only once the email is committed, an email can't be taken back if the transaction rolls back
+        transaction.on_commit(send_queued_emails)
+    elif mode == 'thread':
+        transaction.on_commit(wake_worker)
+
+
+def send_queued_emails(batch_size=None):
+    """
+    Send one batch of emails that are due, over a single connection to the mail server
+
+    Returns how many emails were tried, so callers can keep going until there is nothing left
+    """
+    options = settings.OUTBOX
+    batch_size = batch_size or options['BATCH_SIZE']
+    batch = claim_due(OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING), 'send_after', options['LEASE'],
+                      batch_size)
+    if not batch:
+        return 0
+
+    mail_connection = get_connection(fail_silently=False)
+    try:
+        mail_connection.open()
+    except Exception as exc:
+        for email in batch:
+            retry_email(email, exc)
+        return len(batch)
+
+    sent = []
+    try:
+        for email in batch:
+            try:
+                mail_connection.send_messages([
+                    EmailMessage(email.subject, email.body, email.from_email, [email.to])
+                ])
+            except Exception as exc:
+                retry_email(email, exc)
+            else:
+                sent += [email.pk]
+    finally:
+        mail_connection.close()
+
+    OutgoingEmail.objects.filter(pk__in=sent).update(status=OutgoingEmail.SENT, sent_at=timezone.now())
+    return len(batch)
+
+
+def retry_email(email, exc):
+    """
+    Record a failed attempt to send an email, and put it back in the outbox with a longer wait each time
+    """
+    options = settings.OUTBOX
+    email.attempts += 1
+    email.last_error = repr(exc)
+    if email.attempts >= options['MAX_ATTEMPTS']:
+        email.status = OutgoingEmail.FAILED
+        logger.error('Giving up on sending %s after %d attempts: %r', email, email.attempts, exc)
+    else:
+        delay = options['RETRY_DELAY'] * 2 ** (email.attempts - 1)
+        email.send_after = timezone.now() + timedelta(seconds=delay)
+        logger.warning('Could not send %s, retrying in %d seconds: %r', email, delay, exc)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'send_after'])
+
+
+# Sends emails from the outbox in a background thread of the web process. It is woken up whenever a transaction
+# queues an email, and otherwise checks every POLL_INTERVAL seconds so that retries go out once they are due.
+worker = BackgroundJob('outbox-worker', send_queued_emails, 'OUTBOX')
+
+
+def wake_worker():
+    """
+    Tell the outbox worker there is something to send, starting it if this process doesn't have one yet
+    """
+    worker.wake()
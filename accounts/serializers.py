@@ -1,8 +1,19 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from accounts.models import Profile
+from WallApp.sparse_fields import SparseFieldsSerializerMixin
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
-    posts = serializers.HyperlinkedRelatedField(many=True, view_name='post-detail', read_only=True)
+class UserSerializer(SparseFieldsSerializerMixin, serializers.HyperlinkedModelSerializer):
+    # A link to the user's posts a page at a time, listing every one of them here made heavy posters' accounts huge
+    posts = serializers.HyperlinkedIdentityField(view_name='user-posts')
+    post_count = serializers.SerializerMethodField()
+
+    def get_post_count(self, user):
+        try:
+            return user.profile.post_count
+        except Profile.DoesNotExist:
+            # Users get a profile with their first post
+            return 0
 
     def create(self, validated_data):
         instance = User.objects.create_user(**validated_data)
@@ -10,4 +21,4 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = User
-        fields = ('url', 'id', 'username', 'password', 'email', 'posts')
\ No newline at end of file
+        fields = ('url', 'id', 'username', 'password', 'email', 'post_count', 'posts')
\ No newline at end of file
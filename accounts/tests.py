@@ -1,12 +1,31 @@
 from django.contrib.auth.models import User
 import json
-from django.test import TestCase
+from django.test import Client, TestCase
 from rest_framework import status
 from WallApp.test_utils import *
 from django.core import mail
 from accounts.email_info import *
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
+from post.models import Post
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from accounts.authentication import get_token_cache, TokenCache
+from accounts.models import AccountDeletion, OutgoingEmail, Profile, ThrottleBucket
+from accounts.background import BackgroundJob, claim_due
+from accounts.deletion import run_account_deletions
+from accounts.outbox import queue_email, send_queued_emails
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.test import override_settings
+from django.utils import timezone
+from accounts.throttling import prune_buckets, take_token
+from unittest import mock
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
 
 
 global WELCOME_EMAIL_SUBJECT
@@ -82,6 +101,14 @@ class AccountsTest(TestCase):
             # Check that information is correct
             user = User.objects.get(username=USERNAMES[i])
             self.assertEqual(EMAILS[i], user.email, 'Account did not contain the correct email address after creation')
+            self.assertTrue(response['Location'].endswith('/accounts/{}/'.format(user.pk)),
+                            'Response did not link to the new account')
+
+            # Check that the welcome email was queued rather than sent during the request
+            self.assertEqual(len(mail.outbox), i, 'Email was sent before the response instead of in the background')
+            self.assertEqual(OutgoingEmail.objects.filter(to=EMAILS[i], status=OutgoingEmail.PENDING).count(), 1,
+                             'Email was not queued')
+            send_queued_emails()
 
             #Check that the welcome email was sent
             self.assertEqual(len(mail.outbox), i+1, 'Outbox does not containt the correct number of emails, Email may not have been sent')
@@ -134,7 +161,6 @@ class AccountsTest(TestCase):
 
         self.logout()
 
-
     def test_delete_account(self):
         """
         Make sure that only users can delete their own accounts and admins can delete all accounts
@@ -224,3 +250,650 @@ class AccountsTest(TestCase):
             self.assertNotEqual(response.status_code, status.HTTP_200_OK,
                              'Admin was able to edit a user\'s account')
         self.logout()
+
+
+class AccountsQueryBudgetTest(TestCase):
+    """
+    Make sure that the account endpoints run a fixed number of queries, however many posts the user has
+
+    If one of these fails, something has started loading related objects one at a time (N+1 queries)
+    """
+
+    # Authenticating with a token takes one query (the token joined with its user) the first time it is used
+    QUERY_BUDGETS = {
+        'retrieve': 2,       # token + user with its post count
+        'posts': 2,          # user + a page of posts
+    }
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        for text in POSTS * 5:
+            Post.objects.create(author=self.user, text=text)
+
+    def test_retrieve_budget(self):
+        """
+        Make sure getting an account counts its posts in the same query
+        """
+        token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        with self.assertNumQueries(self.QUERY_BUDGETS['retrieve']):
+            response = self.client.get('/accounts/{}/'.format(self.user.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Test user could not view it\'s own account details')
+        self.assertEqual(response.json()['post_count'], len(POSTS * 5), 'Account did not count its posts')
+
+    def test_posts_budget(self):
+        """
+        Make sure getting a page of a user's posts takes the same queries however many they have
+        """
+        with self.assertNumQueries(self.QUERY_BUDGETS['posts']):
+            response = self.client.get('/accounts/{}/posts/'.format(self.user.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get a user\'s posts')
+
+
+class UserPostsTest(TestCase):
+    """
+    All tests related to reading one user's posts
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.other = User.objects.create_user(username=USERNAMES[1], email=EMAILS[1], password=PASSWORDS[1])
+        for text in POSTS * 5:
+            Post.objects.create(author=self.user, text=text)
+            Post.objects.create(author=self.other, text=text)
+
+    def test_account_links_to_posts(self):
+        """
+        Make sure that an account has a link to its posts instead of listing them
+        """
+        token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get('/accounts/{}/'.format(self.user.pk))
+        self.assertTrue(response.json()['posts'].endswith('/accounts/{}/posts/'.format(self.user.pk)),
+                        'Account did not link to its posts')
+
+    def test_walk_posts(self):
+        """
+        Make sure that following the next links gives every one of the user's posts once, in order, to anyone
+        """
+        url, ids = '/accounts/{}/posts/'.format(self.user.pk), []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get a user\'s posts')
+            self.assertNotIn('count', response.json(), 'User\'s posts were paged by number')
+            ids += [post['id'] for post in response.json()['results']]
+            url = response.json()['next']
+        expected = list(Post.objects.filter(author=self.user).values_list('id', flat=True))
+        self.assertEqual(ids, expected, 'Did not get every one of the user\'s posts in order')
+
+        response = self.client.get('/accounts/0/posts/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Got posts for a user who doesn\'t exist')
+
+    def test_sparse_fields(self):
+        """
+        Make sure that an account and its posts can be asked for only some fields, without reading the others
+        """
+        token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/accounts/{}/?fields=id,username'.format(self.user.pk))
+        self.assertEqual(response.json(), {'id': self.user.pk, 'username': USERNAMES[0]}, 'Account was not pruned')
+        self.assertNotIn('accounts_profile', queries[-1]['sql'], 'Profile was read without being asked for')
+        response = self.client.get('/accounts/{}/?omit=posts'.format(self.user.pk))
+        self.assertNotIn('posts', response.json(), 'Account was not pruned')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/accounts/{}/posts/?omit=author'.format(self.user.pk))
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'posted_at', 'text'], 'Posts were not pruned')
+        self.assertNotIn('auth_user', queries[-1]['sql'], 'Posts joined their author without being asked for')
+
+    def test_posts_use_index(self):
+        """
+        Make sure that a page of a user's posts seeks through the author index instead of scanning every post
+        """
+        response = self.client.get('/accounts/{}/posts/'.format(self.user.pk))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.json()['next'])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[-1]['sql'])
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('post_author_posted_at_idx', plan, 'User\'s posts did not use the author index')
+
+
+class PostCountTest(TestCase):
+    """
+    All tests related to keeping count of each user's posts
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.admin = User.objects.create_superuser(username=ADMIN_USERNAME, email=ADMIN_EMAIL,
+                                                   password=ADMIN_PASSWORD)
+
+    def login(self, user):
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def post_count(self):
+        self.login(self.user)
+        return self.client.get('/accounts/{}/'.format(self.user.pk)).json()['post_count']
+
+    def test_counts_follow_writes(self):
+        """
+        Make sure that every way of making and deleting posts keeps the count right
+        """
+        self.assertEqual(self.post_count(), 0, 'New user had posts')
+        self.login(self.user)
+        self.client.post('/post/', {'text': POSTS[0]})
+        self.client.post('/post/bulk/', json.dumps([{'text': text} for text in POSTS]), content_type='application/json')
+        Post.objects.create(author=self.user, text=POSTS[0])
+        self.assertEqual(self.post_count(), 5, 'Created posts were not counted')
+
+        pks = list(Post.objects.filter(author=self.user).values_list('pk', flat=True))
+        self.client.delete('/post/{}/'.format(pks[0]))
+        self.login(self.admin)
+        self.client.delete('/post/{}/'.format(pks[1]))
+        Post.objects.get(pk=pks[2]).delete()
+        Post.objects.filter(pk=pks[3]).delete()
+        self.assertEqual(self.post_count(), 1, 'Deleted posts were not counted')
+        self.assertFalse(Profile.objects.filter(user=self.admin).exists(), 'Admin was counted for deleting a post')
+
+        self.user.delete()
+        self.assertFalse(Profile.objects.filter(user_id=self.user.pk).exists(), 'Profile outlived its user')
+
+    def test_missing_profile(self):
+        """
+        Make sure that a user without a profile gets one counted from scratch with their next post
+        """
+        Post.objects.bulk_create([Post(author=self.user, text=text) for text in POSTS])
+        Post.objects.create(author=self.user, text=POSTS[0])
+        self.assertEqual(Profile.objects.get(user=self.user).post_count, 4, 'Profile was not counted from scratch')
+
+    def test_reconcile(self):
+        """
+        Make sure that reconcile_post_counts fixes counts that have drifted, and creates missing profiles
+        """
+        for text in POSTS:
+            Post.objects.create(author=self.user, text=text)
+            Post.objects.create(author=self.admin, text=text)
+        Profile.objects.filter(user=self.user).update(post_count=99)
+        Profile.objects.filter(user=self.admin).delete()
+
+        stdout = StringIO()
+        call_command('reconcile_post_counts', batch_size=1, stdout=stdout)
+        self.assertEqual(Profile.objects.get(user=self.user).post_count, len(POSTS), 'Count was not fixed')
+        self.assertEqual(Profile.objects.get(user=self.admin).post_count, len(POSTS), 'Profile was not created')
+        self.assertIn('fixed 1 post counts and created 1 profiles', stdout.getvalue(), 'Wrong summary')
+
+        stdout = StringIO()
+        call_command('reconcile_post_counts', stdout=stdout)
+        self.assertIn('fixed 0 post counts', stdout.getvalue(), 'Right counts were changed')
+
+
+class AccountDeletionTest(TestCase):
+    """
+    All tests related to deleting accounts in the background
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.other = User.objects.create_user(username=USERNAMES[1], email=EMAILS[1], password=PASSWORDS[1])
+        for text in POSTS * 3:
+            Post.objects.create(author=self.user, text=text)
+        Post.objects.create(author=self.other, text=POSTS[0])
+        self.token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_delete_in_batches(self):
+        """
+        Make sure that deleting an account deactivates it at once, and deletes its posts a batch at a time
+        """
+        response = self.client.delete('/accounts/{}/'.format(self.user.pk))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT, 'Could not delete the account')
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active, 'Account was not deactivated')
+        self.assertEqual(AccountDeletion.objects.get(user_id=self.user.pk).username, USERNAMES[0],
+                         'Deletion did not keep the username for admins')
+        response = self.client.post('/post/', {'text': POSTS[0]})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, 'Deleted account could still post')
+
+        deletion = AccountDeletion.objects.get(user_id=self.user.pk)
+        self.assertEqual((deletion.posts_total, deletion.posts_deleted), (9, 0), 'Posts were deleted in the request')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(run_account_deletions(batch_size=4), 'Nothing was deleted')
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 1,
+                         'A batch was not deleted with one DELETE')
+        self.assertEqual(AccountDeletion.objects.get(pk=deletion.pk).posts_deleted, 4, 'Progress was not recorded')
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 5, 'Wrong number of posts deleted')
+
+        while run_account_deletions(batch_size=4):
+            pass
+        deletion = AccountDeletion.objects.get(pk=deletion.pk)
+        self.assertEqual((deletion.status, deletion.posts_deleted), (AccountDeletion.DONE, 9), 'Deletion did not finish')
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists(), 'User was not deleted')
+        self.assertEqual(Post.objects.filter(author=self.other).count(), 1, 'Another user\'s posts were deleted')
+
+    def test_posts_are_hidden(self):
+        """
+        Make sure that a deleted account's posts leave the wall straight away, before they are deleted
+        """
+        # Leave only this test's posts, which all fit on the first page
+        Post.objects.exclude(author__in=[self.user, self.other]).delete()
+        self.client.delete('/accounts/{}/'.format(self.user.pk))
+        self.client.credentials()
+        urls = ('/post/', '/post/?pagination=cursor', '/post/?fields=id', '/accounts/{}/posts/'.format(self.user.pk))
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get {}'.format(url))
+            self.assertEqual([post['id'] for post in response.json()['results']],
+                             [] if url.startswith('/accounts/') else [Post.objects.get(author=self.other).pk],
+                             '{} showed posts of a deleted account'.format(url))
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 9, 'Posts were deleted in the request')
+
+    @override_settings(ACCOUNT_DELETION=dict(settings.ACCOUNT_DELETION, MODE='eager'))
+    def test_eager_mode(self):
+        """
+        Make sure that eager mode deletes everything once the deletion is committed, not inside the request
+        """
+        # Tests run inside a transaction that never commits, so run what would happen on commit by hand
+        with mock.patch('accounts.deletion.transaction.on_commit') as on_commit:
+            self.client.delete('/accounts/{}/'.format(self.user.pk))
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 9, 'Posts were deleted in the request')
+        for args, kwargs in on_commit.call_args_list:
+            args[0]()
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists(), 'Account was not deleted on commit')
+
+    def test_username_is_freed(self):
+        """
+        Make sure that a deleted account's username can be signed up for again before its posts are gone
+        """
+        self.client.delete('/accounts/{}/'.format(self.user.pk))
+        self.client.credentials()
+        response = self.client.post('/accounts/', {'username': USERNAMES[0], 'email': EMAILS[0],
+                                                   'password': PASSWORDS[0]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Username was still taken')
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 9, 'Posts were deleted in the request')
+        self.assertEqual(Post.objects.filter(author__username=USERNAMES[0]).count(), 0,
+                         'New account was given the deleted account\'s posts')
+
+    def test_claimed_deletion_is_skipped(self):
+        """
+        Make sure that a deletion another worker is running is left alone until its lease runs out
+        """
+        self.client.delete('/accounts/{}/'.format(self.user.pk))
+        AccountDeletion.objects.update(run_after=timezone.now() + timedelta(seconds=60))
+        self.assertFalse(run_account_deletions(), 'Ran a deletion another worker had claimed')
+
+        call_command('delete_accounts', once=True, stdout=StringIO())
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 9, 'Command ran a claimed deletion')
+        AccountDeletion.objects.update(run_after=timezone.now())
+        call_command('delete_accounts', once=True, stdout=StringIO())
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists(), 'Command did not finish the deletion')
+
+    def test_admin_progress(self):
+        """
+        Make sure that admins can see how far each deletion has got
+        """
+        self.client.delete('/accounts/{}/'.format(self.user.pk))
+        run_account_deletions(batch_size=3)
+        User.objects.create_superuser(username=ADMIN_USERNAME, email=ADMIN_EMAIL, password=ADMIN_PASSWORD)
+        client = Client()
+        client.login(username=ADMIN_USERNAME, password=ADMIN_PASSWORD)
+        response = client.get('/admin/accounts/accountdeletion/')
+        self.assertContains(response, '33%', msg_prefix='Admin did not show the progress')
+
+
+class OutboxTest(TestCase):
+    """
+    All tests related to sending emails from the outbox
+    """
+
+    def queue_test_emails(self):
+        for i in range(N_TEST_USERS):
+            queue_email(WELCOME_EMAIL_SUBJECT, WELCOME_EMAIL_MESSAGE, COMPANY_EMAIL, [EMAILS[i]])
+
+    def test_send_in_batches(self):
+        """
+        Make sure that emails are sent a batch at a time, and only once
+        """
+        self.queue_test_emails()
+
+        self.assertEqual(send_queued_emails(batch_size=2), 2, 'Did not send a full batch')
+        self.assertEqual(len(mail.outbox), 2, 'Batch was not sent')
+        self.assertEqual(send_queued_emails(batch_size=2), 1, 'Did not send the rest of the emails')
+        self.assertEqual(send_queued_emails(batch_size=2), 0, 'Sent emails were sent again')
+        self.assertEqual([email.to for email in mail.outbox], [[email] for email in EMAILS],
+                         'Emails were not sent to the right addresses')
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), N_TEST_USERS,
+                         'Sent emails were not marked as sent')
+
+    def test_claimed_batch_is_skipped(self):
+        """
+        Make sure that emails another worker has claimed are left alone until its lease runs out
+        """
+        self.queue_test_emails()
+        pending = OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING)
+        self.assertEqual(len(claim_due(pending, 'send_after', 60, 2)), 2, 'Did not claim a full batch')
+        self.assertEqual([email.to for email in claim_due(pending, 'send_after', 60, 2)], [EMAILS[2]],
+                         'Claimed emails another worker had claimed')
+        self.assertEqual(send_queued_emails(), 0, 'Sent emails another worker had claimed')
+
+        pending.update(send_after=timezone.now())
+        self.assertEqual(send_queued_emails(), N_TEST_USERS, 'Emails were not sent once the lease ran out')
+
+    def test_background_job(self):
+        """
+        Make sure that waking a background job runs its batches in a thread until there are none left
+        """
+        batches = [1, 1, 0]
+        done = threading.Event()
+
+        def run_batch():
+            batch = batches.pop(0)
+            if not batches:
+                done.set()
+            return batch
+
+        job = BackgroundJob('test-worker', run_batch, 'OUTBOX')
+        job.wake()
+        self.assertTrue(done.wait(5), 'Background job did not run its batches')
+        self.assertEqual(batches, [], 'Background job did not stop after an empty batch')
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.BrokenEmailBackend')
+    def test_retry_with_backoff(self):
+        """
+        Make sure that failed emails are retried later, waiting longer each time, until they are given up on
+        """
+        self.queue_test_emails()
+
+        waits = []
+        with self.assertLogs('accounts.outbox', level='WARNING'):
+            for attempt in range(1, settings.OUTBOX['MAX_ATTEMPTS']):
+                send_queued_emails()
+                email = OutgoingEmail.objects.get(to=EMAILS[0])
+                self.assertEqual(email.attempts, attempt, 'Failed attempt was not recorded')
+                self.assertIn('mail server is down', email.last_error, 'Error was not recorded')
+                waits += [email.send_after - timezone.now()]
+
+                # Nothing is due until the wait is over
+                self.assertEqual(send_queued_emails(), 0, 'Failed email was retried straight away')
+                OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).update(send_after=timezone.now())
+            send_queued_emails()
+
+        self.assertTrue(all(a < b for a, b in zip(waits, waits[1:])), 'Retries did not back off')
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.FAILED).count(), N_TEST_USERS,
+                         'Emails were not given up on after MAX_ATTEMPTS')
+
+    @override_settings(OUTBOX=dict(settings.OUTBOX, MODE='eager'))
+    def test_eager_mode(self):
+        """
+        Make sure that eager mode sends emails as soon as they are committed
+        """
+        # Tests run inside a transaction that never commits, so run what would happen on commit by hand
+        with mock.patch('accounts.outbox.transaction.on_commit') as on_commit:
+            self.queue_test_emails()
+        self.assertEqual(len(mail.outbox), 0, 'Emails were sent before they were committed')
+        for args, kwargs in on_commit.call_args_list:
+            args[0]()
+        self.assertEqual(len(mail.outbox), N_TEST_USERS, 'Emails were not sent straight away in eager mode')
+
+
+class BrokenEmailBackend(BaseEmailBackend):
+    """
+    Email backend that can never reach its mail server
+    """
+    def send_messages(self, email_messages):
+        raise ConnectionError('mail server is down')
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """
+    All tests related to caching which user a token belongs to
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.cache = get_token_cache()
+        self.cache.clear()
+
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = '/accounts/{}/'.format(self.user.pk)
+
+    def test_token_is_cached(self):
+        """
+        Make sure that only the first request with a token looks it up in the database
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not authenticate with a token')
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not authenticate with a cached token')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1), 'Hits and misses were not counted')
+
+        # Bad tokens are never cached
+        self.client.credentials(HTTP_AUTHORIZATION='Token notatoken')
+        for i in range(2):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, 'Bad token was accepted')
+        self.assertEqual(len(self.cache), 1, 'Bad token was cached')
+
+    def test_deleted_token_is_forgotten(self):
+        """
+        Make sure that a deleted (or rotated) token stops working straight away
+        """
+        self.client.get(self.url)
+        self.token.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, 'Deleted token was still accepted')
+
+        new_token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + new_token.key)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Rotated token was not accepted')
+
+    def test_changed_user_is_forgotten(self):
+        """
+        Make sure that deactivating or deleting a user stops their token working straight away
+        """
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, 'Deactivated user was still logged in')
+
+        self.user.is_active = True
+        self.user.save()
+        self.client.get(self.url)
+        self.user.delete()
+        self.assertEqual(len(self.cache), 0, 'Deleted user was still cached')
+
+    def test_other_process_is_told(self):
+        """
+        Make sure that a user deactivated through another process stops being logged in here too
+        """
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+        # The other process has a token cache of its own, and only shares the Django cache with this one. An
+        # update() sends no signals, so this process hears nothing but what the other one tells it.
+        other = TokenCache()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        other.forget_user(self.user.pk)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED,
+                         'User deactivated in another process was still logged in')
+
+    @override_settings(TOKEN_CACHE={'MAX_ENTRIES': 2, 'TIMEOUT': 60, 'CACHE': 'default'})
+    def test_cache_is_bounded(self):
+        """
+        Make sure that the cache holds at most MAX_ENTRIES tokens, and forgets them after TIMEOUT seconds
+        """
+        cache = get_token_cache()
+        users = [User.objects.create_user(username=USERNAMES[i], email=EMAILS[i], password=PASSWORDS[i])
+                 for i in range(1, N_TEST_USERS)] + [self.user]
+        for user in users:
+            token = Token.objects.get(user=user)
+            cache.set(token.key, user, token)
+        self.assertEqual(len(cache), 2, 'Cache grew past MAX_ENTRIES')
+        self.assertIsNone(cache.get(Token.objects.get(user=users[0]).key), 'Oldest token was not evicted')
+
+        cache.timeout = -1
+        cache.set(self.token.key, self.user, self.token)
+        self.assertIsNone(cache.get(self.token.key), 'Expired token was still cached')
+
+
+THROTTLES = {
+    'post': {'CAPACITY': 2, 'RATE': 1},
+    'bulk_post': {'CAPACITY': 2, 'RATE': 1},
+    'signup': {'CAPACITY': 2, 'RATE': 0.1},
+}
+
+
+@override_settings(THROTTLES=THROTTLES)
+class ThrottleTest(TestCase):
+    """
+    All tests related to throttling requests that write
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.now = time.time()
+        patcher = mock.patch('accounts.throttling.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def signup(self, i, ip='127.0.0.1'):
+        data = {'username': 'throttled{}'.format(i), 'password': 'throttledpassword'}
+        return self.client.post('/accounts/', json.dumps(data), content_type='application/json', REMOTE_ADDR=ip)
+
+    def test_take_token(self):
+        """
+        Make sure that a bucket gives out CAPACITY tokens at once, then RATE tokens a second
+        """
+        self.assertIsNone(take_token('test', 2, 0.5), 'Full bucket did not give a token')
+        with self.assertNumQueries(1):
+            self.assertIsNone(take_token('test', 2, 0.5), 'Bucket did not give its last token')
+        self.assertAlmostEqual(take_token('test', 2, 0.5), 2, msg='Empty bucket did not say how long to wait')
+
+        self.now += 1
+        self.assertAlmostEqual(take_token('test', 2, 0.5), 1, msg='Bucket did not refill over time')
+        self.now += 1
+        self.assertIsNone(take_token('test', 2, 0.5), 'Refilled bucket did not give a token')
+        self.now += 60
+        self.assertIsNone(take_token('test', 2, 0.5), 'Bucket did not refill')
+        self.assertIsNone(take_token('test', 2, 0.5), 'Bucket did not refill')
+        self.assertIsNotNone(take_token('test', 2, 0.5), 'Bucket filled past its capacity')
+        self.assertIsNone(take_token('other', 2, 0.5), 'Buckets were shared')
+
+    def test_prune_buckets(self):
+        """
+        Make sure that buckets that have filled back up are deleted, and the rest are kept
+        """
+        for scope in ('post', 'signup'):
+            take_token('{}:idle'.format(scope), THROTTLES[scope]['CAPACITY'], THROTTLES[scope]['RATE'])
+        self.now += 5
+        take_token('post:busy', THROTTLES['post']['CAPACITY'], THROTTLES['post']['RATE'], cost=2)
+        ThrottleBucket.objects.create(key='gone:idle', tokens=0, updated_at=self.now)
+
+        self.assertEqual(prune_buckets(), 2, 'Wrong number of buckets pruned')
+        self.assertEqual(set(ThrottleBucket.objects.values_list('key', flat=True)), {'post:busy', 'signup:idle'},
+                         'Pruned a bucket that was still filling, or kept one that was full')
+
+        self.now += 60
+        call_command('prune_throttle_buckets', once=True, stdout=StringIO())
+        self.assertFalse(ThrottleBucket.objects.exists(), 'Command did not prune the buckets that filled up')
+        self.assertIsNone(take_token('post:busy', THROTTLES['post']['CAPACITY'], THROTTLES['post']['RATE'], cost=2),
+                          'Pruned bucket did not start again full')
+
+    def test_signup_throttle(self):
+        """
+        Make sure that signups are throttled per IP address, with Retry-After
+        """
+        for i in range(2):
+            self.assertEqual(self.signup(i).status_code, status.HTTP_201_CREATED, 'Signup was throttled')
+        response = self.signup(2)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS, 'Signup was not throttled')
+        self.assertEqual(response['Retry-After'], '10', 'Throttled signup did not say when to retry')
+        self.assertFalse(User.objects.filter(username='throttled2').exists(), 'Throttled signup made an account')
+
+        # Clients can't pass themselves off as someone else with X-Forwarded-For
+        data = {'username': 'throttled5', 'password': 'throttledpassword'}
+        response = self.client.post('/accounts/', json.dumps(data), content_type='application/json',
+                                    REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS, 'Forwarded signup was not throttled')
+
+        response = self.signup(3, ip='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Other IP address was throttled')
+        self.now += 10
+        self.assertEqual(self.signup(4).status_code, status.HTTP_201_CREATED, 'Signup was not allowed again')
+
+    def test_post_throttle(self):
+        """
+        Make sure that creating posts is throttled per user, and reading them isn't
+        """
+        users = [User.objects.create_user(username=USERNAMES[i], password=PASSWORDS[i]) for i in range(2)]
+        for user in users:
+            token = Token.objects.get(user=user)
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+            for i in range(2):
+                response = self.client.post('/post/', {'text': POSTS[i]})
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Post was throttled')
+            response = self.client.post('/post/', {'text': POSTS[2]})
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS, 'Post was not throttled')
+            self.assertEqual(response['Retry-After'], '1', 'Throttled post did not say when to retry')
+
+        for i in range(5):
+            response = self.client.get('/post/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Reading posts was throttled')
+
+    def test_bulk_cost(self):
+        """
+        Make sure that each post made in bulk takes a token from a bucket of their own, and that a request that
+        could never go through isn't worth retrying
+        """
+        user = User.objects.create_user(username=USERNAMES[0], password=PASSWORDS[0])
+        token = Token.objects.get(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        def bulk(count):
+            return self.client.post('/post/bulk/', json.dumps([{'text': POSTS[0]}] * count),
+                                    content_type='application/json')
+
+        response = bulk(3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST,
+                         'More posts than the bucket can hold were not a bad request')
+        self.assertNotIn('Retry-After', response, 'Told to retry a request that can never go through')
+        for i in range(THROTTLES['post']['CAPACITY']):
+            self.client.post('/post/', {'text': POSTS[0]})
+        self.assertEqual(bulk(2).status_code, status.HTTP_201_CREATED, 'Bulk posts were throttled')
+        response = bulk(1)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS, 'Bulk posts took only one token')
+        self.assertEqual(response['Retry-After'], '1', 'Throttled post did not say when to retry')
+        self.assertEqual(Post.objects.filter(author=user).count(), 4, 'Throttled posts were made')
@@ -0,0 +1,145 @@
+import operator
+import time
+from functools import reduce
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Least
+from rest_framework.exceptions import ValidationError
+from rest_framework.throttling import BaseThrottle
+
+from accounts.models import ThrottleBucket
+
+
+def take_token(key, capacity, rate, cost=1):
+    """
+    Take cost tokens from the bucket called key, which holds up to capacity tokens and gains rate tokens a second
+
+    Returns None if there were enough tokens to take, otherwise how many seconds until there will be. The bucket is
+    refilled and a token taken in one conditional UPDATE, so every worker process sees the same bucket and two
+    requests can never take the same token. That UPDATE is the only query while the client has tokens left.
+    """
+    now = time.time()
+    available = Least(F('tokens') + (Value(now) - F('updated_at')) * Value(rate), Value(float(capacity)))
+    taken = (ThrottleBucket.objects.filter(key=key)
+             .annotate(available=available)
+             .filter(available__gte=cost)
+             .update(tokens=available - Value(float(cost)), updated_at=now))
+    if taken:
+        return None
+
+    bucket = ThrottleBucket.objects.filter(key=key).first()
+    if bucket is None:
+        # The client's first request, which starts off with a full bucket
+        try:
+            with transaction.atomic():
+                ThrottleBucket.objects.create(key=key, tokens=capacity - cost, updated_at=now)
+            return None
+        except IntegrityError:
+            # Another request created the bucket first, so take the tokens from that one
+            return take_token(key, capacity, rate, cost)
+
+    tokens = min(bucket.tokens + (now - bucket.updated_at) * rate, capacity)
+    return (cost - tokens) / rate
+
+
+def prune_buckets():
+    """
+    Delete the buckets that have filled back up, and the buckets of scopes that are no longer in settings.THROTTLES
+
+    A full bucket is no different from no bucket at all, the client's next request starts a new one. Without this
+    there would be a row for every client that ever made a request. Returns how many buckets were deleted.
+    """
+    now = time.time()
+    deleted, _ = ThrottleBucket.objects.exclude(
+        reduce(operator.or_, (Q(key__startswith='{}:'.format(scope)) for scope in settings.THROTTLES), Q(pk=None))
+    ).delete()
+    for scope, options in settings.THROTTLES.items():
+        # tokens + (now - updated_at) * RATE >= CAPACITY, with the arithmetic moved to the side with the columns
+        full = ThrottleBucket.objects.filter(
+            key__startswith='{}:'.format(scope),
+            tokens__gte=Value(float(options['CAPACITY'])) - (Value(now) - F('updated_at')) * Value(options['RATE']))
+        deleted += full.delete()[0]
+    return deleted
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttles requests with a token bucket kept in the database, configured by settings.THROTTLES[scope]
+
+    Each client can make CAPACITY requests in a burst, and then RATE requests a second. Subclasses decide
+    who the client is, and can make some requests cost more than one.
+    """
+    scope = None
+
+    def get_key(self, request, view):
+        """
+        Return what the bucket for this client is called, or None to not throttle the request
+        """
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def get_cost(self, request, view):
+        """
+        Return how many tokens the request takes
+        """
+        return 1
+
+    def allow_request(self, request, view):
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        options = settings.THROTTLES[self.scope]
+        cost = self.get_cost(request, view)
+        if cost > options['CAPACITY']:
+            # The bucket never holds that many tokens, so the request could never go through however long the
+            # client waited. That makes it a bad request rather than one to retry later.
+            raise ValidationError('Request costs {} tokens, more than the {} that can be saved up'.format(
+                cost, options['CAPACITY']))
+        self.wait_time = take_token('{}:{}'.format(self.scope, key), options['CAPACITY'], options['RATE'], cost)
+        return self.wait_time is None
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    One bucket per user, and one per IP address for anonymous requests
+    """
+
+    def get_key(self, request, view):
+        if request.user.is_authenticated:
+            return 'user:{}'.format(request.user.pk)
+        return 'ip:{}'.format(self.get_ident(request))
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """
+    One bucket per IP address
+    """
+
+    def get_key(self, request, view):
+        return 'ip:{}'.format(self.get_ident(request))
+
+
+class PostThrottle(UserTokenBucketThrottle):
+    scope = 'post'
+
+
+class BulkPostThrottle(UserTokenBucketThrottle):
+    """
+    Posts made in bulk have a bucket of their own, counted in posts rather than requests, so that a whole
+    request's worth can be saved up
+    """
+    scope = 'bulk_post'
+
+    def get_cost(self, request, view):
+        # Requests with too many posts are turned away by the view
+        if isinstance(request.data, list) and len(request.data) <= view.bulk_max_size:
+            return max(len(request.data), 1)
+        return 1
+
+
+class SignupThrottle(IPTokenBucketThrottle):
+    scope = 'signup'
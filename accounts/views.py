@@ -5,7 +5,16 @@ from accounts.serializers import UserSerializer
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework import status
-from django.core.mail import send_mail
+from django.db import transaction
+from rest_framework.decorators import detail_route
+from rest_framework.reverse import reverse
+from post.models import Post
+from post.pagination import FeedPagination
+from post.serializers import PostRowSerializer
+from WallApp.sparse_fields import SparseFieldsMixin
+from accounts.deletion import queue_account_deletion
+from accounts.outbox import queue_email
+from accounts.throttling import SignupThrottle
 from accounts.email_info import *
 
 
@@ -13,7 +22,7 @@ global WELCOME_EMAIL_SUBJECT
 global WELCOME_EMAIL_MESSAGE
 global COMPANY_EMAIL
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """
     Viewset for accounts
     """
@@ -34,25 +43,65 @@ class UserViewSet(viewsets.ModelViewSet):
         # No one can list all accounts
         elif self.action in ('list', ):
             self.permission_classes = [AllowNone, ]
+
+        # Anyone can read a user's posts, the same as on the wall
+        elif self.action in ('posts', ):
+            self.permission_classes = [AllowAny, ]
         return super(self.__class__, self).get_permissions()
 
+    def get_queryset(self):
+        queryset = super(UserViewSet, self).get_queryset()
+        # The post count is kept on the profile, read in the same query as the user
+        fields = self.get_sparse_fields()
+        if self.action in ('retrieve', 'update', 'partial_update') and (fields is None or 'post_count' in fields):
+            queryset = queryset.select_related('profile')
+        return queryset
+
+    def get_throttles(self):
+        # Signing up is throttled, it hashes a password and sends an email
+        if self.action in ('create', ):
+            return [SignupThrottle()]
+        return super(UserViewSet, self).get_throttles()
+
     def create(self, request, *args, **kwargs):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.create(serializer.validated_data)
-
-            # Send email when user creates account
-            email = request.data.get('email')
-            send_mail(
-                WELCOME_EMAIL_SUBJECT,
-                WELCOME_EMAIL_MESSAGE,
-                COMPANY_EMAIL,
-                [email],
-                fail_silently=False,
-            )
-            return Response('Successfully created an account', status=status.HTTP_201_CREATED)
+            with transaction.atomic():
+                user = serializer.create(serializer.validated_data)
+
+                # Send email when user creates account, it goes out in the background once the account is saved
+                email = serializer.validated_data.get('email')
+                if email:
+                    queue_email(
+                        WELCOME_EMAIL_SUBJECT,
+                        WELCOME_EMAIL_MESSAGE,
+                        COMPANY_EMAIL,
+                        [email],
+                    )
+            # The body stays as it was for existing clients, the new account's URL is in the Location header
+            headers = {'Location': reverse('user-detail', args=[user.pk], request=request)}
+            return Response('Successfully created an account', status=status.HTTP_201_CREATED, headers=headers)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deactivate the account straight away, its posts and then the user are deleted in the background
+        """
+        user = self.get_object()
+        with transaction.atomic():
+            queue_account_deletion(user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @detail_route(methods=['get'], pagination_class=FeedPagination, serializer_class=PostRowSerializer)
+    def posts(self, request, pk=None):
+        """
+        The user's posts in the order they were made, a page at a time with cursors
+        """
+        user = self.get_object()
+        page = self.paginate_queryset(Post.objects.visible().filter(author=user).rows(self.get_sparse_fields()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
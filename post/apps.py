@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PostConfig(AppConfig):
     name = 'post'
+
+    def ready(self):
+        # Connects the receivers that feed new posts to the event streams
+        import post.events  # noqa
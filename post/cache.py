@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class BaseWallCache(object):
+    """
+    Somewhere to keep rendered pages of the wall
+
+    Every page is stored under the wall version it was rendered at. The version is bumped whenever a post
+    changes, which makes every page rendered before the change unreachable at once, so nothing ever has to
+    work out which pages a change touched.
+    """
+
+    def get(self, key):
+        """
+        Return what is stored under key, or None
+        """
+        raise NotImplementedError('.get() must be overridden')
+
+    def set(self, key, value):
+        """
+        Store value under key
+        """
+        raise NotImplementedError('.set() must be overridden')
+
+    def get_version(self):
+        """
+        Return the current wall version
+        """
+        raise NotImplementedError('.get_version() must be overridden')
+
+    def bump_version(self):
+        """
+        Move on to a new wall version, everything stored so far is stale after this
+        """
+        raise NotImplementedError('.bump_version() must be overridden')
+
+    def clear(self):
+        """
+        Forget everything that is stored
+        """
+        raise NotImplementedError('.clear() must be overridden')
+
+    def make_key(self, version, url):
+        return 'wall:{}:{}'.format(version, md5(url.encode('utf-8')).hexdigest())
+
+
+class LRUWallCache(BaseWallCache):
+    """
+    Keeps pages in this process, throwing away the least recently used page once there are max_entries of them
+
+    Only for a single worker process. Each process has its own pages and its own version, which only sees the
+    changes made through that process, so other workers would keep serving pages from before a change.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        # Start from the time rather than 0, so versions from before a restart are never reused
+        self._version = int(time.time() * 1000)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._pages.move_to_end(key)
+            except KeyError:
+                return None
+            return self._pages[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._pages[key] = value
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def get_version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # Nothing can ask for the old pages anymore, so don't wait for them to be evicted
+            self._pages.clear()
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def __len__(self):
+        return len(self._pages)
+
+
+class DjangoWallCache(BaseWallCache):
+    """
+    Keeps pages and the version in one of Django's CACHES, e.g. memcached shared by every worker
+
+    Stale pages are not deleted, they are never asked for again and expire after timeout seconds
+    """
+    version_key = 'wall:version'
+
+    def __init__(self, alias='default', timeout=300):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.start_version()
+            version = self.cache.get(self.version_key)
+        return version
+
+    def start_version(self):
+        # add() so that workers starting at the same time agree on one version
+        self.cache.add(self.version_key, int(time.time() * 1000), None)
+
+    def bump_version(self):
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            # The version was evicted, so start a new one
+            self.start_version()
+
+    def clear(self):
+        self.bump_version()
+
+
+_wall_cache = None
+
+
+def get_wall_cache():
+    """
+    Return the wall cache configured in settings.WALL_CACHE
+    """
+    global _wall_cache
+    if _wall_cache is None:
+        backend = import_string(settings.WALL_CACHE['BACKEND'])
+        _wall_cache = backend(**settings.WALL_CACHE.get('OPTIONS', {}))
+    return _wall_cache
+
+
+def bump_wall_version():
+    """
+    Make every cached page of the wall stale, for anything that changes what the wall looks like
+    """
+    get_wall_cache().bump_version()
+
+
+@receiver(setting_changed)
+def reload_wall_cache(setting, **kwargs):
+    global _wall_cache
+    if setting == 'WALL_CACHE':
+        _wall_cache = None
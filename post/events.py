@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from post.models import Post
+from post.serializers import PostSerializer
+from post.signals import posts_created
+
+
+class PostHub(object):
+    """
+    Hands new posts from whichever request made them to every open event stream in this process
+
+    Posts are rendered once when they are published and kept in a ring buffer of the last max_events,
+    numbered in the order they were published. Each stream remembers the number of the last post it sent
+    and waits on one condition shared by every stream, so an idle stream costs a wait and nothing else.
+    """
+
+    def __init__(self, max_events=1000):
+        self._events = deque(maxlen=max_events)
+        self._position = 0
+        self._condition = threading.Condition()
+
+    @property
+    def position(self):
+        """
+        The number of the last post published, new streams start from here
+        """
+        return self._position
+
+    def publish(self, posts):
+        """
+        Send posts to every stream
+        """
+        renderer = JSONRenderer()
+        events = [(post['id'], renderer.render(post)) for post in PostSerializer(posts, many=True).data]
+        with self._condition:
+            for pk, data in events:
+                self._position += 1
+                self._events.append((self._position, pk, data))
+            self._condition.notify_all()
+
+    def wait(self, position, timeout):
+        """
+        Wait up to timeout seconds for posts published after position
+
+        Returns the (position, id, rendered post) of each of them that is still in the buffer, which is empty
+        if nothing was published in time, and whether any of them had already dropped out of the buffer
+        """
+        with self._condition:
+            if self._position == position:
+                self._condition.wait(timeout)
+            missed = bool(self._events) and self._events[0][0] > position + 1
+            return [event for event in self._events if event[0] > position], missed
+
+
+_post_hub = None
+_post_hub_lock = threading.Lock()
+
+
+def get_post_hub():
+    """
+    Return this process's post hub, configured by settings.WALL_EVENTS
+    """
+    global _post_hub
+    with _post_hub_lock:
+        if _post_hub is None:
+            _post_hub = PostHub(max_events=settings.WALL_EVENTS['BUFFER'])
+    return _post_hub
+
+
+@receiver(setting_changed)
+def reload_post_hub(setting, **kwargs):
+    global _post_hub
+    if setting == 'WALL_EVENTS':
+        _post_hub = None
+
+
+@receiver(post_save, sender=Post)
+@receiver(posts_created, sender=Post)
+def post_created(sender, instance=None, created=True, posts=None, **kwargs):
+    # Only tell the streams once the posts are committed, so nobody sees a post that is rolled back
+    if created:
+        posts = posts if posts is not None else [instance]
+        transaction.on_commit(lambda: get_post_hub().publish(posts))
+
+
+def format_event(pk, data):
+    return b'id: ' + str(pk).encode('ascii') + b'\nevent: post\ndata: ' + data + b'\n\n'
+
+
+def catch_up(last_event_id):
+    """
+    Read the posts made after last_event_id back from the database, for a client that is reconnecting
+
+    Yields the id and rendered post of every one of them, reading CATCH_UP posts at a time
+    """
+    size = settings.WALL_EVENTS['CATCH_UP']
+    renderer = JSONRenderer()
+    while True:
+        posts = Post.objects.visible().select_related('author').filter(pk__gt=last_event_id).order_by('id')
+        posts = list(posts[:size])
+        for post in PostSerializer(posts, many=True).data:
+            yield post['id'], renderer.render(post)
+        if len(posts) < size:
+            return
+        last_event_id = posts[-1].pk
+
+
+def iter_events(hub, position, last_event_id):
+    """
+    Yield new posts as Server-Sent Events, starting with the ones made after last_event_id if there is one
+
+    Sends a comment every HEARTBEAT seconds so that proxies don't drop the connection, and ends after
+    MAX_DURATION seconds, the client reconnects with Last-Event-ID and picks up where it left off
+    """
+    options = settings.WALL_EVENTS
+    deadline = time.time() + options['MAX_DURATION']
+    yield 'retry: {}\n\n'.format(options['RETRY'] * 1000).encode('ascii')
+
+    # Posts read back from the database can come round again from the hub, they are only sent once
+    sent = set()
+    if last_event_id is not None:
+        for pk, data in catch_up(last_event_id):
+            sent.add(pk)
+            last_event_id = pk
+            yield format_event(pk, data)
+    # Waiting on the hub doesn't need the database, so don't keep a connection open for every idle stream
+    if not connection.in_atomic_block:
+        connection.close()
+
+    while time.time() < deadline:
+        events, missed = hub.wait(position, min(options['HEARTBEAT'], max(deadline - time.time(), 0)))
+        if missed and last_event_id is not None:
+            # This stream fell further behind than the hub remembers, read what it missed back instead. Anything
+            # published after this position comes from the hub, and is only sent if catch up didn't send it.
+            position = hub.position
+            for pk, data in catch_up(last_event_id):
+                if pk not in sent:
+                    sent.add(pk)
+                    last_event_id = pk
+                    yield format_event(pk, data)
+            if not connection.in_atomic_block:
+                connection.close()
+            continue
+        if not events:
+            yield b': keep-alive\n\n'
+            continue
+        for event_position, pk, data in events:
+            position = max(position, event_position)
+            if pk not in sent:
+                sent.add(pk)
+                last_event_id = max(pk, last_event_id or 0)
+                yield format_event(pk, data)
+
+
+def post_events(request):
+    """
+    Stream new posts as they are made, as Server-Sent Events
+
+    Clients that reconnect send Last-Event-ID (or ?last_event_id= where the header can't be set),
+    and get the posts they missed first
+    """
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    # Take the position now rather than when the stream starts, so nothing published in between is lost
+    hub = get_post_hub()
+    response = StreamingHttpResponse(iter_events(hub, hub.position, last_event_id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
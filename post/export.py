@@ -0,0 +1,55 @@
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from post.filters import filter_posts
+from post.models import Post
+from post.pagination import keyset_filter
+from post.serializers import PostSerializer
+
+
+def parse_after(value):
+    """
+    Parse the position to resume an export from, the posted_at and id of the last post received,
+    e.g. 2018-03-10T21:25:00.123456Z,42
+    """
+    try:
+        posted_at, pk = value.rsplit(',', 1)
+        posted_at, pk = parse_datetime(posted_at), int(pk)
+    except ValueError:
+        posted_at = None
+    if posted_at is None:
+        raise ValidationError({'after': 'Expected the posted_at and id of a post, e.g. 2018-03-10T21:25:00Z,42'})
+    return posted_at, pk
+
+
+def iter_post_chunks(params, chunk_size=1000):
+    """
+    Yield every post matching the author, since and until parameters (see post/filters.py) in wall order,
+    starting after the post given by the after parameter if there is one, as lists of chunk_size posts
+
+    Each chunk seeks past the last post of the one before, so memory use stays the same however many posts
+    there are and every chunk costs the same to fetch
+    """
+    queryset = filter_posts(Post.objects.visible().select_related('author'), params).order_by('posted_at', 'id')
+    position = parse_after(params['after']) if params.get('after') else None
+
+    while True:
+        chunk = queryset if position is None else keyset_filter(queryset, *position)
+        chunk = list(chunk[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        position = (chunk[-1].posted_at, chunk[-1].pk)
+
+
+def iter_ndjson(params, chunk_size=1000):
+    """
+    Yield the posts from iter_post_chunks as newline delimited JSON, one line per post and a chunk of lines at a time
+
+    Each line is the post exactly as the API returns it, so a client can resume from the last line it received
+    """
+    renderer = JSONRenderer()
+    for chunk in iter_post_chunks(params, chunk_size):
+        yield b''.join(renderer.render(post) + b'\n' for post in PostSerializer(chunk, many=True).data)
@@ -0,0 +1,53 @@
+from datetime import datetime, time
+
+from django.contrib.auth.models import User
+from django.db.models import Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def parse_posted_at(name, value):
+    """
+    Parse an ISO 8601 date and time (or just a date, meaning midnight) from a query parameter,
+    times without a timezone are taken to be UTC
+    """
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            parsed = datetime.combine(date, time.min) if date is not None else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Expected an ISO 8601 date and time, e.g. 2018-03-10T21:25:00Z'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.utc)
+    return parsed
+
+
+def filter_posts(queryset, params):
+    """
+    Narrow down posts with the query parameters the wall accepts
+
+    author: only posts by the user with this username
+    since: only posts made at or after this time
+    until: only posts made before this time
+
+    Every combination of these is answered from one of the indexes on Post, with author on (author, posted_at)
+    and the time range alone on (posted_at, id).
+    """
+    author = params.get('author')
+    since = params.get('since')
+    until = params.get('until')
+
+    if author is not None:
+        # Compare against the author's id rather than joining auth_user, so the lookup stays on the
+        # (author, posted_at) index. The subquery is a single lookup on the unique username index.
+        author_id = User.objects.filter(username=author).values('pk')[:1]
+        queryset = queryset.filter(author_id=Subquery(author_id))
+    if since is not None:
+        queryset = queryset.filter(posted_at__gte=parse_posted_at('since', since))
+    if until is not None:
+        queryset = queryset.filter(posted_at__lt=parse_posted_at('until', until))
+    return queryset
@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from post.models import Post, PostFragment, PostRow
+from post.rendering import render_post_fragment, render_posts
+from post.serializers import PostRowSerializer, PostSerializer
+
+
+class Command(BaseCommand):
+    help = ('Compare how many posts a second PostSerializer and PostRowSerializer can turn into JSON, '
+            'and how many can be put together from their stored JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000, help='How many posts to serialize each time')
+        parser.add_argument('--repeat', type=int, default=5, help='How many times to time each, the best is shown')
+
+    def handle(self, *args, **options):
+        # The posts are built in memory, so only serializing and rendering them is timed
+        author = User(pk=1, username='batman')
+        now = timezone.now()
+        posts = [Post(pk=i, author=author, posted_at=now + timedelta(microseconds=i), text='Post number {}'.format(i))
+                 for i in range(1, options['posts'] + 1)]
+        rows = [PostRow(post.pk, author.username, post.posted_at, post.text) for post in posts]
+        fragments = [PostFragment(post.pk, author.username, post.posted_at,
+                                  render_post_fragment(post.posted_at, post.text), None) for post in posts]
+
+        renderer = JSONRenderer()
+        contenders = (
+            ('PostSerializer', lambda: renderer.render(PostSerializer(posts, many=True).data)),
+            ('PostRowSerializer', lambda: renderer.render(PostRowSerializer(rows, many=True).data)),
+            ('Stored JSON', lambda: render_posts(fragments)),
+        )
+        results = []
+        for name, render in contenders:
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                content = render()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results += [(name, content, len(posts) / best)]
+
+        slow_name, slow_content, slow_rate = results[0]
+        self.stdout.write('{}: {:.0f} posts/s'.format(slow_name, slow_rate))
+        for fast_name, fast_content, fast_rate in results[1:]:
+            if slow_content != fast_content:
+                self.stderr.write('{} and {} gave different output'.format(slow_name, fast_name))
+            self.stdout.write('{}: {:.0f} posts/s ({:.1f}x)'.format(fast_name, fast_rate, fast_rate / slow_rate))
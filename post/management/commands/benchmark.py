@@ -0,0 +1,428 @@
+import http.client
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from post.models import Post
+from post.seeding import seed_wall
+from post.views import PostViewSet
+
+# What share of requests each operation gets unless --mix says otherwise
+DEFAULT_MIX = OrderedDict([
+    ('wall', 60),
+    ('detail', 15),
+    ('create', 10),
+    ('patch', 8),
+    ('delete', 5),
+    ('signup', 2),
+])
+
+BENCH_PREFIX = 'bench-'
+BENCH_PASSWORD = 'benchmark-password'
+
+
+class InProcessTarget(object):
+    """
+    Sends requests straight to the Django app in this process, through all of its middleware
+    """
+
+    def __init__(self):
+        self.client = Client()
+        self.location = None
+
+    def request(self, method, path, data=None, token=None):
+        extra = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+        body = json.dumps(data) if data is not None else ''
+        response = self.client.generic(method, path, body, content_type='application/json', **extra)
+        self.location = response.get('Location')
+        return response.status_code, response.content
+
+    def close(self):
+        # Each worker thread has its own database connection
+        connection.close()
+
+
+class HTTPTarget(object):
+    """
+    Sends requests to a running server over one kept alive connection
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=30)
+        self.prefix = parts.path.rstrip('/')
+        self.location = None
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Token ' + token
+        body = json.dumps(data) if data is not None else None
+        try:
+            self.connection.request(method, self.prefix + path, body, headers)
+            response = self.connection.getresponse()
+            self.location = response.getheader('Location')
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+def account_pk(location):
+    """
+    The pk of the account at the URL a signup's Location header gives
+    """
+    return int(location.rstrip('/').rsplit('/', 1)[1])
+
+
+class Workload(object):
+    """
+    The benchmark users and posts, and what each operation does with them
+
+    Operations pick from what is there at the time, so workers share the pool of posts they can edit and delete.
+    An operation returns None instead of a response when there is nothing left for it to do, and is skipped.
+    Every account made through the API is kept in accounts, as (pk, username), so it can be deleted afterwards.
+    """
+
+    def __init__(self, users, posts_by_author, seed, prefix=BENCH_PREFIX):
+        self.users = users
+        self.posts_by_author = posts_by_author
+        self.lock = threading.Lock()
+        self.signups = 0
+        self.seed = seed
+        self.prefix = prefix
+        self.accounts = []
+
+    def run(self, operation, target, rng):
+        return getattr(self, operation)(target, rng)
+
+    def wall(self, target, rng):
+        if rng.random() < 0.5:
+            return target.request('GET', '/post/?page={}'.format(rng.randint(1, 5)))
+        return target.request('GET', '/post/?pagination=cursor')
+
+    def detail(self, target, rng):
+        picked = self.pick_post(rng)
+        if picked is None:
+            return None
+        author, token, pk = picked
+        return target.request('GET', '/post/{}/'.format(pk))
+
+    def create(self, target, rng):
+        author, token = rng.choice(self.users)
+        status, content = target.request('POST', '/post/', {'text': 'Benchmark post'}, token)
+        if status == 201:
+            with self.lock:
+                self.posts_by_author[author].append(json.loads(content.decode('utf-8'))['id'])
+        return status, content
+
+    def patch(self, target, rng):
+        picked = self.pick_post(rng)
+        if picked is None:
+            return None
+        author, token, pk = picked
+        return target.request('PATCH', '/post/{}/'.format(pk), {'text': 'Edited benchmark post'}, token)
+
+    def delete(self, target, rng):
+        picked = self.pick_post(rng, remove=True)
+        if picked is None:
+            return None
+        author, token, pk = picked
+        return target.request('DELETE', '/post/{}/'.format(pk), token=token)
+
+    def signup(self, target, rng):
+        with self.lock:
+            self.signups += 1
+            username = '{}signup-{}-{}'.format(self.prefix, self.seed, self.signups)
+        status, content = target.request('POST', '/accounts/', {'username': username, 'password': BENCH_PASSWORD})
+        if status == 201:
+            with self.lock:
+                self.accounts.append((account_pk(target.location), username))
+        return status, content
+
+    def pick_post(self, rng, remove=False):
+        """
+        Pick one of the benchmark posts, as (author, token, pk), or None if every one of them has been deleted
+
+        Only users with posts left are picked from, so operations never ask for a post that isn't there.
+        """
+        with self.lock:
+            authors = [(author, token) for author, token in self.users if self.posts_by_author[author]]
+            if not authors:
+                return None
+            author, token = rng.choice(authors)
+            posts = self.posts_by_author[author]
+            index = rng.randrange(len(posts))
+            if remove:
+                posts[index], posts[-1] = posts[-1], posts[index]
+                return author, token, posts.pop()
+            return author, token, posts[index]
+
+
+def percentile(ordered, fraction):
+    """
+    The fraction percentile of an already sorted list, rounded down to a value in it
+    """
+    if not ordered:
+        return None
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+class Command(BaseCommand):
+    help = ('Seed benchmark users and posts, run a mix of concurrent requests against the API, '
+            'and report latency percentiles and requests per second for each operation')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='How many users to seed')
+        parser.add_argument('--posts', type=int, default=2000, help='How many posts to seed')
+        parser.add_argument('--concurrency', type=int, default=4, help='How many clients send requests at once')
+        parser.add_argument('--duration', type=float, default=10, help='How many seconds to send requests for')
+        parser.add_argument('--mix', default=','.join('{}={}'.format(*item) for item in DEFAULT_MIX.items()),
+                            help='Share of requests for each operation, e.g. wall=80,create=20')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for picking requests, for repeatable runs')
+        parser.add_argument('--url', help='Benchmark the server at this URL instead of the app in this process. '
+                                          'Its users and posts are made through the API and deleted afterwards.')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep throttling on, it is turned off in this process by default. A server '
+                                 'benchmarked with --url always keeps its own THROTTLES.')
+        parser.add_argument('--output', help='Save the results to this JSON file')
+        parser.add_argument('--compare', help='Compare with results saved by an earlier run')
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        if options['url'] is None:
+            # Seed and run against a throwaway copy of the database, the same way the tests do
+            directory = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results = self.benchmark(options, mix, self.seed(options))
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                shutil.rmtree(directory, ignore_errors=True)
+        else:
+            # The server's database is left alone, apart from what the benchmark makes through the API
+            self.stdout.write('Throttling can only be turned off in the server\'s own settings, raise its '
+                              'THROTTLES for the benchmark or some requests will get 429s')
+            target = HTTPTarget(options['url'])
+            workload = Workload([], defaultdict(list), options['seed'],
+                                prefix='{}{}-'.format(BENCH_PREFIX, uuid.uuid4().hex[:8]))
+            try:
+                self.seed_server(options, target, workload)
+                results = self.benchmark(options, mix, workload)
+            finally:
+                self.clean_server(target, workload)
+                target.close()
+
+        self.report(results)
+        if options['compare']:
+            with open(options['compare']) as previous:
+                self.compare(json.load(previous), results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def parse_mix(self, value):
+        mix = OrderedDict()
+        try:
+            for part in value.split(','):
+                name, weight = part.split('=')
+                mix[name.strip()] = float(weight)
+        except ValueError:
+            raise CommandError('--mix should look like wall=80,create=20')
+        unknown = set(mix) - set(DEFAULT_MIX)
+        if unknown:
+            raise CommandError('Unknown operations in --mix: {}'.format(', '.join(sorted(unknown))))
+        return mix
+
+    def seed(self, options):
+        """
+        Create the benchmark users, their tokens and posts in the throwaway database, and return the workload
+        that uses them
+        """
+        users = seed_wall(random.Random(options['seed']), options['users'], options['posts'], prefix=BENCH_PREFIX,
+                          password=BENCH_PASSWORD)
+        # bulk_create doesn't send the signal that gives new users their token
+        Token.objects.bulk_create([Token(user_id=pk, key=Token().generate_key()) for pk, joined in users])
+        tokens = dict(Token.objects.filter(user__username__startswith=BENCH_PREFIX).values_list('user_id', 'key'))
+
+        posts_by_author = defaultdict(list)
+        for pk, author_id in Post.objects.filter(author__username__startswith=BENCH_PREFIX).values_list(
+                'pk', 'author_id'):
+            posts_by_author[author_id].append(pk)
+        return Workload([(pk, tokens[pk]) for pk, joined in users], posts_by_author, options['seed'])
+
+    def seed_server(self, options, target, workload):
+        """
+        Sign the benchmark users up and make their posts through the API of the server target points at
+        """
+        def call(method, path, data=None, token=None):
+            status, content = target.request(method, path, data, token)
+            if status >= 300:
+                raise CommandError('Could not seed the server, {} {} gave {}: {}'.format(
+                    method, path, status, content.decode('utf-8', 'replace')[:200]))
+            return json.loads(content.decode('utf-8'))
+
+        for i in range(options['users']):
+            username = '{}{}'.format(workload.prefix, i)
+            call('POST', '/accounts/', {'username': username, 'password': BENCH_PASSWORD})
+            pk = account_pk(target.location)
+            workload.accounts.append((pk, username))
+            token = call('POST', '/api-token-auth/', {'username': username, 'password': BENCH_PASSWORD})['token']
+            workload.users.append((pk, token))
+
+        if not workload.users:
+            return
+        rng = random.Random(options['seed'])
+        counts = defaultdict(int)
+        for pk, token in rng.choices(workload.users, k=options['posts']):
+            counts[(pk, token)] += 1
+        for (pk, token), count in counts.items():
+            for offset in range(0, count, PostViewSet.bulk_max_size):
+                texts = [{'text': 'Benchmark post'}] * min(PostViewSet.bulk_max_size, count - offset)
+                posts = call('POST', '/post/bulk/', texts, token)
+                workload.posts_by_author[pk].extend(post['id'] for post in posts)
+
+    def clean_server(self, target, workload):
+        """
+        Delete the accounts the benchmark made on the server, which deletes their posts too
+        """
+        for pk, username in workload.accounts:
+            try:
+                status, content = target.request('POST', '/api-token-auth/',
+                                                  {'username': username, 'password': BENCH_PASSWORD})
+                if status == 200:
+                    token = json.loads(content.decode('utf-8'))['token']
+                    status, content = target.request('DELETE', '/accounts/{}/'.format(pk), token=token)
+                if status >= 300:
+                    self.stderr.write('Could not delete the benchmark account {}'.format(username))
+            except (http.client.HTTPException, OSError):
+                self.stderr.write('Could not delete the benchmark account {}'.format(username))
+
+    def benchmark(self, options, mix, workload):
+        self.stdout.write('Seeded {} users and {} posts'.format(options['users'], options['posts']))
+
+        latencies = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        operations, weights = list(mix), list(mix.values())
+        deadline = time.perf_counter() + options['duration']
+
+        def worker(number):
+            rng = random.Random('{}-{}'.format(options['seed'], number))
+            target = HTTPTarget(options['url']) if options['url'] else InProcessTarget()
+            try:
+                while time.perf_counter() < deadline:
+                    operation = rng.choices(operations, weights)[0]
+                    start = time.perf_counter()
+                    try:
+                        result = workload.run(operation, target, rng)
+                    except Exception:
+                        with lock:
+                            errors[operation] += 1
+                        continue
+                    elapsed = time.perf_counter() - start
+                    if result is None:
+                        # There was nothing to do it to, so there is no latency worth recording
+                        with lock:
+                            statuses[operation]['skipped'] += 1
+                        continue
+                    status, content = result
+                    with lock:
+                        latencies[operation].append(elapsed)
+                        statuses[operation][str(status)] += 1
+            finally:
+                target.close()
+
+        # Reads and writes are mixed on purpose, so throttling would only measure the throttle. This only
+        # reaches the app in this process, not a server benchmarked with --url
+        if options['throttle'] or options['url']:
+            settings_override = override_settings()
+        else:
+            settings_override = override_settings(THROTTLES={
+                scope: {'CAPACITY': 10 ** 9, 'RATE': 10 ** 9} for scope in settings.THROTTLES
+            })
+        with settings_override:
+            started = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['concurrency'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        operations_results = OrderedDict()
+        for operation in operations:
+            ordered = sorted(latencies[operation])
+            operations_results[operation] = OrderedDict([
+                ('requests', len(ordered)),
+                ('requests_per_second', len(ordered) / elapsed),
+                ('p50_ms', percentile(ordered, 0.50) * 1000 if ordered else None),
+                ('p95_ms', percentile(ordered, 0.95) * 1000 if ordered else None),
+                ('p99_ms', percentile(ordered, 0.99) * 1000 if ordered else None),
+                ('statuses', dict(statuses[operation])),
+                ('errors', errors[operation]),
+            ])
+        total = sum(result['requests'] for result in operations_results.values())
+        return OrderedDict([
+            ('target', options['url'] or 'in-process'),
+            ('options', OrderedDict((name, options[name]) for name in
+                                    ('users', 'posts', 'concurrency', 'duration', 'seed', 'throttle'))),
+            ('mix', mix),
+            ('elapsed', elapsed),
+            ('requests_per_second', total / elapsed),
+            ('operations', operations_results),
+        ])
+
+    def report(self, results):
+        self.stdout.write('{:<8} {:>9} {:>9} {:>9} {:>9} {:>9}  {}'.format(
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'statuses'))
+        for operation, result in results['operations'].items():
+            self.stdout.write('{:<8} {:>9} {:>9.1f} {:>9} {:>9} {:>9}  {}'.format(
+                operation, result['requests'], result['requests_per_second'],
+                *['{:.1f}'.format(result[name]) if result[name] is not None else '-'
+                  for name in ('p50_ms', 'p95_ms', 'p99_ms')],
+                ' '.join('{}x{}'.format(count, status) for status, count in sorted(result['statuses'].items())) +
+                (' {} errors'.format(result['errors']) if result['errors'] else '')))
+        self.stdout.write('Total: {:.1f} requests/s over {:.1f}s'.format(
+            results['requests_per_second'], results['elapsed']))
+
+    def compare(self, previous, results):
+        """
+        Print how each operation's throughput and p95 changed since the previous run
+        """
+        def change(old, new):
+            if not old or new is None:
+                return '-'
+            return '{:+.1f}%'.format((new - old) / old * 100)
+
+        self.stdout.write('Compared with the previous run:')
+        for operation, result in results['operations'].items():
+            old = previous['operations'].get(operation)
+            if old is None:
+                continue
+            self.stdout.write('{:<8} req/s {:>8}  p95 {:>8}'.format(
+                operation, change(old['requests_per_second'], result['requests_per_second']),
+                change(old['p95_ms'], result['p95_ms'])))
+        self.stdout.write('Total    req/s {:>8}'.format(
+            change(previous['requests_per_second'], results['requests_per_second'])))
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from post.export import iter_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Write every post as newline delimited JSON, the same as GET /post/export/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', help='Only export posts by the user with this username')
+        parser.add_argument('--since', help='Only export posts made at or after this ISO 8601 time')
+        parser.add_argument('--until', help='Only export posts made before this ISO 8601 time')
+        parser.add_argument('--after', help='Resume after this <posted_at>,<id>, taken from the last line exported')
+        parser.add_argument('--output', '-o', help='File to write to, instead of standard output')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='How many posts to read at a time')
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in ('author', 'since', 'until', 'after')
+                  if options[name] is not None}
+
+        output = open(options['output'], 'ab') if options['output'] else sys.stdout.buffer
+        try:
+            for lines in iter_ndjson(params, options['chunk_size']):
+                output.write(lines)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from post.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = 'Create the full text search index over posts if it is missing, and fill it from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database to rebuild the index in')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not install_search_index(connection):
+            raise CommandError('{} does not support full text search, posts will be searched with a scan'.format(
+                connection.vendor))
+        self.stdout.write('Rebuilt the search index')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from post.models import render_stored_posts
+
+
+class Command(BaseCommand):
+    help = 'Store the JSON of posts saved before it was stored with them, so the wall doesn\'t render them each time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='How many posts to render at a time')
+        parser.add_argument('--all', action='store_true',
+                            help='Render every post again, e.g. after changing how dates are formatted')
+
+    def handle(self, *args, **options):
+        rendered = 0
+        for count in render_stored_posts(options['batch_size'], everything=options['all']):
+            rendered += count
+            if options['verbosity'] > 1:
+                self.stdout.write('Rendered {} posts'.format(rendered))
+        self.stdout.write('Rendered {} posts'.format(rendered))
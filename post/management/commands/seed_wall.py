@@ -0,0 +1,40 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from post.seeding import seed_wall
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with made up users and posts for testing at scale, '
+            'the same ones every time for the same seed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='How many users to create')
+        parser.add_argument('--posts', type=int, default=100000, help='How many posts to create')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random data')
+        parser.add_argument('--days', type=int, default=365, help='How many days before now the posts cover')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='How much the most prolific users dominate, 0 spreads posts evenly')
+        parser.add_argument('--prefix', default='seed-', help='Start of every username created')
+        parser.add_argument('--password', help='Password for every user created, by default they cannot log in')
+        parser.add_argument('--batch-size', type=int, default=5000, help='How many rows to insert at a time')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['posts'] < 0 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users, --days and --batch-size must be at least 1, --posts at least 0')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError('There are already users called {}..., choose another --prefix'.format(
+                options['prefix']))
+
+        started = time.perf_counter()
+        seed_wall(random.Random(options['seed']), options['users'], options['posts'], prefix=options['prefix'],
+                  days=options['days'], skew=options['skew'], password=options['password'],
+                  batch_size=options['batch_size'], progress=self.progress if options['verbosity'] > 1 else None)
+        self.stdout.write('Created {} users and {} posts in {:.1f}s'.format(
+            options['users'], options['posts'], time.perf_counter() - started))
+
+    def progress(self, users, posts):
+        self.stdout.write('{} users, {} posts'.format(users, posts))
@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def copy_database(connection, path):
+    """
+    Write a consistent copy of the SQLite database behind connection to path, replacing whatever is there
+
+    The copy is written next to path and moved over it once it is complete, so nothing ever opens half of it.
+    Connections that are already open keep reading the old copy until they reconnect, which the SQLite backend
+    does at the next request (see WallApp/sqlite3/base.py). That is only safe
+    because the copy and the replica are in rollback journal mode (see WallApp/sqlite3/base.py), a write
+    ahead log next to path would belong to the old copy but be read with the new one.
+    """
+    partial = path + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    with connection.cursor() as cursor:
+        # The copy is in rollback journal mode, whatever mode the primary is in
+        cursor.execute('VACUUM INTO %s', [partial])
+    os.replace(partial, path)
+    # Left over from before replicas were kept out of WAL mode
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class Command(BaseCommand):
+    help = ('Copy the default SQLite database over each of settings.DATABASE_REPLICAS, '
+            'to try out reading from replicas locally')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep copying, this many seconds apart, instead of copying once')
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Only SQLite databases can be copied, use your database\'s own replication')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('There are no DATABASE_REPLICAS to copy to')
+
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                copy_database(connection, settings.DATABASES[alias]['NAME'])
+                self.stdout.write('Copied {} to {}'.format(DEFAULT_DB_ALIAS, alias))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -10,11 +10,11 @@ def load_data(apps, schema_editor):
     # version than this migration expects. We use the historical version.
     Post = apps.get_model('post', 'Post')
     User = apps.get_model('auth', 'User')
-    user_count = len(User.objects.all())
-    for i in range(20):
-        user = User.objects.get(pk=(i%user_count)+1)
-        post = Post.objects.create(author=user, text='text{}'.format(i))
-        post.save()
+    user_pks = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    # One INSERT for every post, use manage.py seed_wall to make a bigger wall
+    Post.objects.bulk_create([
+        Post(author_id=user_pks[i % len(user_pks)], text='text{}'.format(i)) for i in range(20)
+    ])
 
 class Migration(migrations.Migration):
 
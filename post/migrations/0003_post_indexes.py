@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 16:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0002_auto_20180310_2125'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='post',
+            options={'ordering': ('posted_at', 'id')},
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['posted_at', 'id'], name='post_posted_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'posted_at'], name='post_author_posted_at_idx'),
+        ),
+    ]
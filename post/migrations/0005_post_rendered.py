@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 18:02
+from __future__ import unicode_literals
+
+from django.db import migrations
+import post.models
+
+from post.search import install_search_index
+
+
+def reinstall_search_index(apps, schema_editor):
+    # SQLite adds and removes the column by rebuilding the table, which drops the triggers that keep the index
+    # up to date
+    install_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0004_post_search_index'),
+    ]
+
+    operations = [
+        # Run last when unapplying, after the column has been removed by rebuilding the table
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_index),
+        migrations.AddField(
+            model_name='post',
+            name='rendered',
+            field=post.models.RenderedPostField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
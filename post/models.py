@@ -1,4 +1,131 @@
-from django.db import models
+from collections import OrderedDict, namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.query import ValuesListIterable
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from post.cache import bump_wall_version
+from post.rendering import render_post_fragment
+from post.signals import posts_created, posts_deleted, posts_updated
+
+class PostRow(namedtuple('PostRow', ['id', 'author', 'posted_at', 'text'])):
+    """
+    A post as the wall shows it, with its author's username, read without building a model instance
+
+    Fields that weren't fetched are None
+    """
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+PostRow.__new__.__defaults__ = (None,) * len(PostRow._fields)
+
+# The column each field of a PostRow is read from
+POST_ROW_COLUMNS = OrderedDict([
+    ('id', 'id'),
+    ('author', 'author__username'),
+    ('posted_at', 'posted_at'),
+    ('text', 'text'),
+])
+
+
+class PostRowIterable(ValuesListIterable):
+    def __iter__(self):
+        rows = super(PostRowIterable, self).__iter__()
+        if len(self.queryset._fields) == len(PostRow._fields):
+            for row in rows:
+                yield PostRow._make(row)
+        else:
+            columns = {column: name for name, column in POST_ROW_COLUMNS.items()}
+            names = [columns[column] for column in self.queryset._fields]
+            for row in rows:
+                yield PostRow(**dict(zip(names, row)))
+
+
+class PostFragment(namedtuple('PostFragment', ['id', 'author', 'posted_at', 'rendered', 'text'])):
+    """
+    A post's id, author's username and stored JSON (see Post.rendered), for putting pages of the wall together
+
+    text is only fetched for posts whose JSON hasn't been stored yet, otherwise it is None
+    """
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+
+class PostFragmentIterable(ValuesListIterable):
+    def __iter__(self):
+        for row in super(PostFragmentIterable, self).__iter__():
+            yield PostFragment._make(row)
+
+
+class PostQuerySet(models.QuerySet):
+
+    def visible(self):
+        """
+        Leave out the posts of accounts that are being deleted, they are deleted in the background a batch at a
+        time (see accounts/deletion.py) but shouldn't be seen in the meantime
+
+        This is a subquery on the few deletions that are pending rather than a join, so posts read without their
+        author still don't join it.
+        """
+        AccountDeletion = apps.get_model('accounts', 'AccountDeletion')
+        pending = AccountDeletion.objects.filter(status=AccountDeletion.PENDING).values('user_id')
+        return self.exclude(author_id__in=pending)
+
+    def rows(self, fields=None):
+        """
+        Return the posts as PostRows, fetching only the columns the wall shows
+
+        fields narrows that down further, e.g. without author there is no join. The id and posted_at that
+        pages are found by are always fetched.
+        """
+        clone = self.values_list(*[column for name, column in POST_ROW_COLUMNS.items()
+                                   if fields is None or name in fields or name in ('id', 'posted_at')])
+        clone._iterable_class = PostRowIterable
+        return clone
+
+    def fast_delete(self):
+        """
+        Delete the posts with one DELETE, without loading them first, and return how many were deleted
+
+        QuerySet.delete() loads every post to send post_delete for each, as there are receivers for it.
+        Nothing refers to posts, so there is nothing to collect either, and callers send posts_deleted for
+        all of them at once instead. QuerySet._raw_delete is private to Django, keep its use to here.
+        """
+        return self._raw_delete(self.db)
+
+    def fragments(self):
+        """
+        Return the posts as PostFragments, to be rendered with post.rendering.render_posts()
+        """
+        clone = self.annotate(missing_text=Case(When(rendered='', then=F('text')), default=Value(None),
+                                                output_field=models.TextField()))
+        clone = clone.values_list('id', 'author__username', 'posted_at', 'rendered', 'missing_text')
+        clone._iterable_class = PostFragmentIterable
+        return clone
+
+
+class RenderedPostField(models.TextField):
+    """
+    A post's JSON, as far as it can be stored (see render_post_fragment()), rendered again every time it is saved
+
+    Its pre_save runs after posted_at's, so new posts are rendered with the time they are given. bulk_create
+    calls it too, but QuerySet.update and save(update_fields=...) without rendered don't.
+    """
+
+    def pre_save(self, model_instance, add):
+        value = render_post_fragment(model_instance.posted_at, model_instance.text)
+        setattr(model_instance, self.attname, value)
+        return value
+
 
 class Post(models.Model):
 
@@ -8,6 +135,64 @@ class Post(models.Model):
     posted_at = models.DateTimeField(auto_now_add=True)
     text = models.TextField()
     author = models.ForeignKey('auth.User', related_name='posts', on_delete=models.CASCADE)
+    # The post as JSON, so the wall can be put together without serializing every post on every request
+    rendered = RenderedPostField(blank=True, default='', editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
-        ordering = ('posted_at',)
\ No newline at end of file
+        # id breaks ties between posts made at the same time, so the wall always comes back in the same order
+        ordering = ('posted_at', 'id')
+        indexes = [
+            # The wall, in order
+            models.Index(fields=['posted_at', 'id'], name='post_posted_at_id_idx'),
+            # One author's posts, in order
+            models.Index(fields=['author', 'posted_at'], name='post_author_posted_at_idx'),
+        ]
+
+def render_stored_posts(batch_size=1000, everything=False):
+    """
+    Store the JSON of the posts that don't have it yet, or of every post if everything is set
+
+    A generator that renders the posts in batches of batch_size, in order of id, and yields how many it
+    rendered in each. Posts edited in the meantime are left as their own save rendered them.
+    """
+    posts = Post.objects.order_by('pk')
+    if not everything:
+        posts = posts.filter(rendered='')
+    connection = connections[router.db_for_write(Post)]
+    # Each post takes four query parameters, its id and text to match it, its JSON, and its id again in the IN
+    # list. SQLite before 3.32 allows only 999 in a query, so a batch may take more than one UPDATE.
+    pk_field, text_field, rendered_field = (Post._meta.get_field(name) for name in ('id', 'text', 'rendered'))
+    last = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last).values_list('pk', 'posted_at', 'text')[:batch_size])
+        if not batch:
+            return
+        update_size = connection.ops.bulk_batch_size([pk_field, text_field, rendered_field, pk_field], batch)
+        with transaction.atomic(using=connection.alias):
+            for start in range(0, len(batch), update_size):
+                rows = batch[start:start + update_size]
+                cases = [When(pk=pk, text=text, then=Value(render_post_fragment(posted_at, text)))
+                         for pk, posted_at, text in rows]
+                Post.objects.filter(pk__in=[pk for pk, posted_at, text in rows]).update(
+                    rendered=Case(*cases, default=F('rendered'), output_field=models.TextField()))
+        last = batch[-1][0]
+        yield len(batch)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(posts_created, sender=Post)
+@receiver(posts_updated, sender=Post)
+@receiver(posts_deleted, sender=Post)
+def post_changed(sender, **kwargs):
+    # Bump the wall version now, so this process stops serving pages from before the change, and again once
+    # the change is committed, in case another request cached the old rows in between
+    bump_wall_version()
+    transaction.on_commit(bump_wall_version)
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def author_changed(sender, instance=None, created=False, update_fields=None, **kwargs):
+    # Posts show their author's username, a brand new user has no posts yet
+    if not created and (update_fields is None or 'username' in update_fields):
+        post_changed(sender)
@@ -0,0 +1,196 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict, namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_text
+from django.utils.six.moves.urllib import parse as urlparse
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# A position on the wall, the (posted_at, id) pair of a post, and whether we are paging backwards from it
+Cursor = namedtuple('Cursor', ['posted_at', 'pk', 'reverse'])
+
+
+def keyset_filter(queryset, posted_at, pk, reverse=False):
+    """
+    Restrict a queryset to the posts strictly after (or before, when reverse is set) the post at (posted_at, pk)
+
+    The range condition on posted_at lets the (posted_at, id) index seek straight to the position,
+    the id comparison only breaks ties between posts made in the same instant
+    """
+    if reverse:
+        return queryset.filter(Q(posted_at__lt=posted_at) | Q(pk__lt=pk), posted_at__lte=posted_at)
+    return queryset.filter(Q(posted_at__gt=posted_at) | Q(pk__gt=pk), posted_at__gte=posted_at)
+
+
+class WallPagination(PageNumberPagination):
+    """
+    Page number pagination for the wall, with an opt in keyset (cursor) mode
+
+    Page numbers need a COUNT(*) over the whole table and an OFFSET scan that gets slower the deeper you go,
+    so clients that scroll can ask for ?pagination=cursor instead. Cursor pages are found by seeking to a
+    (posted_at, id) position, which costs the same on page 1000 as on page 1. Cursor responses have opaque
+    next and previous links, plus a newer link that a client can hold on to and poll for posts made after the
+    newest one it has seen.
+    """
+    cursor_query_param = 'cursor'
+    cursor_query_description = 'The pagination cursor value.'
+    mode_query_param = 'pagination'
+    mode_query_description = 'Set to "cursor" to page through posts with cursors instead of page numbers.'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def use_cursor(self, request):
+        """
+        Cursor mode is used when asked for explicitly, or when following a link that carries a cursor
+        """
+        # Search results are in order of how well they match, which cursors can't seek through
+        if request.query_params.get('q'):
+            return False
+        return (self.cursor_query_param in request.query_params or
+                request.query_params.get(self.mode_query_param) == 'cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.use_cursor(request)
+        if not self.cursor_mode:
+            return super(WallPagination, self).paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            reverse = False
+        else:
+            reverse = self.cursor.reverse
+            queryset = keyset_filter(queryset, self.cursor.posted_at, self.cursor.pk, reverse)
+
+        if reverse:
+            queryset = queryset.order_by('-posted_at', '-id')
+        else:
+            queryset = queryset.order_by('posted_at', 'id')
+
+        # Fetch one extra post to find out if there is anything past this page, instead of counting
+        results = list(queryset[:page_size + 1])
+        self.has_more = len(results) > page_size
+        self.page = results[:page_size]
+        if reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super(WallPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('newer', self.get_newer_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super(WallPagination, self).get_next_link()
+        reverse = self.cursor is not None and self.cursor.reverse
+        if not reverse and not self.has_more:
+            return None
+        return self.get_newer_link()
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super(WallPagination, self).get_previous_link()
+        reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is None or (reverse and not self.has_more):
+            return None
+        if self.page:
+            first = self.page[0]
+            return self.encode_cursor(Cursor(first.posted_at, first.pk, reverse=True))
+        # We paged forwards past the end of the wall, so go back to the page ending with the post we started after
+        return self.encode_cursor(Cursor(self.cursor.posted_at, self.cursor.pk + 1, reverse=True))
+
+    def get_newer_link(self):
+        """
+        Link to the posts made after the newest post on this page
+        """
+        if self.page:
+            last = self.page[-1]
+            return self.encode_cursor(Cursor(last.posted_at, last.pk, reverse=False))
+        if self.cursor is not None and not self.cursor.reverse:
+            return self.encode_cursor(self.cursor)
+        # There is nothing on the wall (or nothing before where we paged back from), so start from the top
+        return replace_query_param(remove_query_param(self.base_url, self.cursor_query_param),
+                                   self.mode_query_param, 'cursor')
+
+    def decode_cursor(self, request):
+        """
+        Turn the cursor in the request (if there is one) into a Cursor
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = urlparse.parse_qs(querystring, keep_blank_values=True)
+            posted_at = parse_datetime(tokens['p'][0])
+            pk = int(tokens['i'][0])
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if posted_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(posted_at, pk, reverse)
+
+    def encode_cursor(self, cursor):
+        """
+        Turn a Cursor into a link to the page it points at
+        """
+        tokens = OrderedDict([('p', cursor.posted_at.isoformat()), ('i', str(cursor.pk))])
+        if cursor.reverse:
+            tokens['r'] = '1'
+        querystring = urlparse.urlencode(tokens)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        fields = super(WallPagination, self).get_schema_fields(view)
+        fields += [
+            coreapi.Field(
+                name=self.mode_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Pagination',
+                    description=force_text(self.mode_query_description)
+                )
+            ),
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description=force_text(self.cursor_query_description)
+                )
+            )
+        ]
+        return fields
+
+
+class FeedPagination(WallPagination):
+    """
+    Always pages by cursor, for feeds like one user's posts that can grow without limit and are only scrolled
+    """
+
+    def use_cursor(self, request):
+        return True
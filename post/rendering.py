@@ -0,0 +1,45 @@
+from collections import OrderedDict
+
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+
+renderer = JSONRenderer()
+posted_at_field = serializers.DateTimeField(read_only=True)
+
+
+def render_post_fragment(posted_at, text):
+    """
+    Render a post's posted_at and text the way JSONRenderer renders them in a PostSerializer, without the braces
+
+    This is what Post.rendered holds. It is all of a post's JSON that only changes when the post itself is
+    saved, the id isn't known before the post is inserted and the author's username can change under it.
+    """
+    # Posts are read back from the database in UTC, and rendered that way
+    if timezone.is_aware(posted_at):
+        posted_at = posted_at.astimezone(timezone.utc)
+    data = OrderedDict((
+        ('posted_at', posted_at_field.to_representation(posted_at)),
+        ('text', text),
+    ))
+    return renderer.render(data)[1:-1].decode('utf-8')
+
+
+def render_posts(fragments):
+    """
+    Render PostFragments (see Post.objects.fragments()) as a JSON array, the same as JSONRenderer renders
+    PostSerializer's output for them
+
+    The stored fragment is used as it is, only the id and author are rendered. Posts saved before fragments
+    were stored, and not yet filled in by the render_posts command, come with their text and are rendered
+    from scratch.
+    """
+    authors = {}
+    parts = []
+    for post in fragments:
+        author = authors.get(post.author)
+        if author is None:
+            author = authors[post.author] = renderer.render(post.author).decode('utf-8')
+        parts.append('{{"id":{},"author":{},{}}}'.format(
+            post.id, author, post.rendered or render_post_fragment(post.posted_at, post.text)))
+    return ('[' + ','.join(parts) + ']').encode('utf-8')
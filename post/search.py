@@ -0,0 +1,117 @@
+from django.db import OperationalError, connections, transaction
+
+# An external content FTS5 table, it indexes post_post.text without keeping a second copy of it.
+# The triggers keep the index in step with every write to post_post, including bulk and raw ones.
+SEARCH_TABLE = 'post_post_fts'
+
+CREATE_SEARCH_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_post_fts USING fts5(text, content='post_post', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS post_post_fts_insert AFTER INSERT ON post_post BEGIN "
+    "INSERT INTO post_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS post_post_fts_delete AFTER DELETE ON post_post BEGIN "
+    "INSERT INTO post_post_fts(post_post_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS post_post_fts_update AFTER UPDATE OF text ON post_post BEGIN "
+    "INSERT INTO post_post_fts(post_post_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO post_post_fts(rowid, text) VALUES (new.id, new.text); "
+    "END",
+]
+
+DROP_SEARCH_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS post_post_fts_insert",
+    "DROP TRIGGER IF EXISTS post_post_fts_delete",
+    "DROP TRIGGER IF EXISTS post_post_fts_update",
+]
+
+DROP_SEARCH_INDEX = DROP_SEARCH_TRIGGERS + [
+    "DROP TABLE IF EXISTS post_post_fts",
+]
+
+REBUILD_SEARCH_INDEX = "INSERT INTO post_post_fts(post_post_fts) VALUES ('rebuild')"
+
+# Whether each database has the search index, looked up once per process
+_has_search_index = {}
+
+
+def install_search_index(connection):
+    """
+    Create the search index and its triggers if they are missing, and fill it from post_post
+
+    Does nothing on databases other than SQLite, or on SQLite builds without FTS5, which are searched
+    with a scan instead. SQLite drops triggers when a table is rebuilt, so migrations that alter post_post
+    have to call this again afterwards.
+    """
+    _has_search_index.pop(connection.alias, None)
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            for statement in CREATE_SEARCH_INDEX:
+                cursor.execute(statement)
+            cursor.execute(REBUILD_SEARCH_INDEX)
+    except OperationalError:
+        # No such module: fts5
+        return False
+    return True
+
+
+def uninstall_search_index(connection):
+    _has_search_index.pop(connection.alias, None)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for statement in DROP_SEARCH_INDEX:
+                cursor.execute(statement)
+
+
+def pause_search_index(connection):
+    """
+    Stop keeping the search index up to date, until install_search_index rebuilds it in one go
+
+    For loading many posts at once, which is much quicker than indexing them row by row. The index table
+    is kept, so search still works, but misses whatever changed while it was paused.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for statement in DROP_SEARCH_TRIGGERS:
+                cursor.execute(statement)
+
+
+def has_search_index(using='default'):
+    if using not in _has_search_index:
+        connection = connections[using]
+        _has_search_index[using] = (connection.vendor == 'sqlite' and
+                                    SEARCH_TABLE in connection.introspection.table_names())
+    return _has_search_index[using]
+
+
+def make_match_query(text):
+    """
+    Turn what someone typed into an FTS5 query that matches posts containing every word of it
+
+    Each word is quoted, so nothing typed is read as FTS5 syntax
+    """
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+def search_posts(queryset, text):
+    """
+    Narrow down posts to the ones that contain every word of text, best matches first
+
+    Uses the FTS5 index where there is one, otherwise falls back to a case insensitive scan of every post
+    in wall order
+    """
+    query = make_match_query(text)
+    if not query:
+        return queryset
+    if not has_search_index(queryset.db):
+        for word in text.split():
+            queryset = queryset.filter(text__icontains=word)
+        return queryset
+    # Joining on rowid lets SQLite start from the matches in the index and look each post up by id
+    return queryset.extra(
+        tables=[SEARCH_TABLE],
+        where=['{0}.rowid = post_post.id'.format(SEARCH_TABLE), '{0} MATCH %s'.format(SEARCH_TABLE)],
+        params=[query],
+        order_by=['{0}.rank'.format(SEARCH_TABLE), 'id'],
+    )
@@ -0,0 +1,148 @@
+import itertools
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from accounts.models import Profile
+from post.cache import bump_wall_version
+from post.models import Post
+from post.rendering import render_post_fragment
+from post.search import has_search_index, install_search_index, pause_search_index
+
+WORDS = (
+    'the wall is up today again just got back from work and this weekend coffee tea morning night '
+    'anyone seen new post hello world thanks everyone great idea lunch dinner home city train late '
+    'early happy tired finally weather rain sun music movie book game friends family call soon love'
+).split()
+
+# How busy each hour of the day is, quiet overnight and busiest in the evening
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 2, 4, 6, 8, 8, 8, 9, 10, 9, 8, 8, 9, 10, 12, 14, 14, 12, 8, 4]
+HOUR_CUM_WEIGHTS = list(itertools.accumulate(HOUR_WEIGHTS))
+
+
+def insert_posts(posts, using):
+    """
+    Insert posts with the posted_at each was given, which bulk_create would replace with now
+
+    The rows are written with one prepared INSERT rather than through Post's fields, so nothing about the
+    model has to change for the other threads using it meanwhile
+    """
+    fields = [Post._meta.get_field(name) for name in ('posted_at', 'text', 'author', 'rendered')]
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote_name(Post._meta.db_table), ', '.join(quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+    for post in posts:
+        post.rendered = render_post_fragment(post.posted_at, post.text)
+    rows = [[field.get_db_prep_save(getattr(post, field.attname), connection) for field in fields] for post in posts]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+@contextmanager
+def search_index_paused(using):
+    """
+    Stop indexing posts as they are inserted, and rebuild the search index once at the end
+    """
+    connection = connections[using]
+    paused = has_search_index(using)
+    if paused:
+        pause_search_index(connection)
+    try:
+        yield
+    finally:
+        if paused:
+            install_search_index(connection)
+
+
+def recent(rng, start, end):
+    """
+    A random time between start and end, more likely to be recent, as activity grows over time
+    """
+    return start + (end - start) * (rng.random() ** 0.5)
+
+
+def make_text(rng):
+    length = min(60, 1 + int(rng.expovariate(1 / 12)))
+    return ' '.join(rng.choices(WORDS, k=length)).capitalize()
+
+
+def seed_users(rng, count, prefix, start, end, password=None, batch_size=5000, progress=None):
+    """
+    Create count users called prefix followed by a number, who joined between start and end
+
+    Every user gets the same password hash, hashing is slow on purpose. Returns each user's pk and when they
+    joined, in the order they were made.
+    """
+    password = make_password(password)
+    using = router.db_for_write(User)
+    for offset in range(0, count, batch_size):
+        users = [User(username='{}{}'.format(prefix, i), email='{}{}@example.com'.format(prefix, i),
+                      password=password, date_joined=recent(rng, start, end))
+                 for i in range(offset, min(count, offset + batch_size))]
+        with transaction.atomic(using=using):
+            User.objects.using(using).bulk_create(users)
+        if progress:
+            progress(offset + len(users), 0)
+    # SQLite doesn't return the pks of bulk created rows
+    return list(User.objects.using(using).filter(username__startswith=prefix)
+                .order_by('pk').values_list('pk', 'date_joined'))
+
+
+def seed_posts(rng, authors, count, end, skew=1.1, batch_size=5000, progress=None):
+    """
+    Create count posts by authors, a list of (pk, date_joined)
+
+    Authors are picked with a Zipf like skew, so a few of them write most of the posts, as on a real wall.
+    Each post is made some time after its author joined, mostly recently and mostly in the evening.
+    Returns how many posts each author got.
+    """
+    authors = list(authors)
+    # Who is prolific shouldn't depend on when they joined
+    rng.shuffle(authors)
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, len(authors) + 1)))
+    using = router.db_for_write(Post)
+    counts = Counter()
+
+    with search_index_paused(using):
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            posts = []
+            for (author, joined), hour in zip(rng.choices(authors, cum_weights=cum_weights, k=size),
+                                              rng.choices(range(24), cum_weights=HOUR_CUM_WEIGHTS, k=size)):
+                day = recent(rng, joined, end)
+                posted_at = day.replace(hour=hour, minute=0, second=0, microsecond=0) + timedelta(
+                    seconds=rng.random() * 3600)
+                posts.append(Post(author_id=author, posted_at=min(max(posted_at, joined), end), text=make_text(rng)))
+                counts[author] += 1
+            with transaction.atomic(using=using):
+                insert_posts(posts, using)
+            if progress:
+                progress(len(authors), offset + len(posts))
+    # Inserting the rows sends no signals, so let the wall cache know about every post at once
+    bump_wall_version()
+    return counts
+
+
+def seed_wall(rng, users, posts, prefix='seed-', days=365, skew=1.1, password=None, batch_size=5000,
+              end=None, progress=None):
+    """
+    Create users and posts spread over the days up to end, the same ones every time for the same rng seed
+
+    Returns the (pk, date_joined) of each user made
+    """
+    end = end or timezone.now()
+    start = end - timedelta(days=days)
+    authors = seed_users(rng, users, prefix, start, end, password=password, batch_size=batch_size,
+                         progress=progress)
+    counts = seed_posts(rng, authors, posts, end, skew=skew, batch_size=batch_size, progress=progress)
+    # Nor do the users get the profiles that hold their post counts
+    Profile.objects.bulk_create([Profile(user_id=pk, post_count=counts[pk]) for pk, joined in authors],
+                                batch_size=batch_size)
+    return authors
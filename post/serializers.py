@@ -1,9 +1,37 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
 from post.models import Post
+from WallApp.sparse_fields import SparseFieldsSerializerMixin
 
-class PostSerializer(serializers.HyperlinkedModelSerializer):
+class PostSerializer(SparseFieldsSerializerMixin, serializers.HyperlinkedModelSerializer):
     author = serializers.ReadOnlyField(source='author.username')
 
     class Meta:
         model = Post
-        fields = ('id', 'author', 'posted_at', 'text')
\ No newline at end of file
+        fields = ('id', 'author', 'posted_at', 'text')
+
+class PostRowSerializer(serializers.BaseSerializer):
+    """
+    Read only serializer for PostRows (see Post.objects.rows()) that gives exactly the same output as PostSerializer
+
+    PostSerializer looks up every field of every post through DRF's field machinery, which is most of the
+    time spent listing posts. This builds each post directly, reading posts is all it can do.
+    """
+    posted_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        fields = PostSerializer.Meta.fields
+
+    def to_representation(self, row):
+        data = OrderedDict((
+            ('id', row.id),
+            ('author', row.author),
+            ('posted_at', self.posted_at.to_representation(row.posted_at)),
+            ('text', row.text),
+        ))
+        # Only the fields picked with ?fields= or ?omit=, see WallApp/sparse_fields.py
+        selected = self.context.get('fields')
+        if selected is not None:
+            data = OrderedDict((name, value) for name, value in data.items() if name in selected)
+        return data
@@ -0,0 +1,14 @@
+from django.dispatch import Signal
+
+# Writing posts in bulk skips Post.save() and Post.delete(), so post_save and post_delete aren't sent.
+# Code that writes posts in bulk sends these instead, anything that keeps track of posts should listen for both.
+
+# Sent after posts are created in bulk, posts is a list of the new posts
+posts_created = Signal(providing_args=['posts'])
+
+# Sent after posts are edited with a single UPDATE, pks is a list of the ids of the edited posts
+posts_updated = Signal(providing_args=['pks'])
+
+# Sent after posts are deleted with a single DELETE, pks is a list of the ids of the deleted posts
+# and author_ids a list of their authors' ids, in the same order
+posts_deleted = Signal(providing_args=['pks', 'author_ids'])
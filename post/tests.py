@@ -1,13 +1,37 @@
-from post.models import Post
+from post.models import Post, render_stored_posts
+from accounts.models import Profile, ThrottleBucket
+from post.serializers import PostRowSerializer, PostSerializer
+from post.views import PostViewSet
 from django.contrib.auth.models import User
 from django.test import Client
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from django.db.models import Count
 from rest_framework import status
 from WallApp.test_utils import *
 from rest_framework.test import APITestCase
 import json
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from post.cache import get_wall_cache, LRUWallCache, DjangoWallCache
+from post.events import get_post_hub, iter_events, PostHub
+from post.export import iter_ndjson, iter_post_chunks
+from post import search
+from post.management.commands import benchmark
+from post.rendering import render_post_fragment
+from WallApp.routers import primary_reads
+from post.seeding import seed_wall
+from django.core.management import call_command, CommandError
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from io import StringIO
+from unittest import mock
+from rest_framework.renderers import JSONRenderer
 
 global N_TEST_USERS
 global USERNAMES
@@ -206,4 +230,1287 @@ class PostTest(APITestCase):
             self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN,
                              'Was able to edit a user\'s post as admin')
 
-        self.logout()
\ No newline at end of file
+        self.logout()
+
+class WallPaginationTest(APITestCase):
+    """
+    All tests related to paging through the wall with cursors
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+
+        # The data migration already put 20 posts on the wall, add some more so there are a few pages
+        for i in range(15):
+            Post.objects.create(author=self.user, text='cursor{}'.format(i))
+        self.all_pks = list(Post.objects.order_by('posted_at', 'id').values_list('pk', flat=True))
+
+    def walk(self, url, link):
+        """
+        Follow the given link from url until it runs out, returning the pks seen on each page
+        """
+        pages = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get a page of posts')
+            pages += [[post['id'] for post in response.json()['results']]]
+            url = response.json()[link]
+        return pages
+
+    def test_walk_forwards_and_backwards(self):
+        """
+        Make sure that following next links visits every post once and in order, and previous links go back
+        """
+        pages = self.walk('/post/?pagination=cursor', 'next')
+        self.assertEqual(sum(pages, []), self.all_pks, 'Following next links did not visit every post in order')
+        self.assertTrue(all(len(page) == 10 for page in pages[:-1]), 'Cursor pages were not full')
+
+        # Go to the last page, then walk back to the start
+        response = self.client.get('/post/?pagination=cursor')
+        while response.json()['next'] is not None:
+            response = self.client.get(response.json()['next'])
+        back_pages = self.walk(response.json()['previous'], 'previous')
+        self.assertEqual(sum(reversed(back_pages), []) + pages[-1], self.all_pks,
+                         'Following previous links did not visit every post in order')
+
+    def test_cursor_pages_do_not_count(self):
+        """
+        Make sure that cursor pages never run COUNT(*) or OFFSET queries
+        """
+        response = self.client.get('/post/?pagination=cursor')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.json()['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the second page of posts')
+        self.assertEqual(len(queries), 1, 'Getting a cursor page took more than one query')
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'], 'Getting a cursor page counted the table')
+            self.assertNotIn('OFFSET', query['sql'], 'Getting a cursor page used an offset')
+
+    def test_newer_link(self):
+        """
+        Make sure that the newer link only returns posts made after the page was fetched
+        """
+        response = self.client.get('/post/?pagination=cursor')
+        while response.json()['next'] is not None:
+            response = self.client.get(response.json()['next'])
+        newer = response.json()['newer']
+
+        response = self.client.get(newer)
+        self.assertEqual(response.json()['results'], [], 'Newer link returned posts that were already seen')
+        self.assertEqual(response.json()['newer'], newer, 'Newer link moved without any new posts')
+
+        post = Post.objects.create(author=self.user, text='brand new')
+        response = self.client.get(newer)
+        self.assertEqual([result['id'] for result in response.json()['results']], [post.pk],
+                         'Newer link did not return the new post')
+
+    def test_invalid_cursor(self):
+        """
+        Make sure that a mangled cursor is a 404 rather than a server error
+        """
+        response = self.client.get('/post/?cursor=notacursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Mangled cursor was not rejected')
+
+    def test_page_numbers_still_work(self):
+        """
+        Make sure that page number pagination is still the default
+        """
+        response = self.client.get('/post/?page=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the second page of posts')
+        self.assertEqual(response.json()['count'], len(self.all_pks), 'Did not get the right number of posts')
+        self.assertEqual([post['id'] for post in response.json()['results']], self.all_pks[10:20],
+                         'Second page did not have the right posts')
+
+
+class PostQueryBudgetTest(APITestCase):
+    """
+    Make sure that every post endpoint runs a fixed number of queries, however many posts and authors there are
+
+    If one of these fails, something has started loading related objects one at a time (N+1 queries)
+    """
+
+    # Authenticating with a token takes one query (the token joined with its user) the first time it is used,
+    # after that it is cached. Throttling takes one query once the user has a bucket, and counting the user's posts
+    # takes one once they have a profile, which the tests start with.
+    # These are the budgets for requests made in the order test_write_budgets makes them.
+    QUERY_BUDGETS = {
+        'list': 2,           # count + page
+        'cursor list': 1,    # page
+        'retrieve': 1,       # post
+        'create': 4,         # token + throttle + insert + post count
+        'partial_update': 2, # update + post
+        'destroy': 2,        # delete + post count
+        'bulk_create': 6,    # token + throttle + savepoint + ids + post count + release savepoint, as well as the inserts
+    }
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+
+        self.users = []
+        for i in range(N_TEST_USERS):
+            self.users += [User.objects.create_user(username=USERNAMES[i],
+                                                    email=EMAILS[i],
+                                                    password=PASSWORDS[i])]
+
+        # Fill more than a page with posts from different authors, so an N+1 would show up
+        for i in range(15):
+            author = User.objects.create_user(username='budget{}'.format(i), password='budgetpassword')
+            Post.objects.create(author=author, text='budget{}'.format(i))
+        self.post = Post.objects.create(author=self.users[0], text=POSTS[0])
+        ThrottleBucket.objects.create(key='post:user:{}'.format(self.users[0].pk), tokens=10, updated_at=time.time())
+
+    def login(self, username):
+        token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_list_budget(self):
+        """
+        Make sure listing posts does not look up each author separately
+        """
+        with self.assertNumQueries(self.QUERY_BUDGETS['list']):
+            response = self.client.get('/post/?page=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the list of posts')
+
+        with self.assertNumQueries(self.QUERY_BUDGETS['cursor list']):
+            response = self.client.get('/post/?pagination=cursor')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the list of posts')
+
+    def test_retrieve_budget(self):
+        """
+        Make sure getting a post loads its author in the same query
+        """
+        with self.assertNumQueries(self.QUERY_BUDGETS['retrieve']):
+            response = self.client.get('/post/{}/'.format(self.post.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get a post')
+
+    def test_write_budgets(self):
+        """
+        Make sure creating, editing and deleting a post does not reload the author
+        """
+        self.login(USERNAMES[0])
+
+        with self.assertNumQueries(self.QUERY_BUDGETS['create']):
+            response = self.client.post('/post/', {'text': POSTS[1]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Could not create a post')
+
+        with self.assertNumQueries(self.QUERY_BUDGETS['partial_update']):
+            response = self.client.patch('/post/{}/'.format(self.post.pk),
+                                         json.dumps({'text': POSTS[2]}),
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not edit a post')
+
+        with self.assertNumQueries(self.QUERY_BUDGETS['destroy']):
+            response = self.client.delete('/post/{}/'.format(self.post.pk))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT, 'Could not delete a post')
+
+
+class WallFilterTest(APITestCase):
+    """
+    All tests related to narrowing down the wall by author and time
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+
+        self.users = []
+        for i in range(N_TEST_USERS):
+            self.users += [User.objects.create_user(username=USERNAMES[i],
+                                                    email=EMAILS[i],
+                                                    password=PASSWORDS[i])]
+        self.test_posts = []
+        for i in range(N_TEST_USERS):
+            self.test_posts += [Post.objects.create(author=self.users[i], text=POSTS[i])]
+
+    def explain(self, url):
+        """
+        GET url, and return the query plans of the queries that it ran
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the list of posts')
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans += [' '.join(str(row[-1]) for row in cursor.fetchall())]
+        return plans
+
+    def test_filter_by_author(self):
+        """
+        Make sure that ?author= only returns that author's posts
+        """
+        for i in range(N_TEST_USERS):
+            response = self.client.get('/post/', {'author': USERNAMES[i]})
+            self.assertEqual([post['id'] for post in response.json()['results']], [self.test_posts[i].pk],
+                             'Did not get only the author\'s posts')
+
+        response = self.client.get('/post/', {'author': 'nobody'})
+        self.assertEqual(response.json()['count'], 0, 'Got posts for an author that does not exist')
+
+    def test_filter_by_time(self):
+        """
+        Make sure that ?since= and ?until= only return posts in that range
+        """
+        middle = self.test_posts[1].posted_at.isoformat()
+
+        response = self.client.get('/post/', {'since': middle, 'pagination': 'cursor'})
+        self.assertEqual([post['id'] for post in response.json()['results']],
+                         [post.pk for post in self.test_posts[1:]], 'Since did not include posts from then on')
+
+        response = self.client.get('/post/', {'author': USERNAMES[0], 'until': middle})
+        self.assertEqual([post['id'] for post in response.json()['results']], [self.test_posts[0].pk],
+                         'Until did not exclude posts from then on')
+
+        response = self.client.get('/post/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Invalid since was not rejected')
+
+    def test_filters_use_indexes(self):
+        """
+        Make sure that every way of filtering the wall is answered from an index, without sorting the table
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are only checked on SQLite')
+
+        since = self.test_posts[0].posted_at.isoformat()
+        expected_indexes = {
+            '/post/?pagination=cursor': 'post_posted_at_id_idx',
+            '/post/?since={}'.format(since): 'post_posted_at_id_idx',
+            '/post/?since={}&until=2100-01-01&pagination=cursor'.format(since): 'post_posted_at_id_idx',
+            '/post/?author={}'.format(USERNAMES[0]): 'post_author_posted_at_idx',
+            '/post/?author={}&since={}'.format(USERNAMES[0], since): 'post_author_posted_at_idx',
+            '/post/?author={}&pagination=cursor'.format(USERNAMES[0]): 'post_author_posted_at_idx',
+        }
+        for url, index in expected_indexes.items():
+            # The last query is the one that gets the page of posts
+            plan = self.explain(url.replace('+', '%2B'))[-1]
+            self.assertIn(index, plan, '{} did not use {}: {}'.format(url, index, plan))
+            self.assertNotIn('TEMP B-TREE', plan, '{} sorted the posts: {}'.format(url, plan))
+
+
+class WallCacheTest(APITestCase):
+    """
+    All tests related to caching rendered pages of the wall
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        get_wall_cache().clear()
+
+        self.users = []
+        for i in range(N_TEST_USERS):
+            self.users += [User.objects.create_user(username=USERNAMES[i],
+                                                    email=EMAILS[i],
+                                                    password=PASSWORDS[i])]
+
+    def login(self, username):
+        token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def test_cached_page_skips_database(self):
+        """
+        Make sure that asking for the same page twice only hits the database once
+        """
+        first = self.client.get('/post/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/post/')
+        self.assertEqual(second.status_code, status.HTTP_200_OK, 'Could not get the cached list of posts')
+        self.assertEqual(first.content, second.content, 'Cached page was not the same as the rendered one')
+
+        # Pages deep in the wall are not cached
+        self.client.get('/post/?page=6')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/post/?page=6')
+        self.assertNotEqual(len(queries), 0, 'A page past WALL_CACHE[\'PAGES\'] was cached')
+
+    def test_changes_invalidate_pages(self):
+        """
+        Make sure that creating, editing and deleting posts are seen straight away
+        """
+        self.login(USERNAMES[0])
+        url = '/post/?pagination=cursor&author={}'.format(USERNAMES[0])
+
+        self.assertEqual(self.client.get(url).json()['results'], [], 'Test user already had posts')
+
+        response = self.client.post('/post/', {'text': POSTS[0]})
+        post_id = response.json()['id']
+        texts = [post['text'] for post in self.client.get(url).json()['results']]
+        self.assertEqual(texts, [POSTS[0]], 'Cached page did not show a new post')
+
+        self.client.patch('/post/{}/'.format(post_id), json.dumps({'text': POSTS[1]}),
+                          content_type='application/json')
+        texts = [post['text'] for post in self.client.get(url).json()['results']]
+        self.assertEqual(texts, [POSTS[1]], 'Cached page did not show an edited post')
+
+        self.client.delete('/post/{}/'.format(post_id))
+        self.assertEqual(self.client.get(url).json()['results'], [], 'Cached page still showed a deleted post')
+
+        # Renaming the author changes how their posts look
+        Post.objects.create(author=self.users[0], text=POSTS[2])
+        self.client.get(url)
+        self.users[0].username = 'renamed'
+        self.users[0].save()
+        url = '/post/?pagination=cursor&author=renamed'
+        authors = [post['author'] for post in self.client.get(url).json()['results']]
+        self.assertEqual(authors, ['renamed'], 'Cached page did not show the author\'s new username')
+
+    def test_lru_eviction(self):
+        """
+        Make sure that the in process cache throws away the least recently used page when it is full
+        """
+        cache = LRUWallCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None, 'Least recently used page was not evicted')
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3), 'Recently used pages were evicted')
+
+        version = cache.get_version()
+        cache.bump_version()
+        self.assertGreater(cache.get_version(), version, 'Bumping did not change the version')
+        self.assertEqual(len(cache), 0, 'Bumping the version kept stale pages')
+
+    @override_settings(WALL_CACHE={'BACKEND': 'post.cache.DjangoWallCache', 'PAGES': 5, 'MAX_AGE': 5})
+    def test_django_cache_backend(self):
+        """
+        Make sure that pages can be kept in one of Django's caches instead
+        """
+        self.assertIsInstance(get_wall_cache(), DjangoWallCache, 'WALL_CACHE backend was not used')
+        count = self.client.get('/post/').json()['count']
+        with self.assertNumQueries(0):
+            self.client.get('/post/')
+
+        Post.objects.create(author=self.users[0], text=POSTS[0])
+        response = self.client.get('/post/')
+        self.assertEqual(response.json()['count'], count + 1, 'Cached page did not show a new post')
+
+    def test_replicas(self):
+        """
+        Make sure that cached pages are read from the primary, and pages read from a replica get no ETag
+        """
+        with mock.patch('post.views.replicas_allowed', return_value=True), \
+                mock.patch('post.views.primary_reads', side_effect=primary_reads) as primary:
+            response = self.client.get('/post/')
+            self.assertTrue(primary.called, 'Page was cached without reading it from the primary')
+            self.assertTrue(response.has_header('ETag'), 'Page read from the primary had no ETag')
+
+            primary.reset_mock()
+            # The browsable API isn't cached
+            response = self.client.get('/post/', HTTP_ACCEPT='text/html')
+            self.assertFalse(primary.called, 'Page that is not cached was read from the primary')
+            self.assertFalse(response.has_header('ETag'), 'Page that may be from a replica had an ETag')
+
+    def test_shared_version(self):
+        """
+        Make sure that by default every worker sees the wall version bumped by any of them
+        """
+        self.assertIsInstance(get_wall_cache(), DjangoWallCache, 'Default wall cache was not shared')
+        # Two workers each have their own wall cache, over the same Django cache
+        worker = DjangoWallCache()
+        version = worker.get_version()
+        Post.objects.create(author=self.users[0], text=POSTS[0])
+        self.assertNotEqual(worker.get_version(), version, 'Other workers did not see the new version')
+
+
+class ConditionalGetTest(APITestCase):
+    """
+    All tests related to ETags and caching headers on posts
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.post = Post.objects.create(author=self.user, text=POSTS[0])
+
+    def test_not_modified(self):
+        """
+        Make sure that clients with an up to date copy get a 304 without any posts being read
+        """
+        for url in ('/post/', '/post/{}/'.format(self.post.pk)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get posts')
+            etag = response['ETag']
+            self.assertFalse(response.has_header('Last-Modified'),
+                             'Last-Modified can\'t tell apart changes made within a second')
+
+            # A single post is looked up first, in case it was deleted
+            with self.assertNumQueries(0 if url == '/post/' else 1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, 'Matching ETag was not a 304')
+            self.assertEqual(response.content, b'', '304 response had a body')
+            self.assertEqual(response['ETag'], etag, '304 response did not repeat the ETag')
+
+            # Once a post changes, the old ETag no longer matches
+            Post.objects.create(author=self.user, text=POSTS[1])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Stale ETag was a 304')
+            self.assertNotEqual(response['ETag'], etag, 'ETag did not change with the posts')
+
+        # Deleting a post changes the ETag too, but a client that got the new one still mustn't get a 304 for it
+        url = '/post/{}/'.format(self.post.pk)
+        Post.objects.filter(pk=self.post.pk).delete()
+        etag = self.client.get('/post/')['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Deleted post was a 304')
+
+    def test_cache_headers(self):
+        """
+        Make sure that only anonymous responses can be kept by shared caches
+        """
+        response = self.client.get('/post/')
+        self.assertIn('public', response['Cache-Control'], 'Anonymous list was not cacheable by proxies')
+        self.assertIn('max-age', response['Cache-Control'], 'Anonymous list had no max-age')
+        self.assertIn('Authorization', response['Vary'], 'Response did not vary on Authorization')
+        self.assertIn('Accept', response['Vary'], 'Response did not vary on Accept')
+
+        token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get('/post/')
+        self.assertIn('private', response['Cache-Control'], 'Logged in list was cacheable by proxies')
+        self.assertIn('no-cache', response['Cache-Control'], 'Logged in list was not revalidated')
+
+        # Writes are never cached
+        response = self.client.post('/post/', {'text': POSTS[2]})
+        self.assertFalse(response.has_header('ETag'), 'Creating a post returned an ETag')
+
+
+class BulkCreateTest(APITestCase):
+    """
+    All tests related to creating many posts at once
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        ThrottleBucket.objects.create(key='bulk_post:user:{}'.format(self.user.pk),
+                                      tokens=PostViewSet.bulk_max_size, updated_at=time.time())
+        Profile.objects.create(user=self.user)
+
+    def login(self, username):
+        token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def post_bulk(self, posts):
+        return self.client.post('/post/bulk/', json.dumps(posts), content_type='application/json')
+
+    def test_bulk_create(self):
+        """
+        Make sure that every post is created, in a fixed number of queries, and returned with its id
+        """
+        self.login(USERNAMES[0])
+        posts = [{'text': 'bulk{}'.format(i)} for i in range(PostViewSet.bulk_max_size)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_bulk(posts)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Could not create posts in bulk')
+
+        # The database limits how many rows go in one INSERT, but it should be as few as that allows
+        fields = [field for field in Post._meta.concrete_fields if not field.primary_key]
+        batch_size = connection.ops.bulk_batch_size(fields, posts) or len(posts)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "post_post"')]
+        self.assertEqual(len(inserts), -(-len(posts) // batch_size), 'Posts were not inserted in bulk')
+        self.assertLessEqual(len(queries) - len(inserts), PostQueryBudgetTest.QUERY_BUDGETS['bulk_create'],
+                             'Creating posts in bulk took too many queries')
+
+        results = response.json()
+        self.assertEqual([result['text'] for result in results], [post['text'] for post in posts],
+                         'Bulk results were not in the same order as the posts')
+        for result in results:
+            post = Post.objects.get(pk=result['id'])
+            self.assertEqual(post.text, result['text'], 'Bulk result had the wrong id')
+            self.assertEqual(post.author, self.user, 'Bulk post had the wrong author')
+            self.assertEqual(result['author'], USERNAMES[0], 'Bulk result had the wrong author')
+
+    def test_bulk_create_is_all_or_nothing(self):
+        """
+        Make sure that one invalid post means nothing is created, and the errors say which post was invalid
+        """
+        self.login(USERNAMES[0])
+        count = Post.objects.count()
+
+        response = self.post_bulk([{'text': POSTS[0]}, {'text': ''}, {'text': POSTS[2]}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Invalid post was accepted')
+        errors = response.json()
+        self.assertEqual(len(errors), 3, 'Did not get a result for each post')
+        self.assertEqual(errors[0], {}, 'Valid post had errors')
+        self.assertIn('text', errors[1], 'Invalid post had no errors')
+        self.assertEqual(Post.objects.count(), count, 'Posts were created even though one was invalid')
+
+        response = self.post_bulk({'text': POSTS[0]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Posts that weren\'t a list were accepted')
+
+        response = self.post_bulk([{'text': POSTS[0]}] * (PostViewSet.bulk_max_size + 1))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Too many posts were accepted')
+
+    def test_bulk_create_needs_login(self):
+        """
+        Make sure that posts can't be created in bulk anonymously
+        """
+        response = self.post_bulk([{'text': POSTS[0]}])
+        self.assertNotEqual(response.status_code, status.HTTP_201_CREATED, 'Was able to post without logging in')
+
+
+class OwnerScopedWriteTest(APITestCase):
+    """
+    All tests related to editing and deleting posts with a single statement
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+
+        self.users = []
+        for i in range(N_TEST_USERS):
+            self.users += [User.objects.create_user(username=USERNAMES[i],
+                                                    email=EMAILS[i],
+                                                    password=PASSWORDS[i])]
+        User.objects.create_superuser(username=ADMIN_USERNAME, email=ADMIN_EMAIL, password=ADMIN_PASSWORD)
+        self.post = Post.objects.create(author=self.users[0], text=POSTS[0])
+        self.missing_pk = Post.objects.order_by('-pk').values_list('pk', flat=True)[0] + 1
+
+    def login(self, username):
+        token = Token.objects.get(user__username=username)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def patch(self, pk, data):
+        return self.client.patch('/post/{}/'.format(pk), json.dumps(data), content_type='application/json')
+
+    def test_update_responses(self):
+        """
+        Make sure that edits answer with the same statuses as when posts were loaded and checked first
+        """
+        response = self.patch(self.post.pk, {'text': 'anonymous'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, 'Anonymous edit was not a 401')
+
+        self.login(USERNAMES[1])
+        response = self.patch(self.post.pk, {'text': 'not mine'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Editing someone else\'s post was not a 403')
+        response = self.patch(self.missing_pk, {'text': 'missing'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Editing a missing post was not a 404')
+        response = self.patch(self.post.pk, {'text': ''})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN,
+                         'Invalid edit of someone else\'s post was not a 403')
+        response = self.patch(self.missing_pk, {'text': ''})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND,
+                         'Invalid edit of a missing post was not a 404')
+        response = self.patch('notanid', {'text': 'missing'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Editing a bad id was not a 404')
+
+        self.login(USERNAMES[0])
+        response = self.patch(self.post.pk, {'text': ''})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Empty text was accepted')
+        response = self.patch(self.post.pk, {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Empty edit was not accepted')
+        response = self.client.put('/post/{}/'.format(self.post.pk), json.dumps({'text': POSTS[1]}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not replace a post')
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.text, POSTS[1], 'Post was not edited')
+        self.assertEqual(response.json(), PostSerializer(self.post).data, 'Edit did not return the edited post')
+
+    def test_destroy_responses(self):
+        """
+        Make sure that deletes answer with the same statuses as when posts were loaded and checked first
+        """
+        url = '/post/{}/'.format(self.post.pk)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED, 'Anonymous delete was not a 401')
+
+        self.login(USERNAMES[1])
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN, 'Deleting someone else\'s post was not a 403')
+        self.assertTrue(Post.objects.filter(pk=self.post.pk).exists(), 'Post was deleted by someone else')
+
+        self.login(ADMIN_USERNAME)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT, 'Admin could not delete a post')
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, 'Deleting a missing post was not a 404')
+
+
+class PostExportTest(APITestCase):
+    """
+    All tests related to exporting the whole wall
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+
+        self.users = []
+        for i in range(N_TEST_USERS):
+            self.users += [User.objects.create_user(username=USERNAMES[i],
+                                                    email=EMAILS[i],
+                                                    password=PASSWORDS[i])]
+        for i in range(N_TEST_USERS):
+            Post.objects.create(author=self.users[i], text=POSTS[i])
+
+    def export(self, query=''):
+        """
+        GET the export, and return the posts in it
+        """
+        response = self.client.get('/post/export/' + query, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not export the wall')
+        self.assertTrue(response.streaming, 'Export was not streamed')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson', 'Export was not NDJSON')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.endswith('\n'), 'Export did not end with a newline')
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_export_everything(self):
+        """
+        Make sure that every post is exported once, oldest first, the same as the API shows it
+        """
+        posts = self.export()
+        expected = PostSerializer(Post.objects.select_related('author').order_by('posted_at', 'id'), many=True).data
+        self.assertEqual(posts, json.loads(json.dumps(expected)), 'Export was not every post in order')
+
+    def test_export_filters(self):
+        """
+        Make sure that the export takes the same filters as the wall
+        """
+        posts = self.export('?author=' + USERNAMES[0])
+        self.assertEqual([post['author'] for post in posts], [USERNAMES[0]], 'Export by author was wrong')
+
+        since = Post.objects.order_by('-posted_at').values_list('posted_at', flat=True)[N_TEST_USERS - 1]
+        posts = self.export('?since=' + since.isoformat().replace('+00:00', 'Z'))
+        self.assertEqual(len(posts), N_TEST_USERS, 'Export since a time was wrong')
+
+        response = self.client.get('/post/export/?since=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, 'Bad since was accepted')
+
+    def test_export_resume(self):
+        """
+        Make sure that an export can pick up after the last line it got
+        """
+        posts = self.export()
+        last = posts[9]
+        rest = self.export('?after={},{}'.format(last['posted_at'], last['id']))
+        self.assertEqual(rest, posts[10:], 'Resumed export did not carry on from the last post')
+
+        for after in ('42', 'yesterday,42', '2018-03-10T21:25:00Z,notanid'):
+            response = self.client.get('/post/export/?after=' + after)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST,
+                             'Bad after {} was accepted'.format(after))
+
+    def test_export_chunks(self):
+        """
+        Make sure that the export reads a chunk of posts per query, with no query per post
+        """
+        total = Post.objects.count()
+        chunks = list(iter_post_chunks({}, chunk_size=7))
+        self.assertEqual([len(chunk) for chunk in chunks], [7] * (total // 7) + [total % 7] * bool(total % 7),
+                         'Export was not read in chunks')
+
+        with CaptureQueriesContext(connection) as queries:
+            lines = b''.join(iter_ndjson({}, chunk_size=7)).splitlines()
+        self.assertEqual(len(lines), total, 'Export did not have a line per post')
+        self.assertEqual(len(queries), total // 7 + 1, 'Export did not take one query per chunk')
+
+    def test_export_command(self):
+        """
+        Make sure that the export_posts command writes the same lines as the endpoint
+        """
+        output = os.path.join(tempfile.mkdtemp(), 'posts.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('export_posts', output=output, chunk_size=5, author=USERNAMES[1])
+        with open(output, 'rb') as export:
+            posts = [json.loads(line.decode('utf-8')) for line in export]
+        self.assertEqual(posts, self.export('?author=' + USERNAMES[1]), 'Command export was wrong')
+
+        with self.assertRaises(CommandError):
+            call_command('export_posts', output=output, after='notanid')
+
+
+class PostEventsTest(APITestCase):
+    """
+    All tests related to streaming new posts as they are made
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.posts = [Post.objects.create(author=self.user, text=text) for text in POSTS]
+
+    def stream(self, **extra):
+        """
+        GET the event stream, and return the ids and posts it sent
+        """
+        response = self.client.get('/post/events/', **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the event stream')
+        self.assertTrue(response.streaming, 'Events were not streamed')
+        self.assertEqual(response['Content-Type'], 'text/event-stream', 'Events were not Server-Sent Events')
+        events = []
+        for chunk in response.streaming_content:
+            if chunk.startswith(b'id: '):
+                lines = chunk.decode('utf-8').splitlines()
+                events += [(int(lines[0][len('id: '):]), json.loads(lines[2][len('data: '):]))]
+        return events
+
+    @override_settings(WALL_EVENTS={'BUFFER': 10, 'CATCH_UP': 10, 'HEARTBEAT': 0.01, 'MAX_DURATION': 0, 'RETRY': 3})
+    def test_catch_up(self):
+        """
+        Make sure that a client reconnecting with Last-Event-ID gets every post it missed
+        """
+        last = self.posts[1]
+        events = self.stream(HTTP_LAST_EVENT_ID=str(last.pk))
+        expected = PostSerializer(Post.objects.filter(pk__gt=last.pk).order_by('id'), many=True).data
+        self.assertEqual([pk for pk, post in events], [post['id'] for post in expected],
+                         'Catch up did not send the posts after Last-Event-ID')
+        self.assertEqual([post for pk, post in events], json.loads(json.dumps(expected)),
+                         'Catch up did not send the posts as the API shows them')
+
+        events = self.stream(QUERY_STRING='last_event_id={}'.format(last.pk))
+        self.assertEqual(len(events), len(expected), 'Catch up ignored ?last_event_id=')
+        self.assertEqual(self.stream(), [], 'Catch up happened without Last-Event-ID')
+
+    @override_settings(WALL_EVENTS={'BUFFER': 1, 'CATCH_UP': 1, 'HEARTBEAT': 0.01, 'MAX_DURATION': 0.1, 'RETRY': 3})
+    def test_catch_up_pages(self):
+        """
+        Make sure that catch up sends every post missed, however many more than CATCH_UP there are
+        """
+        last = self.posts[0]
+        expected = list(Post.objects.filter(pk__gt=last.pk).order_by('id').values_list('id', flat=True))
+        self.assertGreater(len(expected), 1, 'Too few posts to page through')
+        events = self.stream(HTTP_LAST_EVENT_ID=str(last.pk))
+        self.assertEqual([pk for pk, post in events], expected, 'Reconnecting client missed posts')
+
+        # A stream that falls further behind than the hub remembers reads everything it missed back
+        hub = PostHub(max_events=1)
+        stream = iter_events(hub, hub.position, last.pk)
+        content = b''
+        while b'keep-alive' not in content:
+            content += next(stream)
+        posts = [Post.objects.create(author=self.user, text='new post {}'.format(i)) for i in range(5)]
+        hub.publish(posts)
+        content = b''
+        while b'keep-alive' not in content:
+            content += next(stream)
+        sent = [int(line[len('id: '):]) for line in content.decode('utf-8').splitlines() if line.startswith('id: ')]
+        self.assertEqual(sent, [post.pk for post in posts], 'Stream that fell behind missed posts')
+
+    @override_settings(WALL_EVENTS={'BUFFER': 10, 'CATCH_UP': 10, 'HEARTBEAT': 0.01, 'MAX_DURATION': 0.1, 'RETRY': 3})
+    def test_new_posts(self):
+        """
+        Make sure that posts are sent to open streams once they are committed
+        """
+        before = len(connection.run_on_commit)
+        post = Post.objects.create(author=self.user, text='new post')
+        response = self.client.get('/post/events/')
+        self.assertEqual(get_post_hub().wait(0, 0), ([], False), 'Post was published before it was committed')
+
+        # TestCase never commits, so run what would have run on commit by hand
+        for savepoints, callback in connection.run_on_commit[before:]:
+            callback()
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('id: {}\nevent: post\n'.format(post.pk), content, 'New post was not sent')
+        self.assertIn(': keep-alive\n', content, 'Idle stream was not kept alive')
+        self.assertTrue(content.startswith('retry: 3000\n'), 'Stream did not say when to reconnect')
+
+    def test_hub(self):
+        """
+        Make sure that the hub tells a stream when it has fallen too far behind
+        """
+        hub = PostHub(max_events=2)
+        self.assertEqual(hub.wait(hub.position, 0), ([], False), 'Hub had posts before any were published')
+        hub.publish(self.posts[:2])
+        events, missed = hub.wait(0, 0)
+        self.assertEqual([pk for position, pk, data in events], [post.pk for post in self.posts[:2]],
+                         'Hub did not send the published posts')
+        self.assertFalse(missed, 'Stream that was not behind was told it missed posts')
+
+        hub.publish(self.posts[2:3])
+        events, missed = hub.wait(0, 0)
+        self.assertTrue(missed, 'Stream that fell behind was not told it missed posts')
+        self.assertEqual(hub.wait(hub.position, 0), ([], False), 'Stream that was up to date got posts')
+
+
+class WallSearchTest(APITestCase):
+    """
+    All tests related to searching the wall
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.long = Post.objects.create(author=self.user, text='kiwi and a lot of other words to make it long')
+        self.short = Post.objects.create(author=self.user, text='Kiwi kiwi kiwi')
+        self.other = Post.objects.create(author=self.user, text='banana')
+        get_wall_cache().clear()
+
+    def search(self, query):
+        """
+        Search the wall, and return the ids of the posts found
+        """
+        response = self.client.get('/post/', {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not search for {}'.format(query))
+        return [post['id'] for post in response.json()['results']]
+
+    def test_search(self):
+        """
+        Make sure that ?q= finds the posts with every word in it, best matches first
+        """
+        self.assertEqual(self.search('kiwi'), [self.short.pk, self.long.pk], 'Search was not ranked')
+        self.assertEqual(self.search('kiwi words'), [self.long.pk], 'Search did not need every word')
+        self.assertEqual(self.search('BANANA'), [self.other.pk], 'Search was case sensitive')
+        self.assertEqual(self.search('cherry'), [], 'Search found posts without the word')
+        response = self.client.get('/post/', {'q': ''})
+        self.assertEqual(response.json()['count'], Post.objects.count(), 'Empty search did not return the wall')
+        for query in ('"', 'kiwi OR', 'NEAR(kiwi', '*', 'text:kiwi'):
+            self.search(query)
+
+        response = self.client.get('/post/', {'q': 'kiwi', 'pagination': 'cursor'})
+        self.assertEqual(response.json()['count'], 2, 'Search was not paged by number')
+
+    def test_search_follows_writes(self):
+        """
+        Make sure that the search index keeps up with posts being edited and deleted
+        """
+        self.other.text = 'kiwi banana'
+        self.other.save()
+        self.assertIn(self.other.pk, self.search('kiwi'), 'Edited post was not found')
+        self.assertEqual(self.search('banana'), [self.other.pk], 'Edited post was not found')
+
+        self.short.delete()
+        self.assertNotIn(self.short.pk, self.search('kiwi'), 'Deleted post was found')
+
+        Post.objects.bulk_create([Post(author=self.user, text='cherry')])
+        self.assertEqual(len(self.search('cherry')), 1, 'Bulk created post was not found')
+
+    def test_search_uses_index(self):
+        """
+        Make sure that search is answered from the full text index instead of a scan of every post
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.search('kiwi')
+        with connection.cursor() as cursor:
+            for query in queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+                self.assertIn('VIRTUAL TABLE', plan, 'Search did not use the index')
+                self.assertNotIn('SCAN post_post', plan.replace('SCAN post_post_fts', ''), 'Search scanned every post')
+
+    def test_search_without_index(self):
+        """
+        Make sure that search still works on databases without a full text index
+        """
+        self.addCleanup(search._has_search_index.clear)
+        search._has_search_index['default'] = False
+        self.assertEqual(self.search('kiwi'), [self.long.pk, self.short.pk], 'Search without the index was wrong')
+        self.assertEqual(self.search('words kiwi'), [self.long.pk], 'Search without the index was wrong')
+
+    def test_rebuild_command(self):
+        """
+        Make sure that rebuild_search_index brings back an index that has fallen out of step
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO post_post_fts(post_post_fts) VALUES ('delete-all')")
+        self.assertEqual(self.search('kiwi'), [], 'Index was not emptied')
+        call_command('rebuild_search_index', stdout=StringIO())
+        # The index was changed behind the wall cache's back
+        get_wall_cache().clear()
+        self.assertEqual(self.search('kiwi'), [self.short.pk, self.long.pk], 'Index was not rebuilt')
+
+
+class PostRowSerializerTest(APITestCase):
+    """
+    All tests related to reading posts without model instances
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        texts = POSTS + ['Ünïcödé ✓ 🦇', 'quotes " and \' and \\ backslashes', 'line\nbreaks\tand tabs', '<b>html</b>']
+        for text in texts:
+            Post.objects.create(author=self.user, text=text)
+        # A time with no microseconds is written differently
+        self.post = Post.objects.latest('id')
+        self.post.posted_at = datetime(2018, 3, 10, 21, 25, tzinfo=timezone.utc)
+        self.post.save()
+
+    def test_golden_output(self):
+        """
+        Make sure that reading posts as rows gives byte for byte the same JSON as PostSerializer
+        """
+        renderer = JSONRenderer()
+        expected = renderer.render(PostSerializer(Post.objects.select_related('author'), many=True).data)
+        self.assertEqual(renderer.render(PostRowSerializer(Post.objects.rows(), many=True).data), expected,
+                         'Rows were not serialized the same as posts')
+
+        urls = ['/post/', '/post/?page=2', '/post/?pagination=cursor', '/post/?q=and',
+                '/post/?author=' + USERNAMES[0], '/post/{}/'.format(self.post.pk)]
+        responses = {}
+        for use_rows in (True, False):
+            get_wall_cache().clear()
+            with mock.patch.object(PostViewSet, 'use_rows', return_value=use_rows):
+                for url in urls:
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get {}'.format(url))
+                    responses.setdefault(url, []).append(response.content)
+        for url, (rows_content, posts_content) in responses.items():
+            self.assertEqual(rows_content, posts_content, '{} was not the same read as rows'.format(url))
+
+    def test_rows_query(self):
+        """
+        Make sure that rows only fetch the columns the wall shows
+        """
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(Post.objects.rows())
+        self.assertEqual(len(queries), 1, 'Rows took more than one query')
+        self.assertNotIn('password', queries[0]['sql'], 'Rows fetched every column of the author')
+        self.assertIn(self.post.pk, [row.pk for row in rows], 'Rows did not have a pk')
+
+    def test_browsable_api(self):
+        """
+        Make sure that the browsable API still gets posts it can build forms from
+        """
+        token = Token.objects.get(user__username=USERNAMES[0])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get('/post/{}/'.format(self.post.pk), HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not browse a post')
+        self.assertContains(response, '<form', msg_prefix='Browsable API had no form for the owner')
+
+    def test_benchmark_command(self):
+        """
+        Make sure that bench_serializers runs
+        """
+        stdout, stderr = StringIO(), StringIO()
+        call_command('bench_serializers', posts=10, repeat=1, stdout=stdout, stderr=stderr)
+        self.assertEqual(stderr.getvalue(), '', 'Serializers gave different output')
+        self.assertIn('PostRowSerializer', stdout.getvalue(), 'Benchmark did not time PostRowSerializer')
+        self.assertIn('Stored JSON', stdout.getvalue(), 'Benchmark did not time stored JSON')
+
+    def test_stored_json(self):
+        """
+        Make sure that the JSON stored with each post is kept up to date, and pages made from it match PostSerializer
+        """
+        def wall():
+            get_wall_cache().clear()
+            response = self.client.get('/post/?author=' + self.user.username)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get the wall')
+            return response.json()['results']
+
+        def expected():
+            return PostSerializer(Post.objects.filter(author=self.user).select_related('author'), many=True).data
+
+        for post in Post.objects.filter(author=self.user):
+            self.assertEqual(post.rendered, render_post_fragment(post.posted_at, post.text),
+                             'Post was not rendered when it was saved')
+
+        token = Token.objects.get(user__username=USERNAMES[0])
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.patch('/post/{}/'.format(self.post.pk), {'text': 'edited'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not edit post')
+        self.assertIn('"text":"edited"', Post.objects.get(pk=self.post.pk).rendered, 'Edit was not rendered')
+        self.client.credentials()
+
+        # The username isn't stored with the posts, so changing it needs nothing rendered again
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(wall(), expected(), 'Wall did not show the new username')
+
+        # Posts saved before the JSON was stored with them are rendered as they are read, until the command runs
+        Post.objects.filter(pk=self.post.pk).update(rendered='')
+        self.assertEqual(wall(), expected(), 'Wall was wrong for posts without stored JSON')
+        missing = Post.objects.filter(rendered='').count()
+        stdout = StringIO()
+        call_command('render_posts', batch_size=2, stdout=stdout)
+        self.assertIn('Rendered {} posts'.format(missing), stdout.getvalue(),
+                      'Command did not render the missing posts')
+        self.assertFalse(Post.objects.filter(rendered='').exists(), 'Command left posts without JSON')
+        self.assertEqual(Post.objects.get(pk=self.post.pk).rendered,
+                         render_post_fragment(self.post.posted_at, 'edited'), 'Command did not store the JSON')
+        self.assertEqual(wall(), expected(), 'Wall was wrong after the command ran')
+
+    def test_render_many(self):
+        """
+        Make sure that rendering a large batch stays within SQLite's limit of 999 parameters a query
+        """
+        Post.objects.bulk_create([Post(author=self.user, text='many{}'.format(i)) for i in range(600)])
+        Post.objects.update(rendered='')
+        count = Post.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sum(render_stored_posts(batch_size=1000)), count, 'Not every post was rendered')
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), -(-count // (999 // 4)), 'Batch was not split to fit the parameter limit')
+        self.assertFalse(Post.objects.filter(rendered='').exists(), 'Posts were left without JSON')
+
+
+class BenchmarkTest(APITestCase):
+    """
+    All tests related to the benchmark command
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.command = benchmark.Command(stdout=StringIO())
+        self.options = {'users': 3, 'posts': 30, 'seed': 1}
+
+    def test_seed(self):
+        """
+        Make sure that the benchmark seeds users with tokens and gives each of them posts to edit
+        """
+        workload = self.command.seed(self.options)
+        self.assertEqual(len(workload.users), 3, 'Wrong number of benchmark users')
+        self.assertEqual(sum(len(posts) for posts in workload.posts_by_author.values()), 30,
+                         'Wrong number of benchmark posts')
+        for author, token in workload.users:
+            self.assertTrue(Token.objects.filter(user_id=author, key=token).exists(), 'Benchmark user had no token')
+
+    def test_operations(self):
+        """
+        Make sure that every operation in the mix succeeds against the app
+        """
+        workload = self.command.seed(self.options)
+        target = benchmark.InProcessTarget()
+        expected = {'wall': status.HTTP_200_OK, 'detail': status.HTTP_200_OK, 'create': status.HTTP_201_CREATED,
+                    'patch': status.HTTP_200_OK, 'delete': status.HTTP_204_NO_CONTENT,
+                    'signup': status.HTTP_201_CREATED}
+        rng = random.Random(0)
+        with override_settings(THROTTLES={'post': {'CAPACITY': 100, 'RATE': 1},
+                                          'bulk_post': {'CAPACITY': 100, 'RATE': 1},
+                                          'signup': {'CAPACITY': 100, 'RATE': 1}}):
+            for operation in benchmark.DEFAULT_MIX:
+                status_code, content = workload.run(operation, target, rng)
+                self.assertEqual(status_code, expected[operation], '{} failed: {}'.format(operation, content))
+
+    def test_authors_without_posts(self):
+        """
+        Make sure that operations on posts only pick posts that are there, and are skipped once there are none
+        """
+        workload = self.command.seed(self.options)
+        target = benchmark.InProcessTarget()
+        rng = random.Random(0)
+        # Leave one author with a single post
+        authors = [author for author, token in workload.users]
+        for author in authors[1:]:
+            workload.posts_by_author[author] = []
+        del workload.posts_by_author[authors[0]][1:]
+        for operation in ('detail', 'patch', 'detail'):
+            status_code, content = workload.run(operation, target, rng)
+            self.assertEqual(status_code, status.HTTP_200_OK, '{} picked a missing post: {}'.format(operation, content))
+        status_code, content = workload.run('delete', target, rng)
+        self.assertEqual(status_code, status.HTTP_204_NO_CONTENT, 'Could not delete the last post')
+        for operation in ('detail', 'patch', 'delete'):
+            self.assertIsNone(workload.run(operation, target, rng), '{} ran without a post'.format(operation))
+
+    @override_settings(ACCOUNT_DELETION={'MODE': 'eager', 'BATCH_SIZE': 500, 'LEASE': 300, 'POLL_INTERVAL': 30},
+                       THROTTLES={'post': {'CAPACITY': 100, 'RATE': 1}, 'bulk_post': {'CAPACITY': 100, 'RATE': 1},
+                                  'signup': {'CAPACITY': 100, 'RATE': 1}})
+    def test_server(self):
+        """
+        Make sure that benchmarking a server makes its users and posts through the API, and deletes only those
+        """
+        bystander = User.objects.create_user(username=benchmark.BENCH_PREFIX + 'bystander', password=PASSWORDS[0])
+        target = benchmark.InProcessTarget()
+        workload = benchmark.Workload([], defaultdict(list), 1, prefix=benchmark.BENCH_PREFIX + 'run-')
+        self.command.seed_server(self.options, target, workload)
+        self.assertEqual(len(workload.users), 3, 'Wrong number of benchmark users')
+        self.assertEqual(Post.objects.filter(author__username__startswith=workload.prefix).count(), 30,
+                         'Wrong number of benchmark posts')
+        status_code, content = workload.run('signup', target, random.Random(0))
+        self.assertEqual(status_code, status.HTTP_201_CREATED, 'Could not sign up: {}'.format(content))
+
+        pks = [pk for pk, username in workload.accounts]
+        # TestCase never commits, so run what eager mode runs on commit straight away
+        with mock.patch('accounts.deletion.transaction.on_commit', side_effect=lambda callback: callback()):
+            self.command.clean_server(target, workload)
+        self.assertFalse(User.objects.filter(pk__in=pks).exists(), 'Benchmark accounts were not deleted')
+        self.assertFalse(Post.objects.filter(author_id__in=pks).exists(), 'Benchmark posts were not deleted')
+        self.assertTrue(User.objects.filter(pk=bystander.pk).exists(),
+                        'An account the benchmark did not make was deleted')
+
+    def test_report(self):
+        """
+        Make sure that percentiles, the report and the comparison are worked out right
+        """
+        self.assertEqual(benchmark.percentile(list(range(1, 101)), 0.5), 50, 'Wrong median')
+        self.assertEqual(benchmark.percentile(list(range(1, 101)), 0.99), 99, 'Wrong 99th percentile')
+        self.assertIsNone(benchmark.percentile([], 0.5), 'Percentile of nothing was not None')
+        with self.assertRaises(CommandError):
+            self.command.parse_mix('wall=1,nonsense=2')
+
+        results = {'elapsed': 2.0, 'requests_per_second': 10.0, 'operations': {
+            'wall': {'requests': 20, 'requests_per_second': 10.0, 'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0,
+                     'statuses': {'200': 20}, 'errors': 0}}}
+        faster = json.loads(json.dumps(results))
+        faster['operations']['wall']['requests_per_second'] = faster['requests_per_second'] = 15.0
+        self.command.report(results)
+        self.command.compare(results, faster)
+        output = self.command.stdout.getvalue()
+        self.assertIn('20x200', output, 'Report did not count statuses')
+        self.assertIn('+50.0%', output, 'Comparison did not show the change in throughput')
+
+
+class SeedWallTest(APITestCase):
+    """
+    All tests related to seeding the wall with made up users and posts
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.end = datetime(2018, 3, 10, 21, 25, tzinfo=timezone.utc)
+
+    def seeded_posts(self, prefix):
+        posts = Post.objects.filter(author__username__startswith=prefix).select_related('author')
+        return [(post.author.username[len(prefix):], post.posted_at, post.text) for post in posts]
+
+    def test_deterministic(self):
+        """
+        Make sure that the same seed makes the same wall
+        """
+        for prefix in ('first-', 'second-'):
+            seed_wall(random.Random(1), 10, 200, prefix=prefix, end=self.end, batch_size=50)
+        self.assertEqual(len(self.seeded_posts('first-')), 200, 'Wrong number of posts seeded')
+        self.assertEqual(self.seeded_posts('first-'), self.seeded_posts('second-'), 'Same seed made different posts')
+
+        seed_wall(random.Random(2), 10, 200, prefix='third-', end=self.end, batch_size=50)
+        self.assertNotEqual(self.seeded_posts('first-'), self.seeded_posts('third-'),
+                            'Different seeds made the same posts')
+
+    def test_realistic(self):
+        """
+        Make sure that posts come after their author joined, and that a few authors write most of them
+        """
+        seed_wall(random.Random(1), 20, 1000, prefix='seed-', days=30, end=self.end)
+        posts = Post.objects.filter(author__username__startswith='seed-').select_related('author')
+        for post in posts:
+            self.assertGreaterEqual(post.posted_at, post.author.date_joined, 'Post was made before its author joined')
+            self.assertLessEqual(post.posted_at, self.end, 'Post was made in the future')
+            self.assertGreaterEqual(post.posted_at, self.end - timedelta(days=30), 'Post was made too long ago')
+
+        counts = sorted(User.objects.filter(username__startswith='seed-').annotate(
+            n=Count('posts')).values_list('n', flat=True), reverse=True)
+        self.assertGreater(sum(counts[:4]), sum(counts[4:]), 'The most prolific authors did not write most posts')
+
+    def test_batches(self):
+        """
+        Make sure that users and posts are inserted in batches, and that search still finds them
+        """
+        with CaptureQueriesContext(connection) as queries:
+            seed_wall(random.Random(1), 10, 100, prefix='seed-', end=self.end, batch_size=50)
+        # Each batch is one prepared INSERT run for every post in it
+        inserts = [query['sql'] for query in queries if 'INSERT INTO "post_post"' in query['sql']]
+        self.assertEqual(len(inserts), 2, 'Posts were not inserted in batches')
+        post = Post.objects.filter(author__username__startswith='seed-').first()
+        self.assertEqual(post.rendered, render_post_fragment(post.posted_at, post.text),
+                         'Seeded post did not have its JSON stored')
+
+        text = Post.objects.filter(author__username__startswith='seed-').first().text
+        response = self.client.get('/post/', {'q': text})
+        self.assertGreaterEqual(response.json()['count'], 1, 'Search did not find a seeded post')
+
+    def test_command(self):
+        """
+        Make sure that seed_wall creates what it was asked to, and won't reuse a prefix
+        """
+        stdout = StringIO()
+        call_command('seed_wall', users=5, posts=50, stdout=stdout)
+        self.assertEqual(User.objects.filter(username__startswith='seed-').count(), 5, 'Wrong number of users')
+        self.assertEqual(Post.objects.filter(author__username__startswith='seed-').count(), 50,
+                         'Wrong number of posts')
+        with self.assertRaises(CommandError):
+            call_command('seed_wall', users=5, posts=50, stdout=stdout)
+
+
+class SparseFieldsTest(APITestCase):
+    """
+    All tests related to asking for only some fields of posts
+    """
+
+    def setUp(self):
+        """
+        Set up tests
+        """
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=USERNAMES[0], email=EMAILS[0], password=PASSWORDS[0])
+        self.post = Post.objects.create(author=self.user, text=POSTS[0])
+        get_wall_cache().clear()
+
+    def get(self, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, 'Could not get {}'.format(url))
+        return response, [query['sql'] for query in queries]
+
+    def test_fields(self):
+        """
+        Make sure that ?fields= and ?omit= prune the posts and the columns read for them
+        """
+        for url in ('/post/?fields=id,text', '/post/?omit=author,posted_at', '/post/?pagination=cursor&fields=text,id'):
+            response, queries = self.get(url)
+            for post in response.json()['results']:
+                self.assertEqual(list(post), ['id', 'text'], '{} did not prune the posts'.format(url))
+            self.assertNotIn('auth_user', queries[-1], '{} joined the author'.format(url))
+
+        response, queries = self.get('/post/{}/?fields=author'.format(self.post.pk))
+        self.assertEqual(response.json(), {'author': USERNAMES[0]}, 'Post was not pruned')
+        self.assertNotIn('"post_post"."text"', queries[-1], 'Text was read without being asked for')
+
+        response, queries = self.get('/post/?fields=id,text&pagination=cursor')
+        self.assertEqual(self.client.get(response.json()['next']).status_code, status.HTTP_200_OK,
+                         'Could not follow a cursor without posted_at in the posts')
+
+    def test_browsable_api(self):
+        """
+        Make sure that posts read as model instances are pruned the same way
+        """
+        response, queries = self.get('/post/', HTTP_ACCEPT='text/html')
+        self.assertContains(response, '&quot;author&quot;', msg_prefix='Browsable API did not show the author')
+        response, queries = self.get('/post/?fields=id,text', HTTP_ACCEPT='text/html')
+        self.assertNotIn('auth_user', ' '.join(queries), 'Browsable API joined the author')
+        self.assertNotContains(response, '&quot;author&quot;', msg_prefix='Browsable API showed the author')
+
+    def test_unknown_fields(self):
+        """
+        Make sure that asking for fields posts don't have, or for none at all, is an error, and that writes aren't
+        pruned
+        """
+        for url in ('/post/?fields=password', '/post/?omit=id,nonsense', '/post/?fields=&format=json',
+                    '/post/?fields=,', '/post/?omit=id,author,posted_at,text', '/post/?fields=id&omit=id'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, '{} was not an error'.format(url))
+
+        token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.post('/post/?fields=id', {'text': POSTS[1]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, 'Could not create a post')
+        self.assertEqual(response.json()['text'], POSTS[1], 'Created post was pruned')
@@ -1,5 +1,5 @@
 from django.conf.urls import url, include
-from post import views
+from post import events, views
 from rest_framework.routers import DefaultRouter
 
 # Create a router and register our viewsets with it.
@@ -9,5 +9,7 @@ router.register(r'post', views.PostViewSet)
 # The API URLs are now determined automatically by the router.
 # Additionally, we include the login URLs for the browsable API.
 urlpatterns = [
+    # Before the router, which would take events for the id of a post
+    url(r'^post/events/$', events.post_events, name='post-events'),
     url(r'^', include(router.urls)),
 ]
\ No newline at end of file
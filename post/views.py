@@ -1,26 +1,204 @@
+from hashlib import md5
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
 from rest_framework.response import Response
+from accounts.throttling import BulkPostThrottle, PostThrottle
+from post.cache import get_wall_cache
 from post.models import Post
-from post.serializers import PostSerializer
+from post.signals import posts_created, posts_deleted, posts_updated
+from post.serializers import PostRowSerializer, PostSerializer
+from post.export import iter_ndjson, parse_after
+from post.filters import filter_posts, parse_posted_at
+from post.pagination import WallPagination
+from post.rendering import render_post_fragment, render_posts
+from post.search import search_posts
+from WallApp.routers import primary_reads, replicas_allowed
+from WallApp.sparse_fields import SparseFieldsMixin
 from post.permissions import IsOwnerOrReadOnly, IsOwnerOrAdmin
 from rest_framework import viewsets, status
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import PermissionDenied, ValidationError
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """
     Viewset for posts
     """
-    queryset = Post.objects.all()
+    # Load each post's author in the same query, the serializer needs its username
+    queryset = Post.objects.visible().select_related('author')
     serializer_class = PostSerializer
+    pagination_class = WallPagination
 
     # The default will be that anyone can read a post, but only owners can change it
     permission_classes = (IsOwnerOrReadOnly,)
 
+    # The most posts that can be created with one request to bulk
+    bulk_max_size = 1000
+
+    # Whether the response was read from the primary even though the request may read from replicas
+    read_from_primary = False
+
+    def get_throttles(self):
+        # Creating posts is throttled, reading them isn't
+        if self.action == 'create':
+            return [PostThrottle()]
+        if self.action == 'bulk':
+            return [BulkPostThrottle()]
+        return super(PostViewSet, self).get_throttles()
+
     def get_permissions(self):
         # Both owners and admins can destroy a post, so if we're destroying we change permissions
         if self.action in ('destroy',):
             self.permission_classes = [IsOwnerOrAdmin, ]
         return super(self.__class__, self).get_permissions()
 
+    def get_serializer_class(self):
+        if self.use_rows():
+            return PostRowSerializer
+        return super(PostViewSet, self).get_serializer_class()
+
+    def use_rows(self):
+        """
+        Reading posts as JSON goes through PostRows and PostRowSerializer, which skip building model instances
+
+        The browsable API needs model instances for its forms, so it gets them
+        """
+        return (self.action in ('list', 'retrieve') and
+                getattr(self.request, 'accepted_renderer', None) is not None and
+                self.request.accepted_renderer.format == 'json')
+
+    def use_fragments(self):
+        """
+        Whole pages of the wall as JSON are put together from the JSON stored with each post, see Post.rendered
+        """
+        return self.action in ('list',) and self.use_rows() and self.get_sparse_fields() is None
+
+    def get_queryset(self):
+        queryset = super(PostViewSet, self).get_queryset()
+        # The wall can be narrowed down to an author and a time range
+        if self.action in ('list',):
+            queryset = filter_posts(queryset, self.request.query_params)
+            # and searched, which puts the best matches first
+            if self.request.query_params.get('q'):
+                queryset = search_posts(queryset, self.request.query_params['q'])
+        fields = self.get_sparse_fields()
+        # Only the author's username is shown, so there is no need to join it if that isn't
+        if fields is not None and 'author' not in fields:
+            queryset = queryset.select_related(None)
+        if self.use_fragments():
+            queryset = queryset.fragments()
+        elif self.use_rows():
+            queryset = queryset.rows(fields)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.get_not_modified_response(request)
+        if not_modified is not None:
+            return not_modified
+
+        key = self.get_cache_key(request)
+        if key is None and not self.use_fragments():
+            return super(PostViewSet, self).list(request, *args, **kwargs)
+
+        cache = get_wall_cache()
+        if key is None:
+            page = (self.render_page(request, *args, **kwargs), request.accepted_media_type)
+        else:
+            page = cache.get(key)
+            if page is None:
+                # Pages kept for everyone are read from the primary. A replica that hasn't caught up yet would
+                # have the page cached under the new version, and served until the next change.
+                with primary_reads():
+                    page = (self.render_page(request, *args, **kwargs), request.accepted_media_type)
+                cache.set(key, page)
+            self.read_from_primary = True
+
+        content, content_type = page
+        return HttpResponse(content, content_type=content_type)
+
+    def render_page(self, request, *args, **kwargs):
+        """
+        Return the content of this page of the wall, as the accepted renderer renders it
+        """
+        if not self.use_fragments():
+            response = super(PostViewSet, self).list(request, *args, **kwargs)
+            return request.accepted_renderer.render(response.data, request.accepted_media_type,
+                                                    self.get_renderer_context())
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return render_posts(queryset)
+        # Render the pagination's envelope without the posts, and add them as its last key, where the
+        # paginators put them
+        data = self.get_paginated_response([]).data
+        data.pop('results')
+        envelope = request.accepted_renderer.render(data, request.accepted_media_type, self.get_renderer_context())
+        return envelope[:-1] + (b',' if data else b'') + b'"results":' + render_posts(page) + b'}'
+
+    def retrieve(self, request, *args, **kwargs):
+        # Look the post up first, a post that is gone is a 404 whatever the client has
+        instance = self.get_object()
+        not_modified = self.get_not_modified_response(request)
+        if not_modified is not None:
+            return not_modified
+        return Response(self.get_serializer(instance).data)
+
+    def get_etag(self, request):
+        """
+        Return the ETag of the posts as they are now
+
+        Every change to a post bumps the wall version, so the version stands in for the posts themselves
+        without reading or rendering any of them. There is no Last-Modified, its one second resolution would
+        miss a second change made within the same second.
+        """
+        if not hasattr(self, '_etag'):
+            media_type = md5(request.accepted_media_type.encode('utf-8')).hexdigest()[:8]
+            self._etag = quote_etag('{}-{}'.format(get_wall_cache().get_version(), media_type))
+        return self._etag
+
+    def get_not_modified_response(self, request):
+        """
+        Return a 304 response if the client already has the posts it is asking for, otherwise None
+        """
+        return get_conditional_response(request, etag=self.get_etag(request))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(PostViewSet, self).finalize_response(request, response, *args, **kwargs)
+        if self.action in ('list', 'retrieve') and response.status_code in (200, 304):
+            # Posts read from a replica may be from before the current version, so they don't get its ETag
+            if response.status_code == 304 or self.read_from_primary or not replicas_allowed():
+                response['ETag'] = self.get_etag(request)
+
+            # Posts look the same to everyone, but only anonymous responses may be shared by proxies
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, public=True, max_age=settings.WALL_CACHE['MAX_AGE'])
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def get_cache_key(self, request):
+        """
+        Return the key this page of the wall is cached under, or None if it should not be cached
+        """
+        # Only JSON is cached, the browsable API shows who is logged in
+        if request.accepted_renderer.format != 'json':
+            return None
+
+        # Pages far down the wall are rarely asked for twice
+        if not self.paginator.use_cursor(request):
+            page = request.query_params.get(self.paginator.page_query_param, '1')
+            if not page.isdigit() or int(page) > settings.WALL_CACHE['PAGES']:
+                return None
+
+        # The version has to be read before the page is, so a change made while rendering it is never missed
+        return get_wall_cache().make_key(self.get_etag(request),
+                                         request.accepted_media_type + request.build_absolute_uri())
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -35,4 +213,145 @@ class PostViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
\ No newline at end of file
+        serializer.save(author=self.request.user)
+
+    def update(self, request, *args, **kwargs):
+        """
+        Edit a post with one UPDATE that only matches the post if it belongs to the user
+
+        Checking ownership in the same statement as the write means the post is never loaded just to look
+        at its author, and it can't change hands between the check and the write. Its posted_at is read
+        first, filtered the same way, to render the JSON stored with it.
+        """
+        partial = kwargs.pop('partial', False)
+        pk = self.get_lookup_value()
+        # Only owners can edit a post
+        posts = self.get_owned_posts(pk, allow_staff=False)
+        instance = posts.only('posted_at', 'text').first()
+        if instance is None:
+            self.permission_denied_or_not_found(pk)
+
+        # Like the permission checks, a 403 or 404 comes before any complaint about the data
+        serializer = self.get_serializer(data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data:
+            for name, value in serializer.validated_data.items():
+                setattr(instance, name, value)
+            # An UPDATE doesn't go through save(), so the post's stored JSON is rendered here
+            instance.rendered = render_post_fragment(instance.posted_at, instance.text)
+            if not posts.update(rendered=instance.rendered, **serializer.validated_data):
+                # Deleted since we read it
+                raise Http404
+        posts_updated.send(sender=Post, pks=[pk])
+
+        instance.author = request.user
+        return Response(self.get_serializer(instance).data)
+
+    def destroy(self, request, *args, **kwargs):
+        """
+        Delete a post with one DELETE that only matches the post if it belongs to the user (or the user is an admin)
+        """
+        pk = self.get_lookup_value()
+        # Both owners and admins can destroy a post
+        posts = self.get_owned_posts(pk, allow_staff=True)
+        # Users can only match their own post, an admin may be deleting someone else's
+        if request.user.is_staff:
+            author_ids = list(posts.values_list('author_id', flat=True))
+        else:
+            author_ids = [request.user.pk]
+        deleted = posts.fast_delete()
+        if not deleted:
+            self.permission_denied_or_not_found(pk)
+        posts_deleted.send(sender=Post, pks=[pk], author_ids=author_ids)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @list_route(methods=['get'])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream every post as newline delimited JSON, oldest first
+
+        Takes the same author, since and until parameters as the wall, and after=<posted_at>,<id>
+        to pick up where an interrupted export left off
+        """
+        # Check the parameters now, errors can't be reported once the response has started
+        params = request.query_params
+        for name in ('since', 'until'):
+            if params.get(name) is not None:
+                parse_posted_at(name, params[name])
+        if params.get('after'):
+            parse_after(params['after'])
+
+        response = StreamingHttpResponse(iter_ndjson(params), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="posts.ndjson"'
+        return response
+
+    def perform_content_negotiation(self, request, force=False):
+        # The export is always newline delimited JSON, whatever the client asks for
+        if self.action in ('export',):
+            force = True
+        return super(PostViewSet, self).perform_content_negotiation(request, force)
+
+    def get_lookup_value(self):
+        """
+        Return the primary key of the post named in the URL
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return Post._meta.pk.to_python(self.kwargs[lookup_url_kwarg])
+        except DjangoValidationError:
+            raise Http404
+
+    def get_owned_posts(self, pk, allow_staff):
+        """
+        Return a queryset matching the post with this primary key, but only if the user may change it
+        """
+        # Anonymous users get a 401, as they do from the permission classes
+        if not self.request.user.is_authenticated:
+            self.permission_denied(self.request)
+        posts = Post.objects.filter(pk=pk)
+        if allow_staff and self.request.user.is_staff:
+            return posts
+        return posts.filter(author=self.request.user)
+
+    def permission_denied_or_not_found(self, pk):
+        """
+        Explain why a write to a post didn't match anything, with a 403 if it exists and a 404 if it doesn't
+        """
+        if Post.objects.filter(pk=pk).exists():
+            self.permission_denied(self.request)
+        raise Http404
+
+    @list_route(methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create many posts at once from a JSON array of posts
+
+        Either every post is created or, if any of them is invalid, none are and the response lists
+        the errors for each post in order
+        """
+        # Only authenticated users can create posts
+        if not request.user.is_authenticated:
+            raise PermissionDenied('Cannot post anonymously')
+
+        if isinstance(request.data, list) and len(request.data) > self.bulk_max_size:
+            raise ValidationError('Cannot create more than {} posts at once'.format(self.bulk_max_size))
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        posts = self.perform_bulk_create(serializer)
+
+        return Response(self.get_serializer(posts, many=True).data, status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, serializer):
+        posts = [Post(author=self.request.user, **data) for data in serializer.validated_data]
+        with transaction.atomic():
+            Post.objects.bulk_create(posts)
+            if posts and posts[0].pk is None:
+                # SQLite doesn't say which ids it gave rows inserted in bulk. It gives each new row the next id
+                # after the highest one, and nothing else can write until this transaction commits, so the
+                # new posts are the ones with the highest ids.
+                pks = Post.objects.order_by('-pk').values_list('pk', flat=True)[:len(posts)]
+                for post, pk in zip(posts, reversed(list(pks))):
+                    post.pk = pk
+            posts_created.send(sender=Post, posts=posts)
+        return posts